@@ -14,6 +14,8 @@ urlpatterns = patterns(__package__ + '.api_views',
 
     url(r'^version$', 'get_kalite_version', {}, 'get_kalite_version'),
 
+    url(r'^export/jobs/$', 'export_job_progress', {}, 'export_job_progress'),
+
     # Zone TastyPie endpoint
     url(r'^export/', include(ZoneResource().urls)),
     url(r'^', include(VideoLogResource().urls)),
@@ -12,7 +12,7 @@ from django.http import HttpResponse, Http404
 from django.utils.translation import ugettext as _
 
 import kalite.version  # for kalite software version
-from .models import Organization
+from .models import ExportJob, Organization
 from fle_utils.internet.classes import JsonResponse, JsonResponseMessageError, JsonResponseMessageSuccess
 from fle_utils.internet.decorators import allow_jsonp, api_handle_error_with_json, api_response_causes_reload
 from kalite.shared.decorators.auth import require_authorized_admin
@@ -35,6 +35,30 @@ def delete_zone(request, zone_id):
     return JsonResponseMessageSuccess(_("You have successfully deleted Zone %(zone_name)s") % {"zone_name": zone.name})
 
 
+@require_authorized_admin
+@api_handle_error_with_json
+def export_job_progress(request):
+    """
+    Returns the state and progress of the export jobs of an organization,
+    polled by the export page.
+    """
+    # require_authorized_admin only checks an org_id of the url
+    try:
+        org = Organization.objects.get(pk=request.GET.get("org_id", ""))
+    except (Organization.DoesNotExist, ValueError):
+        return JsonResponseMessageError(_("Organization not found."), status=404)
+    if not (request.user.is_superuser or org.is_member(request.user)):
+        return JsonResponseMessageError(_("You are not a member of this organization."), status=403)
+
+    jobs = ExportJob.objects.filter(organization=org)
+    job_ids = [job_id for job_id in request.GET.get("ids", "").split(",") if job_id.isdigit()]
+    if job_ids:
+        jobs = jobs.filter(id__in=job_ids)
+    return JsonResponse({
+        "jobs": [job.get_progress() for job in jobs],
+    })
+
+
 @allow_jsonp
 @api_handle_error_with_json
 def get_kalite_version(request):
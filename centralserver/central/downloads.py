@@ -0,0 +1,146 @@
+"""
+Serving of large files from disk: conditional requests, byte ranges, and
+handing the transfer over to the front-end web server.
+"""
+import os
+import re
+import urllib
+
+from django.core.servers.basehttp import FileWrapper
+from django.http import HttpResponse, HttpResponseNotModified
+from django.http.response import StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+
+# Bytes read from a file per chunk when Django streams it itself
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_etag(stat):
+    return '"{mtime:x}-{size:x}"'.format(mtime=int(stat.st_mtime), size=stat.st_size)
+
+
+def is_not_modified(request, etag, mtime):
+    """
+    Returns True when the client's cached copy, as identified by the
+    If-None-Match or If-Modified-Since headers, is still current.
+    """
+    if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+    if if_none_match is not None:
+        return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+    modified_since = parse_http_date_safe(request.META.get("HTTP_IF_MODIFIED_SINCE", ""))
+    return modified_since is not None and int(mtime) <= modified_since
+
+
+def parse_range(request, size, etag, last_modified):
+    """
+    Returns the (first, last) byte positions of the range requested, or None
+    to send the whole file. Only single ranges are supported; anything else
+    is answered with the whole file, which HTTP allows.
+    """
+    header = request.META.get("HTTP_RANGE", "")
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+
+    # A range is only valid for the version of the file the client has
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range and if_range != etag and if_range != last_modified:
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            raise RangeNotSatisfiable()
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable()
+    return first, last
+
+
+def iter_file_range(f, first, last, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Yields the bytes from position first to last of file f, and closes it
+    """
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def serve_file(request, path, content_type, sendfile=None, sendfile_root=None, accel_prefix=None):
+    """
+    Returns a response for the file at path, answering conditional, range
+    and HEAD requests.
+
+    sendfile hands the transfer to the front-end web server, so that no
+    Django worker is kept busy by it:
+      "x-accel-redirect": nginx, serving sendfile_root from the internal
+          location accel_prefix
+      "x-sendfile": Apache with mod_xsendfile, lighttpd
+    The web server then handles range requests itself.
+    """
+    stat = os.stat(path)
+    etag = get_etag(stat)
+    last_modified = http_date(stat.st_mtime)
+
+    if is_not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+
+    elif sendfile == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        relative_path = os.path.relpath(path, sendfile_root).replace(os.sep, "/")
+        response["X-Accel-Redirect"] = urllib.quote(accel_prefix.rstrip("/") + "/" + relative_path)
+
+    elif sendfile == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+
+    else:
+        try:
+            byte_range = parse_range(request, stat.st_size, etag, last_modified)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */{size}".format(size=stat.st_size)
+            return response
+
+        first, last = byte_range or (0, stat.st_size - 1)
+        if request.method == "HEAD":
+            # The headers only, without opening the file
+            response = HttpResponse(content_type=content_type, status=206 if byte_range else 200)
+        elif byte_range:
+            response = StreamingHttpResponse(
+                iter_file_range(open(path, "rb"), first, last),
+                status=206,
+                content_type=content_type,
+            )
+        else:
+            response = StreamingHttpResponse(
+                FileWrapper(open(path, "rb"), DOWNLOAD_CHUNK_SIZE),
+                content_type=content_type,
+            )
+        if byte_range:
+            response["Content-Range"] = "bytes {first}-{last}/{size}".format(first=first, last=last, size=stat.st_size)
+        response["Content-Length"] = last - first + 1
+
+    response["ETag"] = etag
+    response["Last-Modified"] = last_modified
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -75,11 +75,27 @@ class ExportForm(forms.ModelForm):
             ).distinct()
 
     def save(self, *args, **kwargs):
+        """
+        Returns the job for the requested export. Identical requests reuse
+        a pending or recently completed job, which is flagged by setting
+        self.reused.
+        """
         job = super(ExportForm, self).save(commit=False)
         job.organization = self.organization
+        reusable = ExportJob.get_reusable(
+            organization=job.organization,
+            zone=job.zone,
+            facility=job.facility,
+            facility_group=job.facility_group,
+            resource=job.resource,
+            incremental=job.incremental,
+        )
+        self.reused = bool(reusable)
+        if reusable:
+            return reusable
         job.save()
         return job
 
     class Meta:
         model = ExportJob
-        fields = ('zone', 'facility', 'facility_group', 'resource')
+        fields = ('zone', 'facility', 'facility_group', 'resource', 'incremental')
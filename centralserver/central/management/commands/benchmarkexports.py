@@ -0,0 +1,215 @@
+"""
+Benchmarks export jobs of each resource and scope, for instance on a dataset
+made by the generatedataset command, and writes the results to a JSON file
+that can be compared between commits.
+"""
+import json
+import logging
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
+import time
+import traceback
+from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from centralserver.central.models import ExportJob, Organization
+from kalite.facility.models import Facility, FacilityGroup
+
+
+logger = logging.getLogger(__name__)
+
+RESOURCES = ['user_logs', 'attempt_logs', 'exercise_logs', 'ratings', 'device_logs']
+SCOPES = ['organization', 'zone', 'facility', 'facility_group']
+
+
+def get_scopes(organization):
+    """
+    Returns a dict of ExportJob keyword arguments per scope: the organization,
+    and its first zone, first facility in that zone and that facility's
+    first group.
+    """
+    scopes = {'organization': {}}
+    zones = list(organization.zones.order_by('id')[:1])
+    if zones:
+        zone = zones[0]
+        scopes['zone'] = {'zone': zone}
+        facilities = list(Facility.objects.by_zone(zone).order_by('id')[:1])
+        if facilities:
+            scopes['facility'] = {'zone': zone, 'facility': facilities[0]}
+            groups = list(FacilityGroup.objects.filter(facility=facilities[0]).order_by('id')[:1])
+            if groups:
+                scopes['facility_group'] = dict(scopes['facility'], facility_group=groups[0])
+    return scopes
+
+
+def run_benchmark(organization_id, resource, scope):
+    """
+    Runs an export job of the resource and scope, and returns its
+    measurements
+    """
+    organization = Organization.objects.get(id=organization_id)
+    job = ExportJob(organization=organization, resource=resource, **get_scopes(organization)[scope])
+    job.save()
+    try:
+        # Queries are only recorded with a debug cursor
+        connection.use_debug_cursor = True
+        reset_queries()
+        start = time.time()
+        job.run()
+        wall_time = time.time() - start
+        n_queries = len(connection.queries)
+    finally:
+        connection.use_debug_cursor = None
+        reset_queries()
+        ExportJob.objects.filter(id=job.id).delete()
+
+    return {
+        "resource": resource,
+        "scope": scope,
+        "rows": job.rows_written,
+        "wall_seconds": round(wall_time, 3),
+        "queries": n_queries,
+        "rows_per_second": round(job.rows_written / wall_time, 1) if wall_time else None,
+        # Of the whole process, which is forked for this run unless --no-fork
+        # is given. Children ran the shards.
+        "peak_rss_kb": max(getrusage(RUSAGE_SELF).ru_maxrss, getrusage(RUSAGE_CHILDREN).ru_maxrss),
+        "timings": json.loads(job.timings),
+    }
+
+
+def run_benchmark_process(queue, *args):
+    try:
+        queue.put(run_benchmark(*args))
+    except Exception:
+        queue.put({"error": traceback.format_exc()})
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=settings.PROJECT_PATH).strip()
+    except (OSError, subprocess.CalledProcessError, AttributeError):
+        return None
+
+
+class Command(BaseCommand):
+    args = "<results.json>"
+    help = (
+        "Runs an export job of each resource for the organization, zone, "
+        "facility and group scopes, and writes wall time, query count, "
+        "rows/sec and peak RSS of each to a JSON file."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option('-o', '--organization',
+            action='store',
+            dest='organization',
+            default=None,
+            help='Id of the organization to export, by default the one with most zones',
+        ),
+        make_option('-r', '--resources',
+            action='store',
+            dest='resources',
+            default=",".join(RESOURCES),
+            help='Comma separated resources to benchmark',
+        ),
+        make_option('-c', '--compare',
+            action='store',
+            dest='compare',
+            default=None,
+            help='Results file of an earlier run to compare with',
+        ),
+        make_option('--no-fork',
+            action='store_false',
+            dest='fork',
+            default=True,
+            help='Run all benchmarks in this process. Peak RSS is then that of all runs so far.',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Usage: benchmarkexports %s" % self.args)
+
+        if options['organization']:
+            organization = Organization.objects.get(id=options['organization'])
+        else:
+            organizations = sorted(Organization.objects.all(), key=lambda org: -org.zones.count())
+            if not organizations:
+                raise CommandError("There are no organizations, see the generatedataset command")
+            organization = organizations[0]
+
+        scopes = get_scopes(organization)
+        export_root = tempfile.mkdtemp()
+        results = []
+        try:
+            with override_settings(CSV_EXPORT_ROOT=export_root):
+                for resource in options['resources'].split(","):
+                    for scope in SCOPES:
+                        if scope not in scopes:
+                            continue
+                        result = self.run(organization.id, resource, scope, fork=options['fork'])
+                        logger.info("{resource} of {scope}: {rows} rows in {wall_seconds}s, {queries} queries".format(**result))
+                        results.append(result)
+        finally:
+            shutil.rmtree(export_root)
+
+        with open(args[0], "w") as f:
+            json.dump({
+                "commit": get_commit(),
+                "created": timezone.now().isoformat(),
+                "organization": organization.id,
+                "results": results,
+            }, f, indent=2)
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def run(self, organization_id, resource, scope, fork=True):
+        """
+        Runs a benchmark, by default in a process of its own so that its
+        peak RSS is not that of an earlier run
+        """
+        if not fork:
+            return run_benchmark(organization_id, resource, scope)
+
+        # The process must not share the database connection of this one
+        connection.close()
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_benchmark_process, args=(queue, organization_id, resource, scope))
+        process.start()
+        result = queue.get()
+        process.join()
+        if "error" in result:
+            raise CommandError("Benchmark of {resource} of {scope} failed:\n{error}".format(resource=resource, scope=scope, error=result["error"]))
+        return result
+
+    def compare(self, path, results):
+        """
+        Writes the change in wall time and queries of each benchmark, relative
+        to those of an earlier results file
+        """
+        with open(path) as f:
+            earlier = dict(
+                ((result["resource"], result["scope"]), result)
+                for result in json.load(f)["results"]
+            )
+        for result in results:
+            before = earlier.get((result["resource"], result["scope"]))
+            if not before:
+                continue
+            self.stdout.write("{resource:15} {scope:15} {wall_before:>9.3f}s -> {wall_after:>9.3f}s  {queries_before:>6} -> {queries_after:>6} queries\n".format(
+                resource=result["resource"],
+                scope=result["scope"],
+                wall_before=before["wall_seconds"],
+                wall_after=result["wall_seconds"],
+                queries_before=before["queries"],
+                queries_after=result["queries"],
+            ))
@@ -0,0 +1,36 @@
+"""
+"""
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from centralserver.central.models import ExportJob, EXPORT_ORG_QUOTA_BYTES, EXPORT_QUOTA_BYTES
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes the least recently downloaded export files until the exports "
+        "are within EXPORT_QUOTA_BYTES in total and EXPORT_ORG_QUOTA_BYTES per "
+        "organization."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option('-d', '--dry-run',
+            action='store_true',
+            dest='dryrun',
+            help='only list the files that would be deleted',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if EXPORT_QUOTA_BYTES is None and EXPORT_ORG_QUOTA_BYTES is None:
+            logger.info("No export quotas are set, nothing to do")
+            return
+
+        evicted = ExportJob.enforce_quotas(dry_run=options.get('dryrun', False))
+        for job in evicted:
+            self.stdout.write("{id}\t{path}\n".format(id=job.id, path=job.get_file_path()))
+        logger.info("Evicted {n} export files".format(n=len(evicted)))
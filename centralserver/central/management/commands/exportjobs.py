@@ -1,18 +1,82 @@
 """
 """
 import logging
+import multiprocessing
+import os
+import socket
+import time
 from optparse import make_option
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from centralserver.central.models import ExportJob
+from django.db import connection
+from centralserver.central.models import ExportJob, ExportJobLeaseLost
 from django.utils import timezone
 
 
 logger = logging.getLogger(__name__)
 
+# Seconds a daemon waits before polling an empty queue again. The wait is
+# doubled after each poll that finds nothing, up to the maximum.
+EXPORT_DAEMON_MIN_POLL = getattr(settings, "EXPORT_DAEMON_MIN_POLL", 2)
+EXPORT_DAEMON_MAX_POLL = getattr(settings, "EXPORT_DAEMON_MAX_POLL", 60)
+
+
+def get_worker_name():
+    return "{host}:{pid}".format(host=socket.gethostname(), pid=os.getpid())
+
+
+def process_jobs(daemon=False):
+    """
+    Claims and runs jobs until the queue is empty, or forever as a daemon.
+    Any number of these can run at the same time, in this or other
+    processes or on other hosts.
+    """
+    worker = get_worker_name()
+    poll_interval = EXPORT_DAEMON_MIN_POLL
+
+    while True:
+        # Jobs are claimed in the order of ExportJob.schedule()
+        ExportJob.estimate_pending()
+        job = ExportJob.claim_next(worker)
+        if not job and daemon:
+            # Closing the connection ends its transaction, so that the next
+            # poll sees jobs created in the meantime. Django reconnects.
+            connection.close()
+            time.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, EXPORT_DAEMON_MAX_POLL)
+            continue
+        if not job:
+            logger.info("No more jobs in queue ({worker})".format(worker=worker))
+            break
+        poll_interval = EXPORT_DAEMON_MIN_POLL
+
+        logger.info("Processing Job ID {id} ({worker})".format(id=job.id, worker=worker))
+        try:
+            # Marks the job completed once done
+            job.run()
+        except ExportJobLeaseLost as e:
+            logger.warning(str(e))
+        except Exception:
+            logger.exception("Export job {id} failed, attempt {n}".format(id=job.id, n=job.attempts))
+            try:
+                job.mark_failed()
+            except Exception:
+                # The job is attempted again once its lease has expired
+                logger.exception("Could not release export job {id}".format(id=job.id))
+
+        # Make room for the next jobs
+        try:
+            ExportJob.enforce_quotas()
+        except Exception:
+            logger.exception("Could not enforce the export disk quotas")
+
 
 class Command(BaseCommand):
-    help = "Runs pending and non-started export jobs."
+    help = (
+        "Runs pending and non-started export jobs. Small jobs are run first, "
+        "so with several --workers they don't wait for large ones to finish."
+    )
 
     option_list = BaseCommand.option_list + (
         make_option('-d', '--dry-run',
@@ -25,24 +89,69 @@ class Command(BaseCommand):
             dest='resetall',
             help='Resets all jobs (reruns everything!)',
         ),
+        make_option('-w', '--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=1,
+            help='Number of worker processes running jobs in parallel',
+        ),
+        make_option('-D', '--daemon',
+            action='store_true',
+            dest='daemon',
+            help='Keep polling for new jobs instead of exiting once the queue is empty',
+        ),
     )
 
     def handle(self, *args, **options):
         logger.info("Processing pending, non-started export jobs at {}".format(timezone.now()))
-        
+
+        if options['resetall']:
+            ExportJob.objects.all().update(
+                started=None,
+                completed=None,
+                worker="",
+                heartbeat=None,
+                attempts=0,
+                failed=None,
+                rows_written=0,
+                rows_estimated=None,
+                estimating=None,
+                evicted=None,
+            )
+
+        daemon = options.get('daemon', False)
+        if options.get('dryrun', False):
+            self.dry_run()
+        elif options['workers'] <= 1:
+            process_jobs(daemon=daemon)
+        else:
+            # Worker processes must not share the database connection of the
+            # parent, so close it and have each open their own.
+            connection.close()
+            workers = [
+                multiprocessing.Process(target=process_jobs, kwargs={"daemon": daemon})
+                for __ in range(options['workers'])
+            ]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+
+    def dry_run(self):
+        """
+        Runs all pending jobs without claiming them or storing their state
+        """
         # This maintains state when using --dry-run
         last_id = 0
-        
-        if options['resetall']:
-            ExportJob.objects.all().update(started=None, completed=None)
-        
+
         while True:
             next_job = ExportJob.objects.filter(
                 completed=None,
                 started=None,
                 id__gt=last_id,
             ).order_by('id')
-    
+
             if next_job.count() == 0:
                 logger.info("No more jobs in queue")
                 break
@@ -51,12 +160,4 @@ class Command(BaseCommand):
             last_id = job.id
             logger.info("Processing Job ID {}".format(job.id))
 
-            if not options.get('dryrun', False):
-                job.started = timezone.now()
-                job.save()
-            
             job.run()
-            
-            if not options.get('dryrun', False):
-                job.completed = timezone.now()
-                job.save()
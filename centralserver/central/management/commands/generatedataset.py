@@ -0,0 +1,307 @@
+"""
+Generates a synthetic central server dataset of a configurable size, for
+benchmarking exports, the deployments CMS and stats against realistic
+amounts of data.
+"""
+import datetime
+import itertools
+import logging
+import random
+import uuid
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from centralserver.central.models import Organization
+from kalite.facility.models import Facility, FacilityGroup, FacilityUser
+from kalite.main.content_rating_models import ContentRating
+from kalite.main.models import AttemptLog, ExerciseLog
+from securesync.models import Device, DeviceZone, SyncSession, Zone
+
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_TYPES = ["exercise", "playlist", "exercise_fixedblock", "playlist_fixedblock"]
+LANGUAGES = ["en", "es-ES", "pt-BR", "hi", "sw"]
+
+
+def bulk_create_in_batches(model, objects, batch_size):
+    """
+    Inserts the objects, which may be a generator, with one bulk_create() per
+    batch_size objects. Returns the number of objects inserted.
+    """
+    objects = iter(objects)
+    n_objects = 0
+    while True:
+        batch = list(itertools.islice(objects, batch_size))
+        if not batch:
+            break
+        model.objects.bulk_create(batch)
+        n_objects += len(batch)
+    logger.info("Created {n} {model} objects".format(n=n_objects, model=model.__name__))
+    return n_objects
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates organizations, zones, devices, facilities, users and their "
+        "logs with bulk inserts. The same --seed generates the same data."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option('--seed', action='store', type='int', dest='seed', default=0,
+            help='Seed of the random generator'),
+        make_option('--organizations', action='store', type='int', dest='organizations', default=2,
+            help='Number of organizations'),
+        make_option('--zones', action='store', type='int', dest='zones', default=2,
+            help='Number of zones per organization'),
+        make_option('--devices', action='store', type='int', dest='devices', default=3,
+            help='Number of devices per zone'),
+        make_option('--facilities', action='store', type='int', dest='facilities', default=3,
+            help='Number of facilities per zone'),
+        make_option('--groups', action='store', type='int', dest='groups', default=2,
+            help='Number of groups per facility'),
+        make_option('--users', action='store', type='int', dest='users', default=30,
+            help='Number of users per facility'),
+        make_option('--exercises', action='store', type='int', dest='exercises', default=20,
+            help='Number of exercise logs per user'),
+        make_option('--attempts', action='store', type='int', dest='attempts', default=10,
+            help='Number of attempt logs per exercise log'),
+        make_option('--ratings', action='store', type='int', dest='ratings', default=2,
+            help='Number of content ratings per user'),
+        make_option('--sync-sessions', action='store', type='int', dest='sync_sessions', default=20,
+            help='Number of sync sessions per device'),
+        make_option('--days', action='store', type='int', dest='days', default=365,
+            help='Number of days the activity is spread over, up to now'),
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+            help='Number of objects inserted per query'),
+    )
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.end = timezone.now()
+        self.exercise_ids = ["exercise_%04d" % n for n in range(max(500, options['exercises']))]
+        self.video_ids = ["video_%04d" % n for n in range(max(500, options['ratings']))]
+        # Ids of the devices signing everything in a zone
+        self.zone_devices = {}
+
+        orgs = self.create_organizations()
+        zones = self.create_zones(orgs)
+        self.create_devices(zones)
+        self.create_sync_sessions()
+        facility_users = self.create_facilities_and_users(zones)
+        self.create_logs(facility_users)
+
+    def get_uuid(self):
+        return uuid.UUID(int=self.random.getrandbits(128)).hex
+
+    def get_timestamp(self):
+        return self.end - datetime.timedelta(seconds=self.random.randint(0, self.options['days'] * 24 * 3600))
+
+    def synced_fields(self, zone):
+        """
+        Fields of a SyncedModel signed by one of the zone's devices. Models
+        are not actually signed, which would take far too long.
+        """
+        return {
+            "id": self.get_uuid(),
+            "signed_by_id": self.random.choice(self.zone_devices[zone.id]),
+            "zone_fallback_id": zone.id,
+            "counter": self.random.randint(1, 10 ** 6),
+        }
+
+    def create_organizations(self):
+        # Saved one by one, as bulk_create() does not set auto-incremented
+        # primary keys. There are few organizations anyway.
+        owner, created = User.objects.get_or_create(username="benchmark-owner")
+        if created:
+            owner.set_unusable_password()
+            owner.save()
+        orgs = []
+        for n in range(self.options['organizations']):
+            org = Organization(name="Benchmark organization %d" % n)
+            org.save(owner=owner)
+            org.users.add(owner)
+            orgs.append(org)
+        return orgs
+
+    def create_zones(self, orgs):
+        zones = []
+        org_zones = []
+        for org in orgs:
+            for n in range(self.options['zones']):
+                zone = Zone(id=self.get_uuid(), name="%s zone %d" % (org.name, n))
+                zones.append(zone)
+                org_zones.append(Organization.zones.through(organization_id=org.id, zone_id=zone.id))
+        bulk_create_in_batches(Zone, zones, self.batch_size)
+        bulk_create_in_batches(Organization.zones.through, org_zones, self.batch_size)
+        return zones
+
+    def create_devices(self, zones):
+        devices = []
+        device_zones = []
+        for zone in zones:
+            self.zone_devices[zone.id] = []
+            for n in range(self.options['devices']):
+                device = Device(
+                    id=self.get_uuid(),
+                    name="%s device %d" % (zone.name, n),
+                    public_key=self.get_uuid(),
+                    version=self.random.choice(["0.13.0", "0.14.0", "0.15.1", "0.16.9", "0.17.4"]),
+                )
+                devices.append(device)
+                self.zone_devices[zone.id].append(device.id)
+                device_zones.append(DeviceZone(id=self.get_uuid(), device_id=device.id, zone_id=zone.id))
+        bulk_create_in_batches(Device, devices, self.batch_size)
+        bulk_create_in_batches(DeviceZone, device_zones, self.batch_size)
+
+    def create_sync_sessions(self):
+        def sync_sessions():
+            for device_ids in self.zone_devices.values():
+                for device_id in device_ids:
+                    for __ in range(self.options['sync_sessions']):
+                        yield SyncSession(
+                            client_nonce=self.get_uuid(),
+                            client_device_id=device_id,
+                            server_nonce=self.get_uuid(),
+                            verified=True,
+                            client_version="0.17.4",
+                            timestamp=self.get_timestamp(),
+                            models_uploaded=self.random.randint(0, 5000),
+                            models_downloaded=self.random.randint(0, 50),
+                            closed=True,
+                        )
+
+        # Sync session timestamps are set on save otherwise, to now
+        timestamp_field = SyncSession._meta.get_field("timestamp")
+        timestamp_field.auto_now = False
+        try:
+            bulk_create_in_batches(SyncSession, sync_sessions(), self.batch_size)
+        finally:
+            timestamp_field.auto_now = True
+
+    def create_facilities_and_users(self, zones):
+        """
+        Returns a list of (zone, user ids) per facility
+        """
+        facilities = []
+        groups = []
+        facility_users = []
+        for zone in zones:
+            for n in range(self.options['facilities']):
+                facility = Facility(
+                    name="%s facility %d" % (zone.name, n),
+                    latitude=self.random.uniform(-60, 70),
+                    longitude=self.random.uniform(-180, 180),
+                    user_count=self.options['users'],
+                    **self.synced_fields(zone)
+                )
+                facilities.append(facility)
+                facility_groups = [
+                    FacilityGroup(facility_id=facility.id, name="Group %d" % g, **self.synced_fields(zone))
+                    for g in range(self.options['groups'])
+                ]
+                groups.extend(facility_groups)
+                facility_users.append((zone, facility, facility_groups))
+        bulk_create_in_batches(Facility, facilities, self.batch_size)
+        bulk_create_in_batches(FacilityGroup, groups, self.batch_size)
+
+        user_ids = []
+
+        def users():
+            for zone, facility, facility_groups in facility_users:
+                ids = []
+                for n in range(self.options['users']):
+                    user = FacilityUser(
+                        facility_id=facility.id,
+                        group_id=self.random.choice(facility_groups).id if facility_groups else None,
+                        username="user%d" % n,
+                        first_name="First%d" % n,
+                        last_name="Last%d" % n,
+                        is_teacher=(n % 20 == 0),
+                        password="!",
+                        default_language=self.random.choice(LANGUAGES),
+                        **self.synced_fields(zone)
+                    )
+                    ids.append(user.id)
+                    yield user
+                user_ids.append((zone, ids))
+
+        bulk_create_in_batches(FacilityUser, users(), self.batch_size)
+        return user_ids
+
+    def create_logs(self, facility_users):
+        def exercise_and_attempt_logs():
+            for zone, user_ids in facility_users:
+                for user_id in user_ids:
+                    for exercise_id in self.random.sample(self.exercise_ids, self.options['exercises']):
+                        latest_activity = self.get_timestamp()
+                        complete = self.random.random() < 0.6
+                        yield ExerciseLog(
+                            user_id=user_id,
+                            exercise_id=exercise_id,
+                            streak_progress=100 if complete else self.random.randint(0, 90),
+                            attempts=self.options['attempts'],
+                            points=self.random.randint(0, 300),
+                            language="en",
+                            complete=complete,
+                            struggling=self.random.random() < 0.1,
+                            attempts_before_completion=self.options['attempts'] if complete else None,
+                            completion_timestamp=latest_activity if complete else None,
+                            latest_activity_timestamp=latest_activity,
+                            **self.synced_fields(zone)
+                        )
+                        for n in range(self.options['attempts']):
+                            correct = self.random.random() < 0.7
+                            yield AttemptLog(
+                                user_id=user_id,
+                                exercise_id=exercise_id,
+                                seed=self.random.randint(0, 10 ** 6),
+                                answer_given=str(self.random.randint(0, 100)),
+                                points=self.random.randint(0, 15) if correct else 0,
+                                correct=correct,
+                                complete=correct,
+                                context_type=self.random.choice(CONTEXT_TYPES),
+                                language="en",
+                                timestamp=latest_activity - datetime.timedelta(minutes=self.options['attempts'] - n),
+                                time_taken=self.random.randint(1000, 120000),
+                                assessment_item_id=self.get_uuid()[:12],
+                                **self.synced_fields(zone)
+                            )
+
+        def ratings():
+            for zone, user_ids in facility_users:
+                for user_id in user_ids:
+                    for content_id in self.random.sample(self.video_ids, self.options['ratings']):
+                        yield ContentRating(
+                            user_id=user_id,
+                            content_kind="Video",
+                            content_id=content_id,
+                            quality=self.random.randint(1, 5),
+                            difficulty=self.random.randint(1, 5),
+                            text=self.random.choice(["", "", "Great video", "Too fast"]),
+                            **self.synced_fields(zone)
+                        )
+
+        # Exercise and attempt logs are generated together, and inserted in
+        # batches of each
+        batches = {ExerciseLog: [], AttemptLog: []}
+        counts = {ExerciseLog: 0, AttemptLog: 0}
+        for log in exercise_and_attempt_logs():
+            batch = batches[type(log)]
+            batch.append(log)
+            if len(batch) >= self.batch_size:
+                type(log).objects.bulk_create(batch)
+                counts[type(log)] += len(batch)
+                del batch[:]
+        for model, batch in batches.items():
+            if batch:
+                model.objects.bulk_create(batch)
+                counts[model] += len(batch)
+            logger.info("Created {n} {model} objects".format(n=counts[model], model=model.__name__))
+
+        bulk_create_in_batches(ContentRating, ratings(), self.batch_size)
@@ -1,6 +1,14 @@
 import csv
+import datetime
+import gzip
+import itertools
+import json
 import logging
+import multiprocessing
 import os
+import shutil
+import time
+import uuid
 
 from fle_utils.collections_local_copy import OrderedDict
 
@@ -8,10 +16,11 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.exceptions import PermissionDenied
 from django.core.mail import send_mail
-from django.db import models
+from django.db import connection, models
 from django.template.loader import render_to_string
 from django.template import RequestContext
-from django.db.models import Q, Max, Min
+from django.db.models import F, Q, Count, Max, Min
+from django.utils import timezone
 
 from fle_utils.django_utils.classes import ExtendedModel
 from securesync.models import Zone
@@ -19,9 +28,8 @@ from kalite.facility.models import Facility, FacilityGroup, FacilityUser
 from kalite.main.models import AttemptLog, ExerciseLog
 from kalite.packages.bundled.fle_utils.general import ensure_dir
 from kalite.main.content_rating_models import ContentRating
-from kalite.topic_tools.content_models import get_content_item
+from kalite.topic_tools.content_models import get_content_items
 from securesync.devices.models import Device
-from securesync.engine.models import SyncSession
 
 
 logger = logging.getLogger(__name__)
@@ -221,6 +229,169 @@ class DeletionRecord(ExtendedModel):
     deleted_invite = models.ForeignKey(OrganizationInvitation, blank=True, null=True)
 
 
+# Number of rows fetched from the database per query while streaming an
+# export to disk. Memory use of an export job is bounded by this, not by the
+# size of the export.
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+
+
+# Exports are written gzip compressed. CSV data compresses very well even at
+# lower levels, which are much faster to write.
+EXPORT_COMPRESSLEVEL = getattr(settings, "EXPORT_COMPRESSLEVEL", 6)
+
+
+# Logs are exported for this many users at a time, see ExportJob.get_user_ids()
+EXPORT_USER_CHUNK_SIZE = getattr(settings, "EXPORT_USER_CHUNK_SIZE", 500)
+
+# Titles of content items, kept between export jobs run by the same process.
+# Least recently used titles are evicted once the cache is full.
+CONTENT_TITLE_CACHE_SIZE = getattr(settings, "CONTENT_TITLE_CACHE_SIZE", 20000)
+CONTENT_TITLE_CACHE = OrderedDict()
+
+# The content database is SQLite, which limits the number of query parameters
+CONTENT_TITLE_LOOKUP_BATCH_SIZE = 500
+
+
+def get_content_titles(content_ids):
+    """
+    Returns a dict mapping each of the given content ids to its title.
+
+    Ids missing from CONTENT_TITLE_CACHE are looked up with as few content
+    database queries as possible, instead of one get_content_item() call each.
+    Ids not found are not cached, as the content database may be updated.
+    """
+    titles = {}
+    missing_ids = []
+    for content_id in set(content_ids):
+        if content_id in CONTENT_TITLE_CACHE:
+            # Re-insert, to mark it as most recently used
+            titles[content_id] = CONTENT_TITLE_CACHE[content_id] = CONTENT_TITLE_CACHE.pop(content_id)
+        else:
+            missing_ids.append(content_id)
+
+    for i in range(0, len(missing_ids), CONTENT_TITLE_LOOKUP_BATCH_SIZE):
+        batch = missing_ids[i:i + CONTENT_TITLE_LOOKUP_BATCH_SIZE]
+        found = {}
+        for item in get_content_items(ids=batch) or []:
+            # Like get_content_item(), ignore topics sharing an id with content
+            if item.get("kind") == "Topic":
+                continue
+            found[item["id"]] = item.get("title", "Missing title")
+        for content_id in batch:
+            if content_id in found:
+                titles[content_id] = CONTENT_TITLE_CACHE[content_id] = found[content_id]
+            else:
+                titles[content_id] = "Unknown content"
+
+    while len(CONTENT_TITLE_CACHE) > CONTENT_TITLE_CACHE_SIZE:
+        CONTENT_TITLE_CACHE.popitem(last=False)
+
+    return titles
+
+
+def chunked_values_iterator(queryset, fields, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Iterate over the values of the given fields of all objects of a
+    queryset, as tuples, fetching at most chunk_size rows at a time.
+    Exports are made from these tuples, as constructing model instances
+    takes far longer than fetching the data.
+
+    QuerySet.iterator() is not enough: MySQLdb still buffers the whole result
+    set on the client. Instead, we page through the queryset ordered by
+    primary key, continuing each query after the last key seen.
+    """
+    # The primary key is fetched along, unless it is among the fields
+    pk_name = queryset.model._meta.pk.name
+    fields = list(fields)
+    if pk_name in fields:
+        pk_index, offset = fields.index(pk_name), 0
+    else:
+        fields.insert(0, pk_name)
+        pk_index, offset = 0, 1
+
+    queryset = queryset.order_by(pk_name).values_list(*fields)
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            break
+        for row in chunk:
+            yield row[offset:]
+        last_pk = chunk[-1][pk_index]
+
+
+# A worker running an export job renews its claim on the job (its heartbeat)
+# while writing rows. Jobs whose heartbeat is older than this are assumed to be
+# abandoned by a crashed worker, and can be claimed by another worker.
+EXPORT_JOB_LEASE_SECONDS = getattr(settings, "EXPORT_JOB_LEASE_SECONDS", 300)
+
+# A job is run this many times at most. Once its last attempt has failed, or
+# was abandoned by a crashed worker, it is marked failed and not run again.
+EXPORT_JOB_MAX_ATTEMPTS = getattr(settings, "EXPORT_JOB_MAX_ATTEMPTS", 3)
+
+
+# Pending export jobs are run shortest first, unless they have been waiting
+# for longer than this many seconds, see ExportJob.schedule()
+EXPORT_MAX_WAIT_SECONDS = getattr(settings, "EXPORT_MAX_WAIT_SECONDS", 60 * 60)
+
+# Large export jobs are split into shards of a facility each, which are run
+# by this many processes in parallel. 1 disables sharding.
+EXPORT_SHARD_PROCESSES = getattr(settings, "EXPORT_SHARD_PROCESSES", 1)
+# Jobs with fewer estimated rows are not worth sharding
+EXPORT_SHARD_MIN_ROWS = getattr(settings, "EXPORT_SHARD_MIN_ROWS", 1000000)
+
+# Bytes of export files kept on disk, in total and per organization. Files
+# least recently downloaded are deleted beyond that, see
+# ExportJob.enforce_quotas(). None means no limit.
+EXPORT_QUOTA_BYTES = getattr(settings, "EXPORT_QUOTA_BYTES", None)
+EXPORT_ORG_QUOTA_BYTES = getattr(settings, "EXPORT_ORG_QUOTA_BYTES", None)
+
+# Seconds between saving the progress of a running export job
+EXPORT_PROGRESS_INTERVAL = getattr(settings, "EXPORT_PROGRESS_INTERVAL", 5)
+
+# Seconds during which the file of a completed export job is handed out for
+# identical requests, instead of exporting the same data again
+EXPORT_REUSE_SECONDS = getattr(settings, "EXPORT_REUSE_SECONDS", 15 * 60)
+
+
+def get_memory_status():
+    """
+    Returns (current, peak) resident memory of this process in KB, read from
+    /proc/self/status, or None where that can't be read
+    """
+    try:
+        with open("/proc/self/status") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (IOError, KeyError, ValueError):
+        return None
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident memory of this process to its current resident
+    memory, so that the peak of a job can be told from that of the process.
+    Returns False where the kernel doesn't support that (before Linux 4.0).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except IOError:
+        return False
+
+
+class ExportJobLeaseLost(Exception):
+    """
+    Raised when a worker finds that its claim on an export job has been
+    taken over by another worker.
+    """
+    pass
+
+
 class ExportJob(models.Model):
 
     organization = models.ForeignKey(Organization)
@@ -244,112 +415,884 @@ class ExportJob(models.Model):
     started = models.DateTimeField(null=True, blank=True)
     completed = models.DateTimeField(null=True, blank=True)
 
-    def get_file_path(self):
+    incremental = models.BooleanField(
+        default=False,
+        help_text="Only fetch data that changed since the last export of the same data",
+    )
+
+    # Set by the worker that has claimed the job, see claim_next()
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+
+    # Number of times the job was claimed, and when it was given up on, see
+    # mark_failed()
+    attempts = models.PositiveIntegerField(default=0)
+    failed = models.DateTimeField(null=True, blank=True)
+
+    # Set when the file is downloaded, and when it is deleted to free disk
+    # space, see enforce_quotas()
+    last_downloaded = models.DateTimeField(null=True, blank=True)
+    evicted = models.DateTimeField(null=True, blank=True)
+
+    # Progress and statistics of the job, see run() and get_progress()
+    rows_written = models.PositiveIntegerField(default=0)
+    rows_estimated = models.PositiveIntegerField(null=True, blank=True)
+    # Set by the worker estimating the rows, see estimate_pending()
+    estimating = models.DateTimeField(null=True, blank=True)
+    peak_memory = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Growth of the resident memory of the worker process during the job, "
+                  "at its peak, in KB. Shard processes are not included.",
+    )
+    timings = models.TextField(
+        blank=True,
+        help_text="JSON object of the seconds spent in each phase of the export",
+    )
+
+    # Resources that can be exported incrementally, see get_incremental_rows()
+    INCREMENTAL_RESOURCES = ['attempt_logs', 'exercise_logs']
+
+    # AttemptLog context types of the two parts of an exercise
+    PART1_CONTEXT_TYPES = ["playlist", "exercise"]
+    PART2_CONTEXT_TYPES = ["exercise_fixedblock", "playlist_fixedblock"]
+
+    # Attempt statistics of an exercise log without any attempts
+    EMPTY_ATTEMPT_SUMMARY = {
+        "timestamp_first": None,
+        "timestamp_last": None,
+        "part1_answered": 0,
+        "part1_correct": 0,
+        "part2_attempted": 0,
+        "part2_correct": 0,
+    }
+    ATTEMPT_SUMMARY_COLUMNS = [
+        "timestamp_first",
+        "timestamp_last",
+        "part1_answered",
+        "part1_correct",
+        "part2_attempted",
+        "part2_correct",
+    ]
+
+    # Columns added to the rows of each log about its user, and the fields
+    # of the log's values_list() they are fetched by
+    USER_COLUMNS = [
+        "username",
+        "user_id",
+        "facility_name",
+        "facility_id",
+        "is_teacher",
+    ]
+    USER_FIELDS = [
+        "user__username",
+        "user",
+        "user__facility__name",
+        "user__facility",
+        "user__is_teacher",
+    ]
+
+    # Resources of which large jobs are split into shards, see get_shards()
+    SHARDED_RESOURCES = ['user_logs', 'attempt_logs', 'exercise_logs', 'ratings']
+
+    # Ids of the users in scope, see get_user_ids()
+    _user_ids = None
+
+    # Time progress was last saved, see report_progress()
+    _last_progress = 0
+
+    # Column order of the CSV file written for each resource
+    COLUMNS = {
+        'user_logs': [
+            "username",
+            "first_name",
+            "last_name",
+            "facility_name",
+            "default_language",
+            "is_teacher",
+            "facility_id",
+            "id",
+        ],
+        'attempt_logs': [
+            "exercise_id",
+            "seed",
+            "answer_given",
+            "points",
+            "correct",
+            "complete",
+            "context_type",
+            "context_id",
+            "language",
+            "timestamp",
+            "time_taken",
+            "assessment_item_id",
+        ] + USER_COLUMNS,
+        'exercise_logs': [
+            "exercise_id",
+            "streak_progress",
+            "attempts",
+            "points",
+            "language",
+            "complete",
+            "struggling",
+            "attempts_before_completion",
+            "completion_timestamp",
+            "completion_counter",
+            "latest_activity_timestamp",
+            "timestamp_first",
+            "timestamp_last",
+            "part1_answered",
+            "part1_correct",
+            "part2_attempted",
+            "part2_correct",
+        ] + USER_COLUMNS,
+        'ratings': [
+            "content_kind",
+            "content_id",
+            "content_source",
+            "quality",
+            "difficulty",
+            "text",
+            "content_title",
+        ] + USER_COLUMNS,
+        'device_logs': [
+            "name",
+            "description",
+            "public_key",
+            "version",
+            "last_sync",
+            "total_sync_sessions",
+        ],
+    }
+
+    @classmethod
+    def get_reusable(cls, organization, zone, facility, facility_group, resource, incremental=False):
+        """
+        Returns a job exporting the same data as requested: one that is
+        pending, or else one completed less than EXPORT_REUSE_SECONDS ago
+        whose file still exists. Returns None if there is no such job.
+
+        Incremental exports can miss data synced late, see
+        get_incremental_rows(), so only incremental requests reuse them.
+        """
+        identical = cls.objects.filter(
+            organization=organization,
+            zone=zone,
+            facility=facility,
+            facility_group=facility_group,
+            resource=resource,
+        )
+        if not incremental:
+            identical = identical.filter(incremental=False)
+        pending = identical.filter(completed=None, failed=None).order_by('id')[:1]
+        if pending:
+            return pending[0]
+
+        fresh_since = timezone.now() - datetime.timedelta(seconds=EXPORT_REUSE_SECONDS)
+        for job in identical.filter(completed__gte=fresh_since, evicted=None).order_by('-completed'):
+            if os.path.exists(job.get_file_path()):
+                return job
+        return None
+
+    @classmethod
+    def claim_next(cls, worker):
+        """
+        Atomically claims the next job, in the order of schedule(), that is
+        neither completed, failed nor claimed by a live worker, and returns
+        it. Returns None when there is nothing to do.
+
+        Claiming is a conditional UPDATE on the state we last read, so when
+        several workers compete for the same job, only one of them wins.
+        """
+        expired = timezone.now() - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+        candidates = cls.objects.filter(
+            Q(started=None) | Q(heartbeat__lt=expired) | Q(heartbeat=None),
+            completed=None,
+            failed=None,
+        ).order_by('id')
+
+        for job in cls.schedule(candidates):
+            if job.attempts >= EXPORT_JOB_MAX_ATTEMPTS:
+                # The worker of the last attempt crashed
+                logger.error("Giving up on export job {id} after {n} attempts".format(id=job.id, n=job.attempts))
+                cls.objects.filter(pk=job.pk, completed=None, heartbeat=job.heartbeat).update(failed=timezone.now())
+                continue
+            if job.worker:
+                logger.warning("Reclaiming export job {id} abandoned by worker {worker}".format(id=job.id, worker=job.worker))
+            now = timezone.now()
+            claimed = cls.objects.filter(
+                pk=job.pk,
+                completed=None,
+                started=job.started,
+                heartbeat=job.heartbeat,
+            ).update(started=now, heartbeat=now, worker=worker, attempts=F("attempts") + 1)
+            if claimed:
+                job.started = job.heartbeat = now
+                job.worker = worker
+                job.attempts += 1
+                return job
+        return None
+
+    @classmethod
+    def schedule(cls, candidates):
+        """
+        Returns the candidate jobs in the order they should be run:
+          1. jobs waiting for more than EXPORT_MAX_WAIT_SECONDS, oldest first
+          2. jobs of organizations with the fewest jobs running right now
+          3. the jobs with the fewest estimated rows, see estimate_pending()
+        so that small exports are not stuck behind large ones, and a single
+        organization can't occupy all workers while others are waiting.
+        """
+        now = timezone.now()
+        expired = now - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+        overdue = now - datetime.timedelta(seconds=EXPORT_MAX_WAIT_SECONDS)
+        running = dict(
+            (group["organization"], group["n_running"])
+            for group in cls.objects.filter(
+                completed=None,
+                heartbeat__gte=expired,
+            ).values("organization").annotate(n_running=Count("id")).order_by()
+        )
+
+        def key(job):
+            if job.requested < overdue:
+                return (0, 0, 0, job.id)
+            # Jobs that could not be estimated go last
+            size = job.rows_estimated if job.rows_estimated is not None else float("inf")
+            return (1, running.get(job.organization_id, 0), size, job.id)
+
+        return sorted(candidates, key=key)
+
+    @classmethod
+    def estimate_pending(cls):
+        """
+        Estimates the number of rows of pending jobs not yet estimated, for
+        schedule().
+
+        Each job is estimated by a single worker: the one whose conditional
+        UPDATE of estimating wins. A job whose worker crashed or failed to
+        estimate it is estimated again once EXPORT_JOB_LEASE_SECONDS have
+        passed.
+        """
+        expired = timezone.now() - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+        pending = cls.objects.filter(
+            Q(estimating=None) | Q(estimating__lt=expired),
+            completed=None,
+            started=None,
+            failed=None,
+            rows_estimated=None,
+        )
+        for job in pending:
+            claimed = cls.objects.filter(
+                pk=job.pk,
+                rows_estimated=None,
+                estimating=job.estimating,
+            ).update(estimating=timezone.now())
+            if not claimed:
+                continue
+            try:
+                rows_estimated = job.estimate_rows()
+            except Exception:
+                logger.exception("Could not estimate the size of export job {id}".format(id=job.id))
+                continue
+            cls.objects.filter(pk=job.pk, rows_estimated=None).update(rows_estimated=rows_estimated)
+
+    @classmethod
+    def enforce_quotas(cls, dry_run=False):
+        """
+        Deletes the files of completed jobs, least recently downloaded first,
+        until each organization is within EXPORT_ORG_QUOTA_BYTES and all of
+        them together within EXPORT_QUOTA_BYTES. Files never downloaded count
+        as downloaded on completion. Returns the evicted jobs.
+        """
+        if EXPORT_QUOTA_BYTES is None and EXPORT_ORG_QUOTA_BYTES is None:
+            return []
+
+        files = []
+        for job in cls.objects.exclude(completed=None).filter(evicted=None).select_related('organization'):
+            try:
+                size = os.path.getsize(job.get_file_path())
+            except OSError:
+                continue
+            files.append((job.last_downloaded or job.completed, size, job))
+        # Least recently downloaded first
+        files.sort(key=lambda f: (f[0], f[2].id))
+
+        evict = set()
+        if EXPORT_ORG_QUOTA_BYTES is not None:
+            org_sizes = {}
+            for __, size, job in files:
+                org_sizes[job.organization_id] = org_sizes.get(job.organization_id, 0) + size
+            for __, size, job in files:
+                if org_sizes[job.organization_id] > EXPORT_ORG_QUOTA_BYTES:
+                    org_sizes[job.organization_id] -= size
+                    evict.add(job.id)
+        if EXPORT_QUOTA_BYTES is not None:
+            total_size = sum(size for __, size, job in files if job.id not in evict)
+            for __, size, job in files:
+                if total_size <= EXPORT_QUOTA_BYTES:
+                    break
+                if job.id not in evict:
+                    total_size -= size
+                    evict.add(job.id)
+
+        evicted = []
+        for __, size, job in files:
+            if job.id not in evict:
+                continue
+            evicted.append(job)
+            logger.info("Evicting export job {id} of {size} bytes".format(id=job.id, size=size))
+            if dry_run:
+                continue
+            job.evicted = timezone.now()
+            cls.objects.filter(pk=job.pk).update(evicted=job.evicted)
+            try:
+                os.remove(job.get_file_path())
+            except OSError:
+                logger.exception("Could not delete the file of export job {id}".format(id=job.id))
+        return evicted
+
+    def renew_lease(self):
+        """
+        Updates the heartbeat of a claimed job. Raises ExportJobLeaseLost if
+        another worker has reclaimed the job in the meantime.
+        """
+        now = timezone.now()
+        renewed = ExportJob.objects.filter(
+            pk=self.pk,
+            worker=self.worker,
+            completed=None,
+        ).update(heartbeat=now)
+        if not renewed:
+            raise ExportJobLeaseLost("Export job {id} is no longer claimed by {worker}".format(id=self.id, worker=self.worker))
+        self.heartbeat = now
+
+    def keep_lease(self):
+        """
+        Renews the lease of a claimed job if it is getting old. Called
+        throughout run(), so that no phase of a long job lets it expire.
+        """
+        lease_interval = datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS / 5.0)
+        if self.worker and timezone.now() - self.heartbeat > lease_interval:
+            self.renew_lease()
+
+    def mark_completed(self, temp_file_path=None):
+        """
+        Marks a claimed job as completed, provided that this worker still
+        holds the claim. The file written by run() is only then moved into
+        place, so that a worker which lost its claim never overwrites the
+        file of the one that took over.
+        """
+        now = timezone.now()
+        completed = ExportJob.objects.filter(
+            pk=self.pk,
+            worker=self.worker,
+            completed=None,
+        ).update(completed=now)
+        if not completed:
+            if temp_file_path:
+                os.remove(temp_file_path)
+            raise ExportJobLeaseLost("Export job {id} is no longer claimed by {worker}".format(id=self.id, worker=self.worker))
+        self.completed = now
+        if temp_file_path:
+            os.rename(temp_file_path, self.get_file_path(compressed=True))
+
+    def mark_failed(self):
+        """
+        Puts a job whose run failed back in the queue, so that it is attempted
+        again right away, or marks it failed after EXPORT_JOB_MAX_ATTEMPTS
+        """
+        failed = timezone.now() if self.attempts >= EXPORT_JOB_MAX_ATTEMPTS else None
+        ExportJob.objects.filter(
+            pk=self.pk,
+            worker=self.worker,
+            completed=None,
+        ).update(started=None, worker="", heartbeat=None, failed=failed)
+        self.started = self.heartbeat = None
+        self.worker = ""
+        self.failed = failed
+
+    def get_file_path(self, compressed=None):
+        """
+        Exports are written gzip compressed. Jobs that ran before that have
+        an uncompressed .csv file, which is returned if it exists, unless
+        compressed is given.
+        """
         root = os.path.join(
             settings.CSV_EXPORT_ROOT,
             str(self.organization.id),
         )
         ensure_dir(root)
-        return os.path.join(
+        file_path = os.path.join(
             root,
-            "{type}-{dtm}-{id}.csv".format(
+            "{type}-{dtm}-{id}.csv.gz".format(
                 type=self.resource,
                 dtm=str(self.requested.strftime("%Y%m%d")),
                 id=self.id,
             )
         )
+        uncompressed_file_path = file_path[:-len(".gz")]
+        if compressed is None:
+            compressed = os.path.exists(file_path) or not os.path.exists(uncompressed_file_path)
+        return file_path if compressed else uncompressed_file_path
+
+    def get_temp_file_path(self):
+        """
+        Returns a path next to the job's file, unique to this run of the
+        job, that run() writes to
+        """
+        return "{path}.{tag}.tmp".format(path=self.get_file_path(compressed=True), tag=uuid.uuid4().hex)
+
+    def is_compressed(self):
+        return self.get_file_path().endswith(".gz")
+
+    def open_file(self):
+        """
+        Returns the exported CSV file, opened for reading uncompressed data
+        """
+        if self.is_compressed():
+            return gzip.open(self.get_file_path(), 'rb')
+        return open(self.get_file_path(), 'rb')
+
+    def get_columns(self):
+        return self.COLUMNS[self.resource]
+
+    def get_rows(self):
+        """
+        Returns an iterator of rows, sequences of values in the order of
+        get_columns()
+        """
+        if self.incremental:
+            previous = self.get_previous_job()
+            if self.can_run_incrementally(previous):
+                logger.info("Exporting changes since job {id}".format(id=previous.id))
+                return self.get_incremental_rows(previous)
+            logger.info("Cannot export incrementally, exporting everything")
+
+        getters = {
+            'user_logs': self.get_user_logs,
+            'attempt_logs': self.get_attempt_logs,
+            'exercise_logs': self.get_exercise_logs,
+            'ratings': self.get_content_rating,
+            'device_logs': self.get_device_logs,
+        }
+        return getters[self.resource]()
+
+    def get_previous_job(self):
+        """
+        Returns the most recently completed job that exported the same
+        resource for the same scope, or None
+        """
+        previous_jobs = ExportJob.objects.filter(
+            organization=self.organization,
+            zone=self.zone,
+            facility=self.facility,
+            facility_group=self.facility_group,
+            resource=self.resource,
+        ).exclude(completed=None).exclude(pk=self.pk).filter(evicted=None).order_by('-completed')
+        for job in previous_jobs[:1]:
+            return job
+        return None
+
+    def get_incremental_rows(self, previous):
+        """
+        Yields the rows of the previous job's file that are still current,
+        followed by rows that changed since the previous job started.
+
+        The previous job's start time is the watermark: anything it exported
+        was in the database by then. Rows are "changed" when their activity
+        timestamp is past the watermark.
+
+        Rows of users no longer in the scope of the job, for instance moved
+        to another facility since, are dropped, as a full export would.
+
+        Note that these timestamps come from the distributed servers, so data
+        synced long after it was recorded can be missed. Full exports
+        remain the default for that reason.
+        """
+        watermark = previous.started
+        columns = self.get_columns()
+        user_ids_in_scope = set(self.get_user_ids())
+        user_column = columns.index("user_id")
 
-    def run(self):
-        csv_file = open(self.get_file_path(), 'wb')
-        if self.resource == 'user_logs':
-            data = self.get_user_logs()
-        if self.resource == 'attempt_logs':
-            data = self.get_attempt_logs()
         if self.resource == 'exercise_logs':
-            data = self.get_exercise_logs()
-        if self.resource == 'ratings':
-            data = self.get_content_rating()
-        if self.resource == 'device_logs':
-            data = self.get_device_logs()
-        if not data:
-            csv_file.write("")
-            return
-        writer = csv.DictWriter(
-            csv_file,
-            fieldnames=data[0].keys()
-        )
-        writer.writeheader()
-        for row in data:
-            writer.writerow(row)
+            # Exercise logs are updated in place. Rows of changed exercise
+            # logs replace those of the previous file.
+            changed = ExerciseLog.objects.filter(latest_activity_timestamp__gt=watermark)
+            changed_keys = set()
+            for user_ids in self.get_user_id_chunks():
+                changed_keys.update(changed.filter(user__in=user_ids).values_list("user", "exercise_id"))
+            # Only users with changes need their attempts aggregated again
+            changed_user_ids = sorted(set(user_id for user_id, __ in changed_keys))
+            new_rows = self.get_exercise_logs(changed, user_ids=changed_user_ids)
+            user_id, exercise_id = columns.index("user_id"), columns.index("exercise_id")
+            is_current = lambda row: (row[user_id], row[exercise_id]) not in changed_keys
 
-    def get_user_logs(self):
+        else:
+            # Attempt logs are only ever appended
+            new_rows = self.get_attempt_logs(AttemptLog.objects.filter(timestamp__gt=watermark))
+            # Timestamps in the file are str(datetime), which sort as strings
+            timestamp = columns.index("timestamp")
+            is_current = lambda row: row[timestamp] <= str(watermark)
+
+        with previous.open_file() as previous_file:
+            reader = csv.reader(previous_file)
+            # Skip the header, see can_run_incrementally()
+            next(reader, None)
+            for row in reader:
+                if row[user_column] in user_ids_in_scope and is_current(row):
+                    yield row
+
+        for row in new_rows:
+            yield row
+
+    def can_run_incrementally(self, previous):
         """
-        Returns a list of dicts for CSV export
-        """
-        # They must have a zone_id, and may have a facility_id and group_id.
-        # Try to filter from most specific, to least
-        if self.facility_group:
-            queryset = FacilityUser.objects.filter(group=self.facility_group)
-        elif self.facility:
-            queryset = FacilityUser.objects.filter(facility=self.facility)
-        elif self.zone:
-            # We could have used this queryset method, but in order to be clear
-            # and precise, we use the extracted actual query
-            # queryset = FacilityUser.objects.by_zone(self.zone)
-            queryset = FacilityUser.objects.filter(
-                Q(signed_by__devicezone__zone=self.zone, signed_by__devicezone__revoked=False) | \
-                Q(signed_by__devicemetadata__is_trusted=True, zone_fallback=self.zone)
-            )
+        An incremental export needs the previous job's file, in the columns we
+        are writing now
+        """
+        if not previous or self.resource not in self.INCREMENTAL_RESOURCES:
+            return False
+        try:
+            with previous.open_file() as previous_file:
+                header = next(csv.reader(previous_file), None)
+        except IOError:
+            return False
+        # An empty file is a valid export without any rows
+        return header is None or header == self.get_columns()
 
+    def run(self):
+        """
+        Writes the compressed CSV file, one row at a time as rows are streamed
+        from the database. An export without any rows results in an empty file.
+        Large jobs are split into shards run in parallel, see get_shards().
+
+        The file is written to a temporary path first. A claimed job is
+        marked completed once it is written, see mark_completed().
+
+        Progress is saved every EXPORT_PROGRESS_INTERVAL seconds, and the
+        time spent in each phase once done:
+          scope: resolving the users in scope
+          estimate: estimating the number of rows
+          first_row: preparing the export until its first row is ready
+          stream: fetching and writing all rows
+        or for sharded jobs:
+          shards: writing the shards in parallel
+          stitch: joining the shards into the final file
+        and in peak_memory, how far the resident memory of this process grew
+        during the job.
+        """
+        timings = OrderedDict()
+        phase_start = time.time()
+        memory_start = reset_peak_memory() and get_memory_status()
+
+        def end_phase(name):
+            now = time.time()
+            timings[name] = round(now - phase_start, 3)
+            return now
+
+        if self.resource != 'device_logs':
+            self.get_user_ids()
+            self.keep_lease()
+        phase_start = end_phase("scope")
+        # Pending jobs have usually been estimated for scheduling already
+        if self.rows_estimated is None:
+            self.rows_estimated = self.estimate_rows()
+        phase_start = end_phase("estimate")
+        self.rows_written = 0
+        ExportJob.objects.filter(pk=self.pk).update(rows_written=0, rows_estimated=self.rows_estimated)
+
+        temp_file_path = self.get_temp_file_path()
+        try:
+            shards = self.get_shards()
+            if shards:
+                shard_paths = self.run_shards(shards, temp_file_path)
+                phase_start = end_phase("shards")
+                self.stitch_shards(temp_file_path, shard_paths)
+                end_phase("stitch")
+            else:
+                rows = iter(self.get_rows())
+                first_rows = list(itertools.islice(rows, 1))
+                phase_start = end_phase("first_row")
+                self.write_rows(temp_file_path, itertools.chain(first_rows, rows), report_progress=True)
+                end_phase("stream")
+        except Exception:
+            if os.path.exists(temp_file_path):
+                os.remove(temp_file_path)
+            raise
+
+        # Unknown where the peak can't be reset, as it would be that of the
+        # whole life of the worker process
+        memory_end = memory_start and get_memory_status()
+        self.peak_memory = max(0, memory_end[1] - memory_start[0]) if memory_end else None
+        self.timings = json.dumps(timings)
+        ExportJob.objects.filter(pk=self.pk).update(
+            rows_written=self.rows_written,
+            peak_memory=self.peak_memory,
+            timings=self.timings,
+        )
+
+        logger.info("Exported {resource} of {n} rows in {timings}".format(
+            resource=self.resource,
+            n=self.rows_written,
+            timings=", ".join("{0}: {1}s".format(*item) for item in timings.items()),
+        ))
+
+        if self.worker:
+            self.mark_completed(temp_file_path)
         else:
-            queryset = FacilityUser.objects.filter(
-                Q(signed_by__devicezone__zone__organization=self.organization, signed_by__devicezone__revoked=False) | \
-                Q(signed_by__devicemetadata__is_trusted=True, zone_fallback__organization=self.organization)
-            )
+            # Not claimed, as in a dry run
+            os.rename(temp_file_path, self.get_file_path(compressed=True))
 
-        # Prefetch the facility relation
-        queryset = queryset.select_related('facility')
-
-        data = []
-        
-        for user in queryset:
-            data.append({
-                "username": user.username,
-                "first_name": user.first_name,
-                "last_name": user.last_name,
-                "facility_name": user.facility.name,
-                "default_language": user.default_language,
-                "is_teacher": user.is_teacher,
-                "facility_id": user.facility.id,
-                "id": user.id,
-            })
-        
-        return data
-        
-    def get_exercise_logs(self):
-
-        if self.facility_group:
-            queryset = ExerciseLog.objects.filter(user__group=self.facility_group)
-        elif self.facility:
-            queryset = ExerciseLog.objects.filter(user__facility=self.facility)
-        elif self.zone:
-            queryset = ExerciseLog.objects.filter(
-                Q(user__signed_by__devicezone__zone=self.zone, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback=self.zone)
-            )
+    def write_rows(self, file_path, rows, header=True, report_progress=False):
+        """
+        Writes the given rows to file_path as gzip compressed CSV, and returns
+        the number of rows written. Nothing, not even the header, is written
+        if there are no rows.
+        """
+        n_rows = 0
+        with gzip.GzipFile(file_path, 'wb', compresslevel=EXPORT_COMPRESSLEVEL) as csv_file:
+            writer = csv.writer(csv_file)
+            for row in rows:
+                if header and not n_rows:
+                    writer.writerow(self.get_columns())
+                writer.writerow(row)
+                n_rows += 1
+                if report_progress:
+                    self.report_progress(n_rows)
+        return n_rows
+
+    def report_progress(self, rows_written):
+        """
+        Saves the number of rows written every EXPORT_PROGRESS_INTERVAL
+        seconds. Claimed jobs also renew their lease.
+        """
+        self.rows_written = rows_written
+        now = time.time()
+        if now - self._last_progress > EXPORT_PROGRESS_INTERVAL:
+            ExportJob.objects.filter(pk=self.pk).update(rows_written=rows_written)
+            self._last_progress = now
+        self.keep_lease()
+
+    def get_shards(self):
+        """
+        Returns the ids of the users in scope split by facility, in order of
+        facility id, if the job is large enough to be split into shards run
+        by EXPORT_SHARD_PROCESSES processes. Returns None otherwise.
+        """
+        if (EXPORT_SHARD_PROCESSES <= 1 or
+                self.resource not in self.SHARDED_RESOURCES or
+                self.incremental or
+                (self.rows_estimated or 0) < EXPORT_SHARD_MIN_ROWS):
+            return None
+
+        facility_users = {}
+        for user_ids in self.get_user_id_chunks():
+            for user_id, facility_id in FacilityUser.objects.filter(id__in=user_ids).values_list("id", "facility"):
+                facility_users.setdefault(facility_id, []).append(user_id)
+        if len(facility_users) < 2:
+            return None
+        return [sorted(facility_users[facility_id]) for facility_id in sorted(facility_users)]
+
+    def run_shards(self, shards, file_path):
+        """
+        Writes each shard to a file of its own next to file_path, in a pool
+        of EXPORT_SHARD_PROCESSES processes, and returns the file paths in
+        the order of the shards.
+        """
+        shard_paths = ["{path}.shard{n}".format(path=file_path, n=n) for n in range(len(shards))]
+
+        # The processes must not share the database connection of this one,
+        # so close it and have each open their own.
+        connection.close()
+        pool = multiprocessing.Pool(EXPORT_SHARD_PROCESSES)
+        try:
+            results = [
+                pool.apply_async(run_export_shard, (self.id, user_ids, shard_path))
+                for user_ids, shard_path in zip(shards, shard_paths)
+            ]
+            pool.close()
+            while True:
+                done = [result for result in results if result.ready()]
+                # get() raises the exception of a failed shard
+                self.report_progress(sum(result.get() for result in done))
+                pending = [result for result in results if result not in done]
+                if not pending:
+                    break
+                pending[0].wait(EXPORT_PROGRESS_INTERVAL)
+        except Exception:
+            pool.terminate()
+            for shard_path in shard_paths:
+                if os.path.exists(shard_path):
+                    os.remove(shard_path)
+            raise
+        finally:
+            pool.join()
+        return shard_paths
+
+    def stitch_shards(self, file_path, shard_paths):
+        """
+        Joins the shard files into file_path, behind a header. A gzip file
+        may consist of several compressed members, so the shards are
+        appended as they are, without decompressing them again.
+        """
+        with gzip.GzipFile(file_path, 'wb', compresslevel=EXPORT_COMPRESSLEVEL) as csv_file:
+            if self.rows_written:
+                csv.writer(csv_file).writerow(self.get_columns())
+        with open(file_path, 'ab') as f:
+            for shard_path in shard_paths:
+                with open(shard_path, 'rb') as shard_file:
+                    shutil.copyfileobj(shard_file, f)
+                os.remove(shard_path)
+
+    def estimate_rows(self):
+        """
+        Returns the number of rows the export is expected to have, counted
+        before streaming them. Incremental exports have about as many rows
+        as full ones.
+        """
+        if self.resource == 'device_logs':
+            return self.get_device_queryset().count()
+        if self.resource == 'user_logs':
+            return len(self.get_user_ids())
+        model = {
+            'exercise_logs': ExerciseLog,
+            'attempt_logs': AttemptLog,
+            'ratings': ContentRating,
+        }[self.resource]
+        return sum(
+            model.objects.filter(user__in=user_ids).count()
+            for user_ids in self.get_user_id_chunks()
+        )
+
+    def get_rows_per_second(self):
+        """
+        Returns the number of rows written per second since the job started
+        """
+        if not self.started:
+            return None
+        elapsed = ((self.completed or timezone.now()) - self.started).total_seconds()
+        if elapsed <= 0:
+            return None
+        return self.rows_written / elapsed
+
+    def get_progress(self):
+        """
+        Returns the state and progress of the job as a JSON serializable dict.
+        peak_memory is the growth of the worker's resident memory during the
+        job in KB, see run(), or None when unknown.
+        """
+        if self.completed:
+            status = "completed"
+        elif self.failed:
+            status = "failed"
+        elif self.started:
+            status = "running"
         else:
-            queryset = ExerciseLog.objects.filter(
-                Q(user__signed_by__devicezone__zone__organization=self.organization, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback__organization=self.organization)
-            )
+            status = "requested"
+
+        rows_per_second = self.get_rows_per_second()
+        percent = eta = None
+        if status == "completed":
+            percent = 100
+            eta = 0
+        elif status == "running" and self.rows_estimated:
+            percent = min(99, 100 * self.rows_written // self.rows_estimated)
+            if rows_per_second:
+                eta = max(0, int((self.rows_estimated - self.rows_written) / rows_per_second))
+
+        return {
+            "id": self.id,
+            "resource": self.resource,
+            "status": status,
+            "requested": self.requested,
+            "started": self.started,
+            "completed": self.completed,
+            "failed": self.failed,
+            "attempts": self.attempts,
+            "rows_written": self.rows_written,
+            "rows_estimated": self.rows_estimated,
+            "percent": percent,
+            "rows_per_second": rows_per_second and round(rows_per_second, 1),
+            "eta_seconds": eta,
+            "peak_memory": self.peak_memory,
+            "timings": json.loads(self.timings) if self.timings else {},
+        }
+
+    def get_user_ids(self):
+        """
+        Returns the sorted ids of all FacilityUsers within the scope of this
+        job. They are resolved once per job.
+
+        A user is in a zone when signed by a device in the zone, or when
+        signed by a trusted device with the zone as zone_fallback. OR-ing
+        those two joins in every log query keeps the database from using its
+        indexes, so each is a query of its own here, and log queries only
+        filter on user ids.
+        """
+        if self._user_ids is None:
+            if self.facility_group:
+                querysets = [FacilityUser.objects.filter(group=self.facility_group)]
+            elif self.facility:
+                querysets = [FacilityUser.objects.filter(facility=self.facility)]
+            elif self.zone:
+                # See FacilityUser.objects.by_zone(self.zone)
+                querysets = [
+                    FacilityUser.objects.filter(signed_by__devicezone__zone=self.zone, signed_by__devicezone__revoked=False),
+                    FacilityUser.objects.filter(signed_by__devicemetadata__is_trusted=True, zone_fallback=self.zone),
+                ]
+            else:
+                querysets = [
+                    FacilityUser.objects.filter(signed_by__devicezone__zone__organization=self.organization, signed_by__devicezone__revoked=False),
+                    FacilityUser.objects.filter(signed_by__devicemetadata__is_trusted=True, zone_fallback__organization=self.organization),
+                ]
+            user_ids = set()
+            for queryset in querysets:
+                user_ids.update(queryset.values_list("id", flat=True))
+            self._user_ids = sorted(user_ids)
+        return self._user_ids
+
+    def get_user_id_chunks(self, user_ids=None):
+        """
+        Yields lists of at most EXPORT_USER_CHUNK_SIZE user ids, by default
+        of all users in scope. Log queries are run for a chunk of users at a
+        time, each an index lookup on the user id.
+        """
+        if user_ids is None:
+            user_ids = self.get_user_ids()
+        for i in range(0, len(user_ids), EXPORT_USER_CHUNK_SIZE):
+            # Every phase of a job loops over the chunks, whether estimating,
+            # looking up content titles or aggregating attempts
+            self.keep_lease()
+            yield user_ids[i:i + EXPORT_USER_CHUNK_SIZE]
 
-        # Prefetch the user relation
-        queryset = queryset.select_related('user')
-        # Prefetch the facility relation
-        queryset = queryset.select_related('user__facility')
-        
-        columns = [
-            "user",
+    def get_user_logs(self):
+        """
+        Yields a row per FacilityUser for CSV export
+        """
+        fields = [
+            "username",
+            "first_name",
+            "last_name",
+            "facility__name",
+            "default_language",
+            "is_teacher",
+            "facility",
+            "id",
+        ]
+        for user_ids in self.get_user_id_chunks():
+            for row in chunked_values_iterator(FacilityUser.objects.filter(id__in=user_ids), fields):
+                yield row
+
+    def get_exercise_logs(self, queryset=None, user_ids=None):
+        """
+        Yields exercise log rows, by default of all exercise logs. Only logs
+        of the given users, by default all users in scope, are exported.
+        """
+        if queryset is None:
+            queryset = ExerciseLog.objects.all()
+
+        fields = [
             "exercise_id",
             "streak_progress",
             "attempts",
@@ -361,150 +1304,149 @@ class ExportJob(models.Model):
             "completion_timestamp",
             "completion_counter",
             "latest_activity_timestamp",
-        ]
+        ] + self.USER_FIELDS
+        # The attempt statistics go between the exercise log and user columns
+        n_log_fields = len(fields) - len(self.USER_FIELDS)
+        empty_summary = tuple(self.EMPTY_ATTEMPT_SUMMARY[column] for column in self.ATTEMPT_SUMMARY_COLUMNS)
 
-        data = []
-        for log in queryset:
-            dct = {}
-            for key in columns:
-                dct[key] = getattr(log, key)
-            user = dct['user']
-            
-            # Here is a bunch of insane and very costly lookups
-            attempt_logs = AttemptLog.objects.filter(user=user, exercise_id=log.exercise_id, context_type__in=["playlist", "exercise"])
-            dct["timestamp_first"] = attempt_logs.count() and attempt_logs.aggregate(Min('timestamp'))['timestamp__min'] or None
-            dct["timestamp_last"] = attempt_logs.count() and attempt_logs.aggregate(Max('timestamp'))['timestamp__max'] or None
-            dct["part1_answered"] = AttemptLog.objects.filter(user=user, exercise_id=log.exercise_id, context_type__in=["playlist", "exercise"]).count()
-            dct["part1_correct"] = AttemptLog.objects.filter(user=user, exercise_id=log.exercise_id, correct=True, context_type__in=["playlist", "exercise"]).count()
-            dct["part2_attempted"] = AttemptLog.objects.filter(user=user, exercise_id=log.exercise_id, context_type__in=["exercise_fixedblock", "playlist_fixedblock"]).count()
-            dct["part2_correct"] = AttemptLog.objects.filter(user=user, exercise_id=log.exercise_id, correct=True, context_type__in=["exercise_fixedblock", "playlist_fixedblock"]).count()
-            data.append(dct)
-        data = self.annotate_users(data)
-        
-        logger.info("Created exercises log of {} rows".format(len(data)))
-        
-        return data
+        for chunk in self.get_user_id_chunks(user_ids):
+            # Attempt statistics of this chunk of users in a single query,
+            # instead of a handful of AttemptLog queries per exercise log.
+            attempt_summaries = self.get_attempt_log_summaries(AttemptLog.objects.filter(user__in=chunk))
 
-    def get_content_rating(self):
+            for row in chunked_values_iterator(queryset.filter(user__in=chunk), fields):
+                user_id = row[n_log_fields + 1]
+                summary = attempt_summaries.get((user_id, row[0]), empty_summary)
+                yield row[:n_log_fields] + summary + row[n_log_fields:]
 
-        if self.facility_group:
-            queryset = ContentRating.objects.filter(user__group=self.facility_group)
-        elif self.facility:
-            queryset = ContentRating.objects.filter(user__facility=self.facility)
-        elif self.zone:
-            queryset = ContentRating.objects.filter(
-                Q(user__signed_by__devicezone__zone=self.zone, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback=self.zone)
-            )
-        else:
-            queryset = ContentRating.objects.filter(
-                Q(user__signed_by__devicezone__zone__organization=self.organization, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback__organization=self.organization)
-            )
-
-        # Prefetch the user relation
-        queryset = queryset.select_related('user')
-        # Prefetch the facility relation
-        queryset = queryset.select_related('user__facility')
-
-        columns = [
-            "user",
+    def get_content_rating(self):
+        """
+        Yields content rating rows of the users in scope, with the title of
+        the rated content
+        """
+        fields = [
             "content_kind",
             "content_id",
             "content_source",
             "quality",
             "difficulty",
             "text",
-        ]
-
-        data = []
-        for log in queryset:
-            dct = {}
-            for key in columns:
-                dct[key] = getattr(log, key)
-            
-            # Do a lookup of the title
-            content = get_content_item(content_id=log.content_id)
-            dct["content_title"] = content.get("title", "Missing title") if content else "Unknown content"
-
-            data.append(dct)
+        ] + self.USER_FIELDS
+        # The content title goes between the rating and user columns
+        n_rating_fields = len(fields) - len(self.USER_FIELDS)
+
+        # Look up the titles of all rated content at once
+        content_ids = set()
+        for user_ids in self.get_user_id_chunks():
+            content_ids.update(
+                ContentRating.objects.filter(user__in=user_ids).order_by().values_list("content_id", flat=True).distinct()
+            )
+        content_titles = get_content_titles(content_ids)
 
-        data = self.annotate_users(data)
-        
-        logger.info("Exported ratings of {} rows".format(len(data)))
-        
-        return data
+        for user_ids in self.get_user_id_chunks():
+            for row in chunked_values_iterator(ContentRating.objects.filter(user__in=user_ids), fields):
+                # Ratings synced since the titles were looked up
+                title = content_titles.get(row[1])
+                if title is None:
+                    title = content_titles[row[1]] = get_content_titles([row[1]])[row[1]]
+                yield row[:n_rating_fields] + (title,) + row[n_rating_fields:]
 
-    def get_device_logs(self):
+    def get_device_queryset(self):
         # Facility and FacilityGroup are a bit unsure in the export since the
         # mapping from facility to zone to device is unsure. We use the
-        # Facility.fallback_zone
+        # Facility.zone_fallback
         zone = None
         if self.zone:
             zone = self.zone
         if self.facility or self.facility_group:
             facility = self.facility or self.facility_group.facility
-            zone = facility.fallback_zone
+            zone = facility.zone_fallback
 
         if zone:
             queryset = Device.objects.filter(
-                devicezone__zone=self.zone, devicezone__revoked=False
+                devicezone__zone=zone, devicezone__revoked=False
             )
         else:
             queryset = Device.objects.filter(
                 devicezone__zone__organization=self.organization, devicezone__revoked=False
             )
 
-        columns = [
+        return queryset
+
+    def get_device_logs(self):
+        # Sync statistics of each device, in the same query as the device
+        queryset = self.get_device_queryset().annotate(
+            n_sync_sessions=Count("client_sessions", distinct=True),
+            last_sync_timestamp=Max("client_sessions__timestamp"),
+        )
+
+        fields = [
             "name",
             "description",
             "public_key",
             "version",
+            "last_sync_timestamp",
+            "n_sync_sessions",
         ]
-        
-        data = []
-
-        for log in queryset:
-            dct = {}
-            for key in columns:
-                dct[key] = getattr(log, key)
-                all_sessions = SyncSession.objects.filter(client_device__id=log.id)
-                last_sync = "Never" if not all_sessions else all_sessions.order_by("-timestamp")[0].timestamp
-                dct["last_sync"] = last_sync
-                dct["total_sync_sessions"] = len(all_sessions)
-
-            data.append(dct)
-
-        logger.info("Exported devices of {} rows".format(len(data)))
-        
-        return data
-
-    def get_attempt_logs(self):
-        """
-        Fetches all attempt log rows
-        """
-        if self.facility_group:
-            queryset = AttemptLog.objects.filter(user__group=self.facility_group)
-        elif self.facility:
-            queryset = AttemptLog.objects.filter(user__facility=self.facility)
-        elif self.zone:
-            queryset = AttemptLog.objects.filter(
-                Q(user__signed_by__devicezone__zone=self.zone, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback=self.zone)
-            )
-        else:
-            queryset = AttemptLog.objects.filter(
-                Q(user__signed_by__devicezone__zone__organization=self.organization, user__signed_by__devicezone__revoked=False) | \
-                Q(user__signed_by__devicemetadata__is_trusted=True, user__zone_fallback__organization=self.organization)
+
+        for row in chunked_values_iterator(queryset, fields):
+            last_sync = row[4] or "Never"
+            yield row[:4] + (last_sync,) + row[5:]
+
+    def get_attempt_log_summaries(self, attempts):
+        """
+        Returns a dict mapping (user_id, exercise_id) to the attempt statistics
+        exported along with each exercise log, in the order of
+        ATTEMPT_SUMMARY_COLUMNS, computed from the given attempt logs.
+
+        Attempts are counted per (user, exercise, context_type, correct) in one
+        grouped query, and the groups are then folded into the part1/part2
+        totals here.
+        """
+        groups = attempts.filter(
+            context_type__in=self.PART1_CONTEXT_TYPES + self.PART2_CONTEXT_TYPES,
+        ).values(
+            "user", "exercise_id", "context_type", "correct",
+        ).annotate(
+            n_attempts=Count("id"),
+            timestamp_first=Min("timestamp"),
+            timestamp_last=Max("timestamp"),
+        ).order_by()
+
+        summaries = {}
+        for group in groups.iterator():
+            summary = summaries.setdefault(
+                (group["user"], group["exercise_id"]),
+                dict(self.EMPTY_ATTEMPT_SUMMARY),
             )
+            n_correct = group["n_attempts"] if group["correct"] else 0
+            if group["context_type"] in self.PART1_CONTEXT_TYPES:
+                summary["part1_answered"] += group["n_attempts"]
+                summary["part1_correct"] += n_correct
+                # First and last attempts only take part 1 into account
+                if summary["timestamp_first"] is None or group["timestamp_first"] < summary["timestamp_first"]:
+                    summary["timestamp_first"] = group["timestamp_first"]
+                if summary["timestamp_last"] is None or group["timestamp_last"] > summary["timestamp_last"]:
+                    summary["timestamp_last"] = group["timestamp_last"]
+            else:
+                summary["part2_attempted"] += group["n_attempts"]
+                summary["part2_correct"] += n_correct
 
-        # Prefetch the user relation
-        queryset = queryset.select_related('user')
-        # Prefetch the facility relation
-        queryset = queryset.select_related('user__facility')
+        # Rows are tuples, see get_exercise_logs()
+        return dict(
+            (key, tuple(summary[column] for column in self.ATTEMPT_SUMMARY_COLUMNS))
+            for key, summary in summaries.items()
+        )
 
-        columns = [
-            "user",
+    def get_attempt_logs(self, queryset=None):
+        """
+        Yields attempt log rows, by default of all attempt logs, of the users
+        in scope
+        """
+        if queryset is None:
+            queryset = AttemptLog.objects.all()
+
+        fields = [
             "exercise_id",
             "seed",
             "answer_given",
@@ -517,31 +1459,23 @@ class ExportJob(models.Model):
             "timestamp",
             "time_taken",
             "assessment_item_id",
-        ]
-        data = []
-        for log in queryset:
-            dct = {}
-            for key in columns:
-                dct[key] = getattr(log, key)
-            data.append(dct)
-        data = self.annotate_users(data)
-
-        logger.info("Exported attempt logs of {} rows".format(len(data)))
-
-        return data
-
-    def annotate_users(self, rows):
-        for row in rows:
-            user = row.pop('user', None)
-            if not user:
-                continue
-            row["username"] = user.username
-            row["user_id"] = user.id
-            row["facility_name"] = user.facility.name
-            row["facility_id"] = user.facility.id
-            row["is_teacher"] = user.is_teacher
-        return rows
+        ] + self.USER_FIELDS
+
+        for user_ids in self.get_user_id_chunks():
+            for row in chunked_values_iterator(queryset.filter(user__in=user_ids), fields):
+                yield row
 
     class Meta:
         verbose_name = "Export Job"
         verbose_name_plural = "Export Jobs"
+
+
+def run_export_shard(job_id, user_ids, file_path):
+    """
+    Writes the rows of the given users of an export job to file_path, without
+    header, and returns the number of rows. Run by the processes of
+    ExportJob.run_shards().
+    """
+    job = ExportJob.objects.get(id=job_id)
+    job._user_ids = user_ids
+    return job.write_rows(file_path, job.get_rows(), header=False)
@@ -1,7 +1,9 @@
 from .auth_tests import *
 from .browser_tests import *
+from .command_tests import *
 from .ecosystem_tests import *
+from .export_tests import *
 from .fixture_tests import *
 from .invitation_tests import *
 from .unicode_tests import *
-from .url_tests import *
\ No newline at end of file
+from .url_tests import *
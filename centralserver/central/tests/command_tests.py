@@ -0,0 +1,71 @@
+"""
+Tests of the central server management commands
+"""
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..models import Organization
+from kalite.facility.models import Facility, FacilityUser
+from kalite.main.content_rating_models import ContentRating
+from kalite.main.models import AttemptLog, ExerciseLog
+from securesync.models import DeviceZone, SyncSession
+
+
+class GenerateDatasetTests(TestCase):
+
+    def test_dataset_size(self):
+        call_command(
+            "generatedataset",
+            organizations=2,
+            zones=2,
+            devices=2,
+            facilities=3,
+            groups=1,
+            users=4,
+            exercises=3,
+            attempts=2,
+            ratings=1,
+            sync_sessions=2,
+            batch_size=7,
+        )
+        self.assertEqual(Organization.objects.filter(name__startswith="Benchmark").count(), 2)
+        self.assertEqual(DeviceZone.objects.count(), 2 * 2 * 2)
+        self.assertEqual(SyncSession.objects.count(), 2 * 2 * 2 * 2)
+        self.assertEqual(Facility.objects.count(), 2 * 2 * 3)
+        n_users = 2 * 2 * 3 * 4
+        self.assertEqual(FacilityUser.objects.count(), n_users)
+        self.assertEqual(ExerciseLog.objects.count(), n_users * 3)
+        self.assertEqual(AttemptLog.objects.count(), n_users * 3 * 2)
+        self.assertEqual(ContentRating.objects.count(), n_users)
+
+    def test_users_are_in_zone(self):
+        call_command("generatedataset", organizations=1, zones=1, users=2, exercises=1, attempts=1)
+        zone = Organization.objects.get(name="Benchmark organization 0").zones.get()
+        self.assertEqual(FacilityUser.objects.by_zone(zone).count(), 3 * 2)
+
+
+class BenchmarkExportsTests(TestCase):
+
+    def test_results_file(self):
+        call_command("generatedataset", organizations=1, zones=1, users=2, exercises=1, attempts=1)
+        fd, results_path = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        try:
+            call_command("benchmarkexports", results_path, resources="attempt_logs,device_logs", fork=False)
+            with open(results_path) as f:
+                results = json.load(f)["results"]
+        finally:
+            os.remove(results_path)
+
+        self.assertEqual(
+            [(result["resource"], result["scope"]) for result in results],
+            [(resource, scope) for resource in ["attempt_logs", "device_logs"] for scope in ["organization", "zone", "facility", "facility_group"]],
+        )
+        attempt_logs = results[0]
+        self.assertEqual(attempt_logs["rows"], 3 * 2)
+        self.assertTrue(attempt_logs["queries"] > 0)
+        self.assertTrue(attempt_logs["peak_rss_kb"] > 0)
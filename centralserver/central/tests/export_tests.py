@@ -0,0 +1,687 @@
+"""
+Tests of the CSV data export jobs
+"""
+import csv
+import datetime
+import json
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils import unittest
+
+from .utils.mixins import CreateAdminMixin, CentralServerMixins, FakeDeviceMixin
+from ..forms import ExportForm
+from ..models import ExportJob, ExportJobLeaseLost, EXPORT_JOB_LEASE_SECONDS, EXPORT_MAX_WAIT_SECONDS, EXPORT_REUSE_SECONDS, CONTENT_TITLE_CACHE, chunked_values_iterator, get_content_titles, reset_peak_memory, run_export_shard
+from kalite.facility.models import Facility, FacilityUser
+from kalite.main.content_rating_models import ContentRating
+from kalite.main.models import AttemptLog, ExerciseLog
+from securesync.models import Device, DeviceZone, SyncSession
+
+
+class ExportJobTestCase(CreateAdminMixin,
+                        CentralServerMixins,
+                        FakeDeviceMixin,
+                        TestCase):
+
+    def setUp(self):
+        self.export_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(CSV_EXPORT_ROOT=self.export_root)
+        self.settings_override.enable()
+
+        self.setup_fake_device(name="Central")
+        self.user = self.create_admin()
+        self.org = self.create_organization(owner=self.user)
+        self.zone = self.create_zone(organizations=[self.org])
+
+        self.facility = Facility(name="fac1", zone_fallback=self.zone)
+        self.facility.save()
+        self.students = []
+        for i in range(3):
+            student = FacilityUser(
+                username="student%d" % i,
+                facility=self.facility,
+                zone_fallback=self.zone,
+            )
+            student.set_password("password")
+            student.save()
+            self.students.append(student)
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.export_root)
+
+    def create_attempt_logs(self, user, exercise_id="addition_1", n=1, **kwargs):
+        for i in range(n):
+            AttemptLog(
+                user=user,
+                exercise_id=exercise_id,
+                context_type=kwargs.get("context_type", "exercise"),
+                correct=kwargs.get("correct", True),
+                timestamp=kwargs.get("timestamp", datetime.datetime(2016, 1, 1, 12, i)),
+                zone_fallback=self.zone,
+            ).save()
+
+    def run_job(self, resource, **kwargs):
+        job = ExportJob(organization=self.org, resource=resource, **kwargs)
+        job.save()
+        job.run()
+        with job.open_file() as f:
+            return list(csv.reader(f))
+
+
+class ExportJobStreamingTests(ExportJobTestCase):
+
+    def test_chunked_iterator_visits_every_row_once(self):
+        self.create_attempt_logs(self.students[0], n=7)
+        ids = [row[0] for row in chunked_values_iterator(AttemptLog.objects.all(), ["id"], chunk_size=3)]
+        self.assertEqual(sorted(ids), sorted(AttemptLog.objects.values_list("id", flat=True)))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_chunked_iterator_leaves_out_primary_key(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        rows = list(chunked_values_iterator(AttemptLog.objects.all(), ["exercise_id", "user"], chunk_size=1))
+        self.assertEqual(rows, [("addition_1", self.students[0].id)] * 2)
+
+    def test_fixed_column_order(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        rows = self.run_job("attempt_logs", facility=self.facility)
+        self.assertEqual(rows[0], ExportJob.COLUMNS["attempt_logs"])
+        self.assertEqual(len(rows), 3)
+
+    def test_user_logs(self):
+        rows = self.run_job("user_logs", facility=self.facility)
+        header = rows[0]
+        usernames = sorted(row[header.index("username")] for row in rows[1:])
+        self.assertEqual(usernames, ["student0", "student1", "student2"])
+
+    def test_export_is_gzip_compressed(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        job = ExportJob.objects.create(organization=self.org, facility=self.facility, resource="attempt_logs")
+        job.run()
+        self.assertTrue(job.is_compressed())
+        with open(job.get_file_path(), "rb") as f:
+            self.assertEqual(f.read(2), "\x1f\x8b")
+
+    def test_empty_export_writes_empty_file(self):
+        rows = self.run_job("attempt_logs", facility=self.facility)
+        self.assertEqual(rows, [])
+
+
+class ExportScopeTests(ExportJobTestCase):
+
+    def test_user_ids_of_zone_fallback(self):
+        job = ExportJob(organization=self.org, zone=self.zone, resource="user_logs")
+        self.assertEqual(job.get_user_ids(), sorted(student.id for student in self.students))
+
+    def test_other_zone_is_out_of_scope(self):
+        other_zone = self.create_zone(organizations=[self.org])
+        job = ExportJob(organization=self.org, zone=other_zone, resource="user_logs")
+        self.assertEqual(job.get_user_ids(), [])
+
+    def test_logs_are_exported_in_user_chunks(self):
+        for student in self.students:
+            self.create_attempt_logs(student, n=2)
+        with patch("centralserver.central.models.EXPORT_USER_CHUNK_SIZE", 2):
+            rows = self.run_job("attempt_logs", zone=self.zone)
+        self.assertEqual(len(rows), 7)
+
+
+class ExportProgressTests(ExportJobTestCase):
+
+    def test_run_records_progress(self):
+        self.create_attempt_logs(self.students[0], n=4)
+        job = ExportJob(organization=self.org, facility=self.facility, resource="attempt_logs")
+        job.save()
+        job.run()
+        job = ExportJob.objects.get(id=job.id)
+        self.assertEqual(job.rows_estimated, 4)
+        self.assertEqual(job.rows_written, 4)
+        self.assertEqual(
+            sorted(job.get_progress()["timings"].keys()),
+            ["estimate", "first_row", "scope", "stream"],
+        )
+
+    @unittest.skipUnless(reset_peak_memory(), "The peak resident memory can't be reset")
+    def test_peak_memory_is_that_of_the_job(self):
+        self.create_attempt_logs(self.students[0], n=4)
+        # Raises the peak of the process by 50MB before the job
+        memory = bytearray(50 * 1024 * 1024)
+        del memory
+        job = ExportJob(organization=self.org, facility=self.facility, resource="attempt_logs")
+        job.save()
+        job.run()
+        peak_memory = ExportJob.objects.get(id=job.id).peak_memory
+        self.assertIsNotNone(peak_memory)
+        self.assertTrue(0 <= peak_memory < 50 * 1024)
+
+    def test_eta_of_running_job(self):
+        job = ExportJob(organization=self.org, resource="attempt_logs", rows_estimated=300, rows_written=100)
+        job.save()
+        job.started = timezone.now() - datetime.timedelta(seconds=10)
+        progress = job.get_progress()
+        self.assertEqual(progress["status"], "running")
+        self.assertEqual(progress["percent"], 33)
+        self.assertTrue(19 <= progress["eta_seconds"] <= 20)
+
+    def test_progress_api(self):
+        job = ExportJob(organization=self.org, resource="user_logs")
+        job.save()
+        self.client.login(username=self.user.username, password=self.user.real_password)
+        response = self.client.get(reverse("export_job_progress"), {"org_id": self.org.id})
+        self.assertEqual(response.status_code, 200)
+        jobs = json.loads(response.content)["jobs"]
+        self.assertEqual([(j["id"], j["status"]) for j in jobs], [(job.id, "requested")])
+
+    def test_progress_api_of_other_organization(self):
+        ExportJob(organization=self.org, resource="user_logs").save()
+        outsider = User.objects.create_user("outsider", "outsider@example.com", "password")
+        other_org = self.create_organization(name="other-org", owner=outsider)
+        other_org.users.add(outsider)
+        self.client.login(username="outsider", password="password")
+        response = self.client.get(reverse("export_job_progress"), {"org_id": self.org.id})
+        self.assertEqual(response.status_code, 403)
+
+
+class ExportReuseTests(ExportJobTestCase):
+
+    def submit(self, resource="attempt_logs", incremental=False):
+        data = {
+            "submitted": 1,
+            "zone": self.zone.id,
+            "resource": resource,
+        }
+        if incremental:
+            data["incremental"] = "on"
+        form = ExportForm(self.org, data=data)
+        self.assertTrue(form.is_valid(), form.errors)
+        return form, form.save()
+
+    def test_pending_job_is_reused(self):
+        __, job = self.submit()
+        form, duplicate = self.submit()
+        self.assertTrue(form.reused)
+        self.assertEqual(duplicate.id, job.id)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_other_resource_is_not_reused(self):
+        self.submit()
+        form, __ = self.submit(resource="exercise_logs")
+        self.assertFalse(form.reused)
+        self.assertEqual(ExportJob.objects.count(), 2)
+
+    def test_incremental_job_is_not_reused_for_full_export(self):
+        __, job = self.submit(incremental=True)
+        form, duplicate = self.submit()
+        self.assertFalse(form.reused)
+        self.assertFalse(duplicate.incremental)
+
+    def test_full_job_is_reused_for_incremental_export(self):
+        __, job = self.submit()
+        form, duplicate = self.submit(incremental=True)
+        self.assertTrue(form.reused)
+        self.assertEqual(duplicate.id, job.id)
+
+    def test_recently_completed_job_is_reused(self):
+        __, job = self.submit()
+        job.run()
+        job.completed = timezone.now()
+        job.save()
+        form, duplicate = self.submit()
+        self.assertTrue(form.reused)
+        self.assertEqual(duplicate.id, job.id)
+
+    def test_stale_job_is_not_reused(self):
+        __, job = self.submit()
+        job.run()
+        job.completed = timezone.now() - datetime.timedelta(seconds=EXPORT_REUSE_SECONDS + 60)
+        job.save()
+        form, duplicate = self.submit()
+        self.assertFalse(form.reused)
+        self.assertNotEqual(duplicate.id, job.id)
+
+
+class ExportDownloadTests(ExportJobTestCase):
+
+    def setUp(self):
+        super(ExportDownloadTests, self).setUp()
+        self.job = ExportJob(organization=self.org, facility=self.facility, resource="user_logs")
+        self.job.save()
+        self.job.run()
+        self.job.completed = timezone.now()
+        self.job.save()
+        self.url = reverse("data_export_csv", kwargs={"jobid": self.job.id}) + "?org_id=%s" % self.org.id
+        self.client.login(username=self.user.username, password=self.user.real_password)
+        with open(self.job.get_file_path(), "rb") as f:
+            self.file_data = f.read()
+
+    def test_download_has_etag_and_length(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), len(self.file_data))
+        self.assertEqual("".join(response.streaming_content), self.file_data)
+        self.assertTrue(response["ETag"])
+
+    def test_byte_range(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=10-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual("".join(response.streaming_content), self.file_data[10:])
+        self.assertEqual(response["Content-Range"], "bytes 10-%d/%d" % (len(self.file_data) - 1, len(self.file_data)))
+
+    def test_head(self):
+        response = self.client.head(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response["Content-Length"]), len(self.file_data))
+        self.assertEqual(response.content, "")
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_RANGE="bytes=%d-" % len(self.file_data))
+        self.assertEqual(response.status_code, 416)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")["ETag"]
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_accel_redirect(self):
+        with self.settings(CSV_EXPORT_SENDFILE="x-accel-redirect", CSV_EXPORT_ACCEL_PREFIX="/protected/"):
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response["X-Accel-Redirect"],
+            "/protected/%s/%s" % (self.org.id, os.path.basename(self.job.get_file_path())),
+        )
+
+
+class ExerciseLogExportTests(ExportJobTestCase):
+
+    def test_attempt_statistics(self):
+        student = self.students[0]
+        ExerciseLog(user=student, exercise_id="addition_1", zone_fallback=self.zone).save()
+        ExerciseLog(user=self.students[1], exercise_id="addition_1", zone_fallback=self.zone).save()
+        self.create_attempt_logs(student, n=3, context_type="exercise", correct=True)
+        self.create_attempt_logs(student, n=2, context_type="playlist", correct=False,
+                                 timestamp=datetime.datetime(2015, 6, 1))
+        self.create_attempt_logs(student, n=4, context_type="exercise_fixedblock", correct=True)
+        self.create_attempt_logs(student, n=1, context_type="playlist_fixedblock", correct=False)
+        # Attempts at another exercise must not be counted
+        self.create_attempt_logs(student, exercise_id="subtraction_1", n=5)
+
+        rows = self.run_job("exercise_logs", facility=self.facility)
+        header = rows[0]
+        rows = dict((row[header.index("username")], dict(zip(header, row))) for row in rows[1:])
+
+        stats = rows[student.username]
+        self.assertEqual(stats["part1_answered"], "5")
+        self.assertEqual(stats["part1_correct"], "3")
+        self.assertEqual(stats["part2_attempted"], "5")
+        self.assertEqual(stats["part2_correct"], "4")
+        self.assertEqual(stats["timestamp_first"], str(datetime.datetime(2015, 6, 1)))
+        self.assertEqual(stats["timestamp_last"], str(datetime.datetime(2016, 1, 1, 12, 2)))
+
+        no_attempts = rows[self.students[1].username]
+        self.assertEqual(no_attempts["part1_answered"], "0")
+        self.assertEqual(no_attempts["timestamp_first"], "")
+
+
+class ExportJobClaimTests(ExportJobTestCase):
+
+    def test_claimed_job_is_not_claimed_twice(self):
+        job1 = ExportJob.objects.create(organization=self.org, resource="user_logs")
+        job2 = ExportJob.objects.create(organization=self.org, resource="user_logs")
+
+        self.assertEqual(ExportJob.claim_next("worker-1").id, job1.id)
+        self.assertEqual(ExportJob.claim_next("worker-2").id, job2.id)
+        self.assertEqual(ExportJob.claim_next("worker-3"), None)
+
+    def test_abandoned_job_is_reclaimed(self):
+        job = ExportJob.objects.create(organization=self.org, resource="user_logs")
+        crashed = ExportJob.claim_next("worker-1")
+        expired = crashed.heartbeat - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS + 1)
+        ExportJob.objects.filter(id=job.id).update(heartbeat=expired)
+
+        reclaimed = ExportJob.claim_next("worker-2")
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.worker, "worker-2")
+
+        # The crashed worker can no longer complete the job
+        with self.assertRaises(ExportJobLeaseLost):
+            crashed.mark_completed()
+        reclaimed.mark_completed()
+        self.assertTrue(ExportJob.objects.get(id=job.id).completed)
+
+    @patch("centralserver.central.models.EXPORT_JOB_MAX_ATTEMPTS", 2)
+    def test_failed_job_is_given_up_after_max_attempts(self):
+        job = ExportJob.objects.create(organization=self.org, resource="user_logs")
+        ExportJob.claim_next("worker-1").mark_failed()
+        self.assertEqual(ExportJob.objects.get(id=job.id).get_progress()["status"], "requested")
+
+        # Released right away for another attempt
+        retried = ExportJob.claim_next("worker-2")
+        self.assertEqual(retried.attempts, 2)
+        retried.mark_failed()
+
+        self.assertEqual(ExportJob.claim_next("worker-3"), None)
+        progress = ExportJob.objects.get(id=job.id).get_progress()
+        self.assertEqual(progress["status"], "failed")
+        self.assertEqual(progress["attempts"], 2)
+
+    @patch("centralserver.central.models.EXPORT_JOB_MAX_ATTEMPTS", 1)
+    def test_crashed_last_attempt_fails_the_job(self):
+        job = ExportJob.objects.create(organization=self.org, resource="user_logs")
+        crashed = ExportJob.claim_next("worker-1")
+        expired = crashed.heartbeat - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS + 1)
+        ExportJob.objects.filter(id=job.id).update(heartbeat=expired)
+
+        self.assertEqual(ExportJob.claim_next("worker-2"), None)
+        self.assertTrue(ExportJob.objects.get(id=job.id).failed)
+
+    def test_failed_job_is_not_reused(self):
+        job = ExportJob.objects.create(organization=self.org, resource="user_logs", failed=timezone.now())
+        self.assertEqual(ExportJob.get_reusable(self.org, None, None, None, "user_logs"), None)
+
+    def test_claimed_job_is_completed_by_run(self):
+        ExportJob.objects.create(organization=self.org, resource="user_logs")
+        job = ExportJob.claim_next("worker-1")
+        job.run()
+
+        self.assertTrue(ExportJob.objects.get(id=job.id).completed)
+        self.assertEqual(os.listdir(os.path.dirname(job.get_file_path())), [os.path.basename(job.get_file_path())])
+
+    def test_lost_job_does_not_write_its_file(self):
+        ExportJob.objects.create(organization=self.org, resource="user_logs")
+        job = ExportJob.claim_next("worker-1")
+        ExportJob.objects.filter(id=job.id).update(worker="worker-2")
+
+        with self.assertRaises(ExportJobLeaseLost):
+            job.run()
+        self.assertEqual(os.listdir(os.path.dirname(job.get_file_path())), [])
+
+    def test_lease_is_renewed_before_streaming(self):
+        ExportJob.objects.create(organization=self.org, resource="attempt_logs")
+        job = ExportJob.claim_next("worker-1")
+        old_heartbeat = job.heartbeat - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS)
+        ExportJob.objects.filter(id=job.id).update(heartbeat=old_heartbeat)
+        job.heartbeat = old_heartbeat
+
+        job.estimate_rows()
+        self.assertTrue(ExportJob.objects.get(id=job.id).heartbeat > old_heartbeat)
+
+
+class ExportScheduleTests(ExportJobTestCase):
+
+    def create_job(self, rows_estimated, organization=None, **kwargs):
+        job = ExportJob(
+            organization=organization or self.org,
+            resource="attempt_logs",
+            rows_estimated=rows_estimated,
+            **kwargs
+        )
+        job.save()
+        return job
+
+    def test_shortest_job_first(self):
+        large = self.create_job(10000)
+        small = self.create_job(10)
+        self.assertEqual(ExportJob.claim_next("worker1").id, small.id)
+        self.assertEqual(ExportJob.claim_next("worker2").id, large.id)
+
+    def test_organization_fairness(self):
+        other_org = self.create_organization(owner=self.user)
+        self.create_job(10, started=timezone.now(), heartbeat=timezone.now())
+        busy = self.create_job(10)
+        waiting = self.create_job(1000, organization=other_org)
+        self.assertEqual(ExportJob.claim_next("worker1").id, waiting.id)
+        self.assertEqual(ExportJob.claim_next("worker2").id, busy.id)
+
+    def test_overdue_job_goes_first(self):
+        large = self.create_job(10000)
+        ExportJob.objects.filter(id=large.id).update(
+            requested=timezone.now() - datetime.timedelta(seconds=EXPORT_MAX_WAIT_SECONDS + 60),
+        )
+        self.create_job(10)
+        self.assertEqual(ExportJob.claim_next("worker1").id, large.id)
+
+    def test_estimate_pending(self):
+        self.create_attempt_logs(self.students[0], n=3)
+        job = self.create_job(None)
+        ExportJob.estimate_pending()
+        self.assertEqual(ExportJob.objects.get(id=job.id).rows_estimated, 3)
+
+    def test_job_is_estimated_by_one_worker(self):
+        job = self.create_job(None)
+        # Another worker is estimating it
+        ExportJob.objects.filter(id=job.id).update(estimating=timezone.now())
+        with patch.object(ExportJob, "estimate_rows", return_value=5) as estimate_rows:
+            ExportJob.estimate_pending()
+        self.assertFalse(estimate_rows.called)
+        self.assertEqual(ExportJob.objects.get(id=job.id).rows_estimated, None)
+
+    def test_abandoned_estimate_is_taken_over(self):
+        job = self.create_job(None)
+        ExportJob.objects.filter(id=job.id).update(
+            estimating=timezone.now() - datetime.timedelta(seconds=EXPORT_JOB_LEASE_SECONDS + 60),
+        )
+        with patch.object(ExportJob, "estimate_rows", return_value=5):
+            ExportJob.estimate_pending()
+        self.assertEqual(ExportJob.objects.get(id=job.id).rows_estimated, 5)
+
+    def test_failed_estimate_is_not_retried_by_every_poll(self):
+        job = self.create_job(None)
+        with patch.object(ExportJob, "estimate_rows", side_effect=ValueError) as estimate_rows:
+            ExportJob.estimate_pending()
+            ExportJob.estimate_pending()
+        self.assertEqual(estimate_rows.call_count, 1)
+        self.assertEqual(ExportJob.objects.get(id=job.id).rows_estimated, None)
+
+
+class ShardedExportTests(ExportJobTestCase):
+
+    def setUp(self):
+        super(ShardedExportTests, self).setUp()
+        facility2 = Facility(name="fac2", zone_fallback=self.zone)
+        facility2.save()
+        student = FacilityUser(username="student3", facility=facility2, zone_fallback=self.zone)
+        student.set_password("password")
+        student.save()
+        self.students.append(student)
+        for i, student in enumerate(self.students):
+            self.create_attempt_logs(student, n=i + 1)
+
+    @patch("centralserver.central.models.EXPORT_SHARD_MIN_ROWS", 1)
+    @patch("centralserver.central.models.EXPORT_SHARD_PROCESSES", 2)
+    def test_shards_are_stitched_in_order(self):
+        serial_rows = self.run_job("attempt_logs", zone=self.zone)
+
+        job = ExportJob(organization=self.org, zone=self.zone, resource="attempt_logs")
+        job.save()
+        job.rows_estimated = job.estimate_rows()
+        shards = job.get_shards()
+        self.assertEqual(len(shards), 2)
+
+        # Shards are run in this process, as the test data is not visible
+        # to other database connections.
+        shard_paths = []
+        for n, user_ids in enumerate(shards):
+            shard_path = "{0}.shard{1}".format(job.get_file_path(compressed=True), n)
+            job.rows_written += run_export_shard(job.id, user_ids, shard_path)
+            shard_paths.append(shard_path)
+        job.stitch_shards(job.get_file_path(compressed=True), shard_paths)
+
+        with job.open_file() as f:
+            sharded_rows = list(csv.reader(f))
+        self.assertEqual(sharded_rows[0], serial_rows[0])
+        self.assertEqual(sorted(sharded_rows[1:]), sorted(serial_rows[1:]))
+        self.assertEqual(len(sharded_rows), 1 + 1 + 2 + 3 + 4)
+
+    def test_small_jobs_are_not_sharded(self):
+        job = ExportJob(organization=self.org, zone=self.zone, resource="attempt_logs", rows_estimated=10)
+        self.assertEqual(job.get_shards(), None)
+
+
+class ExportRetentionTests(ExportJobTestCase):
+
+    def create_completed_job(self, size, organization=None, **kwargs):
+        job = ExportJob(organization=organization or self.org, resource="user_logs", **kwargs)
+        job.save()
+        with open(job.get_file_path(compressed=True), "wb") as f:
+            f.write("x" * size)
+        job.completed = kwargs.get("completed", timezone.now())
+        job.save()
+        return job
+
+    def evicted_ids(self):
+        return sorted(ExportJob.objects.exclude(evicted=None).values_list("id", flat=True))
+
+    @patch("centralserver.central.models.EXPORT_QUOTA_BYTES", 250)
+    def test_least_recently_downloaded_is_evicted(self):
+        now = timezone.now()
+        downloaded = self.create_completed_job(100, completed=now - datetime.timedelta(days=3), last_downloaded=now)
+        stale = self.create_completed_job(100, completed=now - datetime.timedelta(days=2))
+        self.create_completed_job(100, completed=now - datetime.timedelta(days=1))
+        ExportJob.enforce_quotas()
+        self.assertEqual(self.evicted_ids(), [stale.id])
+        self.assertFalse(os.path.exists(stale.get_file_path()))
+        self.assertTrue(os.path.exists(downloaded.get_file_path()))
+
+    @patch("centralserver.central.models.EXPORT_ORG_QUOTA_BYTES", 150)
+    def test_organization_quota(self):
+        other_org = self.create_organization(owner=self.user)
+        old = self.create_completed_job(100, completed=timezone.now() - datetime.timedelta(days=1))
+        self.create_completed_job(100)
+        self.create_completed_job(100, organization=other_org, completed=timezone.now() - datetime.timedelta(days=2))
+        ExportJob.enforce_quotas()
+        self.assertEqual(self.evicted_ids(), [old.id])
+
+    @patch("centralserver.central.models.EXPORT_QUOTA_BYTES", 50)
+    def test_dry_run_keeps_files(self):
+        job = self.create_completed_job(100)
+        self.assertEqual([j.id for j in ExportJob.enforce_quotas(dry_run=True)], [job.id])
+        self.assertEqual(self.evicted_ids(), [])
+        self.assertTrue(os.path.exists(job.get_file_path()))
+
+
+class IncrementalExportTests(ExportJobTestCase):
+
+    def complete_job(self, resource, started):
+        job = ExportJob(organization=self.org, facility=self.facility, resource=resource)
+        job.save()
+        job.run()
+        job.started = started
+        job.completed = started
+        job.save()
+        return job
+
+    def test_attempt_logs_are_appended(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        self.complete_job("attempt_logs", started=datetime.datetime(2016, 6, 1))
+
+        self.create_attempt_logs(self.students[1], n=3, timestamp=datetime.datetime(2016, 7, 1))
+        rows = self.run_job("attempt_logs", facility=self.facility, incremental=True)
+
+        self.assertEqual(rows[0], ExportJob.COLUMNS["attempt_logs"])
+        self.assertEqual(len(rows), 1 + 5)
+
+    def test_changed_exercise_logs_replace_previous_rows(self):
+        log = ExerciseLog(user=self.students[0], exercise_id="addition_1", points=10,
+                          latest_activity_timestamp=datetime.datetime(2016, 1, 1), zone_fallback=self.zone)
+        log.save()
+        self.complete_job("exercise_logs", started=datetime.datetime(2016, 6, 1))
+
+        log.points = 20
+        log.latest_activity_timestamp = datetime.datetime(2016, 7, 1)
+        log.save()
+        rows = self.run_job("exercise_logs", facility=self.facility, incremental=True)
+
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][rows[0].index("points")], "20")
+
+    def test_rows_of_users_out_of_scope_are_dropped(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        self.create_attempt_logs(self.students[1], n=1)
+        self.complete_job("attempt_logs", started=datetime.datetime(2016, 6, 1))
+
+        other_facility = Facility(name="other", zone_fallback=self.zone)
+        other_facility.save()
+        self.students[0].facility = other_facility
+        self.students[0].save()
+        rows = self.run_job("attempt_logs", facility=self.facility, incremental=True)
+
+        self.assertEqual(len(rows), 1 + 1)
+        self.assertEqual(rows[1][rows[0].index("user_id")], self.students[1].id)
+
+    def test_without_previous_job_everything_is_exported(self):
+        self.create_attempt_logs(self.students[0], n=2)
+        rows = self.run_job("attempt_logs", facility=self.facility, incremental=True)
+        self.assertEqual(len(rows), 3)
+
+
+class ContentTitleTests(TestCase):
+
+    def setUp(self):
+        CONTENT_TITLE_CACHE.clear()
+
+    @patch("centralserver.central.models.get_content_items")
+    def test_titles_are_looked_up_once(self, get_content_items):
+        get_content_items.return_value = [
+            {"id": "video_1", "kind": "Video", "title": "Counting"},
+            {"id": "video_1", "kind": "Topic", "title": "Topic with the same id"},
+        ]
+        titles = get_content_titles(["video_1", "video_1", "missing"])
+        self.assertEqual(titles, {"video_1": "Counting", "missing": "Unknown content"})
+        self.assertEqual(get_content_items.call_count, 1)
+
+        # Served from the cache from now on
+        self.assertEqual(get_content_titles(["video_1"]), {"video_1": "Counting"})
+        self.assertEqual(get_content_items.call_count, 1)
+
+    @patch("centralserver.central.models.get_content_items")
+    def test_missing_titles_are_not_cached(self, get_content_items):
+        get_content_items.return_value = []
+        self.assertEqual(get_content_titles(["video_2"]), {"video_2": "Unknown content"})
+        self.assertNotIn("video_2", CONTENT_TITLE_CACHE)
+
+        # Found once the content database has it
+        get_content_items.return_value = [{"id": "video_2", "kind": "Video", "title": "Shapes"}]
+        self.assertEqual(get_content_titles(["video_2"]), {"video_2": "Shapes"})
+
+
+class RatingExportTests(ExportJobTestCase):
+
+    @patch("centralserver.central.models.get_content_titles")
+    def test_rating_synced_after_title_lookup(self, get_content_titles):
+        ContentRating(user=self.students[0], content_kind="Video", content_id="video_1", quality=5, zone_fallback=self.zone).save()
+        # The rating was not there yet when titles were looked up
+        get_content_titles.side_effect = [{}, {"video_1": "Counting"}]
+
+        rows = self.run_job("ratings", facility=self.facility)
+        self.assertEqual(rows[1][rows[0].index("content_title")], "Counting")
+
+
+class DeviceLogExportTests(ExportJobTestCase):
+
+    def test_sync_statistics(self):
+        device = Device(name="laptop", public_key="key-1")
+        device.save()
+        DeviceZone(device=device, zone=self.zone).save()
+        unsynced = Device(name="unsynced", public_key="key-2")
+        unsynced.save()
+        DeviceZone(device=unsynced, zone=self.zone).save()
+        for i in range(3):
+            SyncSession(client_nonce="nonce%d" % i, client_device=device).save()
+
+        rows = self.run_job("device_logs", zone=self.zone)
+        header = rows[0]
+        rows = dict((row[header.index("name")], dict(zip(header, row))) for row in rows[1:])
+
+        self.assertEqual(rows["laptop"]["total_sync_sessions"], "3")
+        self.assertNotEqual(rows["laptop"]["last_sync"], "Never")
+        self.assertEqual(rows["unsynced"]["total_sync_sessions"], "0")
+        self.assertEqual(rows["unsynced"]["last_sync"], "Never")
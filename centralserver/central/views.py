@@ -2,18 +2,22 @@
 """
 from annoying.decorators import render_to
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
 from django.core.paginator import Paginator
+from django.core.servers.basehttp import FileWrapper
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseNotFound, HttpResponseRedirect, HttpResponseServerError
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 
+from .downloads import DOWNLOAD_CHUNK_SIZE, serve_file
 from .forms import OrganizationForm, OrganizationInvitationForm, ExportForm
 from .models import Organization, OrganizationInvitation, DeletionRecord, get_or_create_user_profile
 from fle_utils.feeds.models import FeedListing
@@ -261,14 +265,25 @@ def export(request):
         form = ExportForm(org, data=request.POST)
         if form.is_valid() and form.cleaned_data['submitted'] > 0:
             job = form.save()
-            messages.success(request, _(
-                "Job ID {id} was created and will run after {cnt} other jobs "
-                "are completed. Please refresh this page to download the CSV data "
-                "and expect up to 5-10 minutes before the file is generated."
-            ).format(
-                id=job.id,
-                cnt=ExportJob.objects.exclude(id=job.id).filter(completed=None).count(),
-            ))
+            if form.reused and job.completed:
+                messages.success(request, _(
+                    "The same data was recently exported by job ID {id}. "
+                    "Please download the CSV data below."
+                ).format(id=job.id))
+            elif form.reused:
+                messages.success(request, _(
+                    "The same data is already being exported by job ID {id}. "
+                    "Its progress is shown below."
+                ).format(id=job.id))
+            else:
+                messages.success(request, _(
+                    "Job ID {id} was created and will run after {cnt} other jobs "
+                    "are completed. Its progress is shown below, and a link to "
+                    "download the CSV data once the file is generated."
+                ).format(
+                    id=job.id,
+                    cnt=ExportJob.objects.exclude(id=job.id).filter(completed=None).count(),
+                ))
             # This is not pretty, but the usage of querystring stuff for
             # maintaining state ain't pretty neither. Some old school PHP
             # patterns :)
@@ -300,14 +315,32 @@ def export(request):
 def export_csv(request, jobid=0):
     org_id = request.GET.get("org_id", "")
     job = get_object_or_404(
-        ExportJob.objects.filter(organization__id=org_id),
+        ExportJob.objects.filter(organization__id=org_id, evicted=None),
         id=jobid,
     )
-    f = open(job.get_file_path(), "r")
-    response = StreamingHttpResponse(
-        f,
-        content_type="text/csv",
-    )
+    # Files least recently downloaded are the first to be deleted when
+    # running out of disk space
+    ExportJob.objects.filter(id=job.id).update(last_downloaded=timezone.now())
+    # Compressed exports are sent as they are to clients accepting gzip,
+    # and decompressed while streaming for everyone else. Only the former
+    # can be resumed or handed to the front-end web server.
+    accepts_gzip = "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", "")
+    if job.is_compressed() and accepts_gzip:
+        response = serve_file(
+            request,
+            job.get_file_path(),
+            content_type="text/csv",
+            sendfile=getattr(settings, "CSV_EXPORT_SENDFILE", None),
+            sendfile_root=settings.CSV_EXPORT_ROOT,
+            accel_prefix=getattr(settings, "CSV_EXPORT_ACCEL_PREFIX", None),
+        )
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = StreamingHttpResponse(
+            FileWrapper(job.open_file(), DOWNLOAD_CHUNK_SIZE),
+            content_type="text/csv",
+        )
+    response['Vary'] = 'Accept-Encoding'
     response['Content-Disposition'] = 'attachment; filename="{org}_{type}_{dtm}.csv"'.format(
         org=job.organization.name,
         type=job.resource,
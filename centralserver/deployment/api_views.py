@@ -0,0 +1,73 @@
+"""
+"""
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Min, Q, Sum
+from django.utils.translation import ugettext as _
+
+from fle_utils.internet.classes import JsonResponse, JsonResponseMessageError
+from fle_utils.internet.decorators import api_handle_error_with_json
+from kalite.shared.decorators.auth import require_authorized_admin
+from .models import FACILITY_GRID_MAX_ZOOM, FacilityLocation
+
+
+# Facilities are clustered on grid cells this many zoom levels below that of
+# the map, so 2 ** 3 = 8 clusters across a map tile at most.
+FACILITY_MAP_CLUSTER_ZOOM = getattr(settings, "FACILITY_MAP_CLUSTER_ZOOM", 3)
+
+
+def parse_bbox(bbox):
+    """
+    Returns (west, south, east, north) from "west,south,east,north" in
+    degrees. West is greater than east for a box crossing the antimeridian.
+    """
+    west, south, east, north = [float(coord) for coord in bbox.split(",")]
+    if not (-90 <= south <= north <= 90 and -180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("Invalid bounding box: %s" % bbox)
+    return west, south, east, north
+
+
+@require_authorized_admin
+@api_handle_error_with_json
+def facility_map(request):
+    """
+    Returns the facilities within the bbox as clusters, one per grid cell at
+    the map's zoom, with the number of facilities and users in each. Reads the
+    facility map grid (see deployment.models.FacilityLocation) only.
+    """
+    try:
+        west, south, east, north = parse_bbox(request.GET.get("bbox", "-180,-90,180,90"))
+        zoom = int(request.GET.get("zoom", 0))
+    except ValueError:
+        return JsonResponseMessageError(_("bbox must be west,south,east,north in degrees, and zoom an integer."), status=400)
+    cell_zoom = max(1, min(FACILITY_GRID_MAX_ZOOM, zoom + FACILITY_MAP_CLUSTER_ZOOM))
+
+    locations = FacilityLocation.objects.filter(latitude__range=(south, north))
+    if west <= east:
+        locations = locations.filter(longitude__range=(west, east))
+    else:
+        locations = locations.filter(Q(longitude__gte=west) | Q(longitude__lte=east))
+
+    # cell_zoom is an integer, so it is safe to format into the SQL
+    clusters = locations \
+        .extra(select={"cell": "SUBSTR(grid_key, 1, %d)" % cell_zoom}) \
+        .values("cell") \
+        .annotate( \
+            n_facilities=Count("facility"), \
+            n_users=Sum("n_actual_users"), \
+            avg_latitude=Avg("latitude"), avg_longitude=Avg("longitude"), \
+            min_latitude=Min("latitude"), max_latitude=Max("latitude"), \
+            min_longitude=Min("longitude"), max_longitude=Max("longitude")) \
+        .order_by()
+
+    return JsonResponse({
+        "zoom": zoom,
+        "cell_zoom": cell_zoom,
+        "clusters": [{
+            "cell": cluster["cell"],
+            "latitude": cluster["avg_latitude"],
+            "longitude": cluster["avg_longitude"],
+            "bbox": [cluster["min_longitude"], cluster["min_latitude"], cluster["max_longitude"], cluster["max_latitude"]],
+            "facilities": cluster["n_facilities"],
+            "users": cluster["n_users"] or 0,
+        } for cluster in clusters],
+    })
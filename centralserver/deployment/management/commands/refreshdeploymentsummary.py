@@ -0,0 +1,25 @@
+"""
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from centralserver.deployment.models import rebuild_deployment_summaries
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the deployment summary read by the deployments CMS from all "
+        "sync sessions, devices and facilities. It is otherwise refreshed as "
+        "sync sessions are closed."
+    )
+
+    def handle(self, *args, **options):
+        # Readers see either the old or the new summary, never a partial one
+        with transaction.commit_on_success():
+            rebuild_deployment_summaries()
+        logger.info("Rebuilt the deployment summary")
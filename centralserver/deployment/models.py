@@ -0,0 +1,340 @@
+"""
+Summary of each deployment shown in the deployments CMS. Aggregating all sync
+sessions and facility users on every page view does not scale, so the totals
+are kept in these tables instead. Only closed sync sessions are counted. Sync
+totals are incremented whenever a sync session is closed, and the facilities
+of the device's zones recounted then. Everything is recounted by the
+refreshdeploymentsummary command, which is meant to be run periodically.
+"""
+import logging
+import math
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.signals import m2m_changed, post_save
+
+from centralserver.central.models import Organization
+from kalite.facility.models import Facility
+from securesync.models import Device, DeviceZone, SyncSession, Zone
+
+
+logger = logging.getLogger(__name__)
+
+# Zoom level of the finest cells of the facility map grid, about 600m wide
+FACILITY_GRID_MAX_ZOOM = getattr(settings, "FACILITY_GRID_MAX_ZOOM", 16)
+
+# Web mercator can't show the poles
+MAX_LATITUDE = 85.05112878
+
+
+class OrganizationSummary(models.Model):
+    organization = models.OneToOneField(Organization, primary_key=True, related_name="summary")
+    total_users = models.IntegerField(default=0)
+    sync_sessions = models.IntegerField(default=0)
+    models_synced = models.IntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # The deployments CMS pages through organizations in this order
+        index_together = [["total_users", "models_synced", "sync_sessions"]]
+
+    def __unicode__(self):
+        return u"Summary of %s" % self.organization_id
+
+
+class DeviceSummary(models.Model):
+    """
+    Sync sessions of a device, once per organization owning its zone
+    """
+    device = models.ForeignKey(Device, related_name="+")
+    zone = models.ForeignKey(Zone, related_name="+")
+    organization = models.ForeignKey(Organization, related_name="device_summaries")
+    sync_sessions = models.IntegerField(default=0)
+    models_synced = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("device", "organization")
+
+
+class FacilitySummary(models.Model):
+    """
+    Users of a facility, once per organization owning its zone
+    """
+    facility = models.ForeignKey(Facility, related_name="+")
+    organization = models.ForeignKey(Organization, related_name="facility_summaries")
+    n_actual_users = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("facility", "organization")
+
+
+class FacilityLocation(models.Model):
+    """
+    Position of a facility on the facility map, with the quadkey of the grid
+    cell containing it at FACILITY_GRID_MAX_ZOOM. The key of the cell at any
+    lower zoom is a prefix of it, so facilities are clustered by grouping on
+    a prefix.
+    """
+    facility = models.OneToOneField(Facility, primary_key=True, related_name="+")
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    grid_key = models.CharField(max_length=FACILITY_GRID_MAX_ZOOM, db_index=True)
+    n_actual_users = models.IntegerField(default=0)
+
+    class Meta:
+        index_together = [["latitude", "longitude"]]
+
+
+def get_grid_key(latitude, longitude, zoom=FACILITY_GRID_MAX_ZOOM):
+    """
+    Returns the quadkey of the web mercator tile containing the point at the
+    zoom level: one digit per level, of the quarter of the tile above it.
+    """
+    latitude = max(-MAX_LATITUDE, min(MAX_LATITUDE, latitude))
+    sin_latitude = math.sin(math.radians(latitude))
+    x = (longitude + 180) / 360.0
+    y = 0.5 - math.log((1 + sin_latitude) / (1 - sin_latitude)) / (4 * math.pi)
+
+    size = 2 ** zoom
+    tile_x = max(0, min(size - 1, int(x * size)))
+    tile_y = max(0, min(size - 1, int(y * size)))
+
+    digits = []
+    for level in range(zoom, 0, -1):
+        mask = 1 << (level - 1)
+        digits.append(str((1 if tile_x & mask else 0) + (2 if tile_y & mask else 0)))
+    return "".join(digits)
+
+
+def refresh_device_summaries(device_ids=None):
+    """
+    Recounts the closed sync sessions of the devices, or of all devices.
+    Returns the ids of the organizations whose totals have changed.
+    """
+    device_zones = DeviceZone.objects.all()
+    sessions = SyncSession.objects.filter(closed=True)
+    old_summaries = DeviceSummary.objects.all()
+    if device_ids is not None:
+        device_zones = device_zones.filter(device__in=device_ids)
+        sessions = sessions.filter(client_device__in=device_ids)
+        old_summaries = old_summaries.filter(device__in=device_ids)
+
+    # Sessions that are never closed aren't counted when they are saved
+    # either, see add_sync_session()
+    session_totals = dict(
+        (row["client_device"], row)
+        for row in sessions \
+            .values("client_device") \
+            .annotate(n_sessions=Count("client_nonce"), n_models=Sum("models_uploaded")) \
+            .order_by()
+    )
+    device_data = device_zones.values("device__id", "zone__id", "zone__organization__id")
+
+    summaries = [
+        DeviceSummary(
+            device_id=devzone["device__id"],
+            zone_id=devzone["zone__id"],
+            organization_id=devzone["zone__organization__id"],
+            sync_sessions=session_totals.get(devzone["device__id"], {}).get("n_sessions") or 0,
+            models_synced=session_totals.get(devzone["device__id"], {}).get("n_models") or 0,
+        )
+        for devzone in device_data
+        if devzone["zone__organization__id"]
+    ]
+
+    # Replaced at once, so that the CMS never misses a summary
+    with transaction.commit_on_success():
+        org_ids = set(old_summaries.values_list("organization", flat=True))
+        old_summaries.delete()
+        DeviceSummary.objects.bulk_create(summaries, batch_size=500)
+    return org_ids | set(summary.organization_id for summary in summaries)
+
+
+def refresh_facility_summaries(zone_ids=None):
+    """
+    Recounts the users of the facilities of the zones, or of all facilities,
+    and places them on the facility map. Returns the ids of the organizations
+    whose totals have changed.
+    """
+    facilities = Facility.objects.filter(signed_by__devicemetadata__is_demo_device=False)
+    old_summaries = FacilitySummary.objects.all()
+    old_locations = FacilityLocation.objects.all()
+    if zone_ids is not None:
+        facilities = facilities.filter(
+            models.Q(signed_by__devicezone__zone__in=zone_ids) | models.Q(zone_fallback__in=zone_ids)
+        )
+        facility_ids = list(facilities.values_list("id", flat=True))
+        old_summaries = old_summaries.filter(facility__in=facility_ids)
+        old_locations = old_locations.filter(facility__in=facility_ids)
+
+    facility_data = facilities \
+        .annotate(n_actual_users=Count("facilityuser", distinct=True)) \
+        .values( \
+            "id", \
+            "n_actual_users", \
+            "latitude", "longitude", \
+            "zone_fallback__organization__id", \
+            "signed_by__devicezone__zone__organization__id",)
+
+    summaries = {}
+    locations = {}
+    for fac in facility_data:
+        if fac["latitude"] is not None and fac["longitude"] is not None:
+            locations[fac["id"]] = FacilityLocation(
+                facility_id=fac["id"],
+                latitude=fac["latitude"],
+                longitude=fac["longitude"],
+                grid_key=get_grid_key(fac["latitude"], fac["longitude"]),
+                n_actual_users=fac["n_actual_users"] or 0,
+            )
+
+        org_id = fac["signed_by__devicezone__zone__organization__id"] or fac["zone_fallback__organization__id"]
+        if not org_id:
+            continue
+        summaries[(fac["id"], org_id)] = FacilitySummary(
+            facility_id=fac["id"],
+            organization_id=org_id,
+            n_actual_users=fac["n_actual_users"] or 0,
+        )
+
+    with transaction.commit_on_success():
+        org_ids = set(old_summaries.values_list("organization", flat=True))
+        old_summaries.delete()
+        FacilitySummary.objects.bulk_create(summaries.values(), batch_size=500)
+        old_locations.delete()
+        FacilityLocation.objects.bulk_create(locations.values(), batch_size=500)
+    return org_ids | set(org_id for __, org_id in summaries)
+
+
+def refresh_organization_summaries(org_ids=None):
+    """
+    Sums the device and facility summaries of the organizations, or of all
+    organizations.
+    """
+    orgs = Organization.objects.all()
+    if org_ids is not None:
+        orgs = orgs.filter(id__in=org_ids)
+    org_ids = list(orgs.values_list("id", flat=True))
+
+    device_totals = dict(
+        (row["organization"], row)
+        for row in DeviceSummary.objects.filter(organization__in=org_ids) \
+            .values("organization") \
+            .annotate(n_sessions=Sum("sync_sessions"), n_models=Sum("models_synced"))
+    )
+    user_totals = dict(
+        (row["organization"], row["n_users"])
+        for row in FacilitySummary.objects.filter(organization__in=org_ids) \
+            .values("organization") \
+            .annotate(n_users=Sum("n_actual_users"))
+    )
+
+    with transaction.commit_on_success():
+        OrganizationSummary.objects.filter(organization__in=org_ids).delete()
+        OrganizationSummary.objects.bulk_create([
+            OrganizationSummary(
+                organization_id=org_id,
+                total_users=user_totals.get(org_id) or 0,
+                sync_sessions=device_totals.get(org_id, {}).get("n_sessions") or 0,
+                models_synced=device_totals.get(org_id, {}).get("n_models") or 0,
+            )
+            for org_id in org_ids
+        ], batch_size=500)
+
+
+def refresh_zone_summaries(zone_ids):
+    """
+    Refreshes the summaries of the devices and facilities of the zones, and
+    of the organizations owning them
+    """
+    device_ids = list(DeviceZone.objects.filter(zone__in=zone_ids).values_list("device", flat=True))
+    org_ids = refresh_device_summaries(device_ids) | refresh_facility_summaries(zone_ids)
+    org_ids.update(Organization.objects.filter(zones__in=zone_ids).values_list("id", flat=True))
+    refresh_organization_summaries(org_ids)
+
+
+def rebuild_deployment_summaries():
+    refresh_device_summaries()
+    refresh_facility_summaries()
+    refresh_organization_summaries()
+
+
+def refresh_user_totals(org_ids):
+    """
+    Sums the facility summaries of the organizations into their user totals
+    """
+    user_totals = dict(
+        (row["organization"], row["n_users"])
+        for row in FacilitySummary.objects.filter(organization__in=org_ids) \
+            .values("organization") \
+            .annotate(n_users=Sum("n_actual_users"))
+    )
+    for org_id in org_ids:
+        OrganizationSummary.objects.filter(organization=org_id).update(total_users=user_totals.get(org_id) or 0)
+
+
+def add_sync_session(device_id, models_uploaded):
+    """
+    Adds a sync session of the device to the totals of its summaries and
+    their organizations, and recounts the users of the facilities of its
+    zones, which the session may have uploaded. A device without summaries
+    yet is counted from scratch.
+    """
+    zone_ids = list(DeviceZone.objects.filter(device=device_id).values_list("zone", flat=True))
+    with transaction.commit_on_success():
+        device_summaries = DeviceSummary.objects.filter(device=device_id)
+        org_ids = list(device_summaries.values_list("organization", flat=True))
+        if not org_ids:
+            refresh_organization_summaries(refresh_device_summaries([device_id]) | refresh_facility_summaries(zone_ids))
+            return
+        increments = {
+            "sync_sessions": F("sync_sessions") + 1,
+            "models_synced": F("models_synced") + models_uploaded,
+        }
+        device_summaries.update(**increments)
+        OrganizationSummary.objects.filter(organization__in=org_ids).update(**increments)
+        refresh_user_totals(set(org_ids) | refresh_facility_summaries(zone_ids))
+
+
+def refresh_on_session_closed(sender, instance, **kwargs):
+    """
+    Counts a sync session once it is closed, which happens once per session,
+    along with the users it uploaded. Sessions that are never closed are
+    never counted.
+    """
+    if not instance.closed:
+        return
+    try:
+        add_sync_session(instance.client_device_id, instance.models_uploaded or 0)
+    except Exception:
+        # The summary must never break syncing
+        logger.exception("Could not refresh the deployment summary of device %s" % instance.client_device_id)
+
+
+def refresh_on_zones_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Devices and facilities move along with the zones added to or removed from
+    an organization
+    """
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if reverse:
+        zone_ids = [instance.pk]
+    elif pk_set:
+        zone_ids = list(pk_set)
+    else:
+        # Zones are already gone after a clear(), so recount them all
+        rebuild_deployment_summaries()
+        return
+    refresh_zone_summaries(zone_ids)
+
+
+def create_organization_summary(sender, instance, created, **kwargs):
+    if created:
+        OrganizationSummary.objects.get_or_create(organization=instance)
+
+
+post_save.connect(refresh_on_session_closed, sender=SyncSession)
+post_save.connect(create_organization_summary, sender=Organization)
+m2m_changed.connect(refresh_on_zones_changed, sender=Organization.zones.through)
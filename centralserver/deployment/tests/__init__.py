@@ -0,0 +1,2 @@
+from .summary_tests import *
+from .facility_map_tests import *
@@ -0,0 +1,115 @@
+"""
+Tests of the facility map grid and the facility_map endpoint clustering it
+"""
+import json
+
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from ..api_views import parse_bbox
+from ..models import FacilityLocation, get_grid_key, refresh_facility_summaries
+from .summary_tests import DeploymentSummaryTestCase
+
+
+class GridKeyTests(TestCase):
+
+    def test_known_points(self):
+        # Seattle, the example of Bing Maps' tile system
+        self.assertEqual(get_grid_key(47.6, -122.3, zoom=8), "02123003")
+        # Sydney: east of the meridian (x 14 of 16), south of the equator (y 9)
+        self.assertEqual(get_grid_key(-33.87, 151.21, zoom=4), "3112")
+        # The south-east quarter starts right at the origin
+        self.assertEqual(get_grid_key(0, 0, zoom=2), "30")
+
+    def test_edges_are_in_the_last_cells(self):
+        # Beyond web mercator's latitudes, and on the antimeridian
+        self.assertEqual(get_grid_key(-90, 180, zoom=3), "333")
+        self.assertEqual(get_grid_key(90, -180, zoom=3), "000")
+
+    def test_lower_zoom_is_a_prefix(self):
+        key = get_grid_key(-17.7, 178.0)
+        self.assertEqual(len(key), 16)
+        for zoom in range(1, 16):
+            self.assertEqual(get_grid_key(-17.7, 178.0, zoom=zoom), key[:zoom])
+
+
+class ParseBboxTests(TestCase):
+
+    def test_bbox(self):
+        self.assertEqual(parse_bbox("-10,-20.5,30,40"), (-10, -20.5, 30, 40))
+
+    def test_bbox_across_antimeridian(self):
+        west, south, east, north = parse_bbox("170,-20,-170,10")
+        self.assertGreater(west, east)
+        self.assertEqual((west, south, east, north), (170, -20, -170, 10))
+
+    def test_invalid_bbox(self):
+        for bbox in ["", "1,2,3", "a,b,c,d", "0,10,20,5", "-190,0,10,10", "0,-91,10,10"]:
+            self.assertRaises(ValueError, parse_bbox, bbox)
+
+
+class FacilityMapTests(DeploymentSummaryTestCase):
+
+    def setUp(self):
+        super(FacilityMapTests, self).setUp()
+        # Two facilities in Seattle, one in Sydney, and two either side of the
+        # antimeridian, in Fiji and Samoa
+        self.add_facility("seattle-1", 47.60, -122.33, n_users=2)
+        self.add_facility("seattle-2", 47.61, -122.30, n_users=1)
+        self.add_facility("sydney", -33.87, 151.21, n_users=3)
+        self.add_facility("fiji", -17.7, 178.0)
+        self.add_facility("samoa", -14.3, -170.7)
+        refresh_facility_summaries()
+        self.client.login(username=self.user.username, password=self.user.real_password)
+
+    def add_facility(self, name, latitude, longitude, n_users=0):
+        facility = self.create_users(self.zone, n_users, facility_name=name)
+        facility.latitude = latitude
+        facility.longitude = longitude
+        facility.save()
+
+    def get_map(self, **params):
+        response = self.client.get(reverse("facility_map"), params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_facilities_are_located(self):
+        self.assertEqual(FacilityLocation.objects.count(), 5)
+        location = FacilityLocation.objects.get(latitude=-33.87)
+        self.assertEqual(location.grid_key, get_grid_key(-33.87, 151.21))
+        self.assertEqual(location.n_actual_users, 3)
+
+    def test_clusters_by_cell(self):
+        data = self.get_map(zoom=2)
+        self.assertEqual(data["cell_zoom"], 5)
+        clusters = dict((cluster["cell"], cluster) for cluster in data["clusters"])
+        self.assertEqual(len(clusters), 4)
+
+        seattle = clusters[get_grid_key(47.6, -122.3, zoom=5)]
+        self.assertEqual((seattle["facilities"], seattle["users"]), (2, 3))
+        self.assertAlmostEqual(seattle["latitude"], 47.605)
+        self.assertEqual(seattle["bbox"], [-122.33, 47.60, -122.30, 47.61])
+        sydney = clusters[get_grid_key(-33.87, 151.21, zoom=5)]
+        self.assertEqual((sydney["facilities"], sydney["users"]), (1, 3))
+
+    def test_cell_zoom_is_capped(self):
+        self.assertEqual(self.get_map(zoom=20)["cell_zoom"], 16)
+        self.assertEqual(self.get_map(zoom=-5)["cell_zoom"], 1)
+
+    def test_bbox(self):
+        data = self.get_map(bbox="-130,40,-120,50", zoom=2)
+        self.assertEqual([cluster["facilities"] for cluster in data["clusters"]], [2])
+
+    def test_bbox_across_antimeridian(self):
+        data = self.get_map(bbox="175,-20,-170,-10", zoom=10)
+        self.assertEqual(sorted(cluster["longitude"] for cluster in data["clusters"]), [-170.7, 178.0])
+
+    def test_invalid_params(self):
+        for params in [{"bbox": "0,10,20,5"}, {"bbox": "west,south,east,north"}, {"zoom": "near"}]:
+            response = self.client.get(reverse("facility_map"), params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_requires_login(self):
+        self.client.logout()
+        response = self.client.get(reverse("facility_map"))
+        self.assertNotEqual(response.status_code, 200)
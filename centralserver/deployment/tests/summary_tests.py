@@ -0,0 +1,129 @@
+"""
+Tests of the deployment summaries and the deployments CMS reading them
+"""
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from centralserver.central.tests.utils.mixins import CreateAdminMixin, CentralServerMixins, FakeDeviceMixin
+from ..models import DeviceSummary, FacilitySummary, OrganizationSummary, rebuild_deployment_summaries
+from kalite.facility.models import Facility, FacilityUser
+from securesync.models import Device, DeviceZone, SyncSession
+
+
+class DeploymentSummaryTestCase(CreateAdminMixin,
+                                CentralServerMixins,
+                                FakeDeviceMixin,
+                                TestCase):
+
+    def setUp(self):
+        self.setup_fake_device(name="Central")
+        self.user = self.create_admin()
+        self.org = self.create_organization(owner=self.user)
+        self.zone = self.create_zone(organizations=[self.org])
+        self.device = self.create_device(self.zone, "laptop")
+
+    def create_device(self, zone, name):
+        device = Device(name=name, public_key="key-%s" % name)
+        device.save()
+        DeviceZone(device=device, zone=zone).save()
+        return device
+
+    def sync(self, device, models_uploaded=0, closed=True):
+        session = SyncSession(client_nonce="nonce%d" % SyncSession.objects.count(), client_device=device)
+        session.save()
+        session.models_uploaded = models_uploaded
+        session.closed = closed
+        session.save()
+        return session
+
+    def create_users(self, zone, n, facility_name="fac1"):
+        facility = Facility(name=facility_name, zone_fallback=zone)
+        facility.save()
+        for i in range(n):
+            user = FacilityUser(username="%s-user%d" % (facility_name, i), facility=facility, zone_fallback=zone)
+            user.set_password("password")
+            user.save()
+        return facility
+
+
+class SyncSessionSummaryTests(DeploymentSummaryTestCase):
+
+    def test_closed_sessions_are_added(self):
+        self.sync(self.device, models_uploaded=5)
+        self.sync(self.device, models_uploaded=3)
+
+        device_summary = DeviceSummary.objects.get(device=self.device, organization=self.org)
+        self.assertEqual((device_summary.sync_sessions, device_summary.models_synced), (2, 8))
+        org_summary = OrganizationSummary.objects.get(organization=self.org)
+        self.assertEqual((org_summary.sync_sessions, org_summary.models_synced), (2, 8))
+
+    def test_open_sessions_are_not_counted(self):
+        self.sync(self.device, models_uploaded=5, closed=False)
+
+        self.assertFalse(DeviceSummary.objects.filter(device=self.device).exists())
+        self.assertEqual(OrganizationSummary.objects.get(organization=self.org).sync_sessions, 0)
+
+        # Nor by a rebuild
+        rebuild_deployment_summaries()
+        self.assertEqual(DeviceSummary.objects.get(device=self.device, organization=self.org).sync_sessions, 0)
+        self.assertEqual(OrganizationSummary.objects.get(organization=self.org).sync_sessions, 0)
+
+    def test_uploaded_users_are_counted(self):
+        self.sync(self.device, models_uploaded=1)
+        # Users uploaded by the next session
+        facility = self.create_users(self.zone, 2)
+        self.sync(self.device, models_uploaded=3)
+
+        self.assertEqual(OrganizationSummary.objects.get(organization=self.org).total_users, 2)
+        self.assertEqual(FacilitySummary.objects.get(facility=facility, organization=self.org).n_actual_users, 2)
+
+    def test_rebuild_matches_incremental_totals(self):
+        other_device = self.create_device(self.zone, "desktop")
+        self.sync(self.device, models_uploaded=5)
+        self.sync(other_device, models_uploaded=2)
+        self.sync(other_device, models_uploaded=1)
+        self.create_users(self.zone, 3)
+        incremental = OrganizationSummary.objects.get(organization=self.org)
+
+        rebuild_deployment_summaries()
+        rebuilt = OrganizationSummary.objects.get(organization=self.org)
+        self.assertEqual(
+            (rebuilt.sync_sessions, rebuilt.models_synced),
+            (incremental.sync_sessions, incremental.models_synced),
+        )
+        self.assertEqual((rebuilt.sync_sessions, rebuilt.models_synced), (3, 8))
+        # Users are only counted by the rebuild
+        self.assertEqual(rebuilt.total_users, 3)
+
+
+class DeploymentCMSTests(DeploymentSummaryTestCase):
+
+    def setUp(self):
+        super(DeploymentCMSTests, self).setUp()
+        # A second organization, with more users
+        self.big_org = self.create_organization(name="org-2", owner=self.user)
+        self.big_zone = self.create_zone(name="zone-2", organizations=[self.big_org])
+        self.create_device(self.big_zone, "server")
+        self.create_users(self.zone, 1, facility_name="small")
+        self.create_users(self.big_zone, 2, facility_name="big")
+        rebuild_deployment_summaries()
+        self.client.login(username=self.user.username, password=self.user.real_password)
+
+    def get_page(self, **params):
+        response = self.client.get(reverse("show_deployment_cms"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context["pages"]
+
+    def test_most_users_first(self):
+        page = self.get_page()
+        self.assertEqual([org["org_name"] for org in page.object_list], ["org-2", "org-1"])
+        self.assertEqual([org["total_users"] for org in page.object_list], [2, 1])
+        self.assertEqual(page.object_list[0]["facilities"]["big"]["n_actual_users"], 2)
+        self.assertEqual(page.object_list[0]["devices"].values()[0]["name"], "server")
+
+    def test_paging(self):
+        first = self.get_page(per_page=1, cur_page=1)
+        second = self.get_page(per_page=1, cur_page=2)
+        self.assertEqual([org["org_name"] for org in first.object_list], ["org-2"])
+        self.assertEqual([org["org_name"] for org in second.object_list], ["org-1"])
+        self.assertEqual(second.paginator.count, 2)
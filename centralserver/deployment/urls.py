@@ -4,3 +4,7 @@ from django.conf.urls import patterns, include, url
 urlpatterns = patterns(__package__ + '.views',
     url(r'^cms/?$', 'show_deployment_cms', {}, 'show_deployment_cms'),
 )
+
+urlpatterns += patterns(__package__ + '.api_views',
+    url(r'^api/facility_map/$', 'facility_map', {}, 'facility_map'),
+)
@@ -10,35 +10,67 @@ from django.utils.translation import ugettext as _
 
 from centralserver.central.models import Organization
 from fle_utils.django_utils.paginate import paginate_data
-from kalite.facility.models import Facility
 from kalite.shared.decorators.auth import require_authorized_admin
-from securesync.models import DeviceZone
+from .models import DeviceSummary, FacilitySummary, OrganizationSummary
+
+
+class QuerySetList(object):
+    """
+    Lets paginate_data() count and slice a queryset in the database. Unlike
+    a queryset, it can be tested for truth without fetching all rows.
+    """
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def __nonzero__(self):
+        return self.queryset.exists()
+
+    def __len__(self):
+        return self.count()
+
+    def count(self):
+        return self.queryset.count()
+
+    def __getitem__(self, key):
+        return self.queryset[key]
 
 
 @require_authorized_admin
 @render_to("deployment/cms.html")
 def show_deployment_cms(request):
     """
-    This does 3 queries:
-    * Facilities, organized by organization.
-    * Devices, organized by organization.
-    * Organizations, organized by organization.
+    This reads the deployment summary (see deployment.models) rather than
+    aggregating sync sessions and facility users on each request:
+    * Organizations on the current page, sorted and paginated by the database.
+    * Users of those organizations.
+    * Devices of those organizations.
+    * Facilities of those organizations.
 
-    It then combines results from these 3 queries to create a list of:
-    * All Users that have facilities, have devices but no facilities, and have no devices.
+    It then combines results from these queries into the page of deployments,
+    with the most users first.
     """
 
-    # Query 1: Organizations
-    deployment_data = OrderedDict([(org["id"], {
-        "org_name": org["name"],
-        "owner": org["owner__username"],
-        "total_users": 0,
-        "sync_sessions": 0,
-        "models_synced": 0,
-    }) for org in list(Organization.objects.values("id", "name", "owner__username"))])
+    # Query 1: Organizations on this page. The organization breaks ties, so
+    # that pages don't overlap.
+    organizations = OrganizationSummary.objects \
+        .values( \
+            "organization__id", "organization__name", "organization__owner__username", \
+            "total_users", "sync_sessions", "models_synced") \
+        .order_by("-total_users", "-models_synced", "-sync_sessions", "organization")
+    paged_data, page_urls = paginate_data(request, QuerySetList(organizations), page=int(request.GET.get("cur_page", 1)), per_page=int(request.GET.get("per_page", 25)))
+    page_orgs = paged_data.object_list if paged_data else []
+
+    deployment_data = OrderedDict([(org["organization__id"], {
+        "org_name": org["organization__name"],
+        "owner": org["organization__owner__username"],
+        "total_users": org["total_users"],
+        "sync_sessions": org["sync_sessions"],
+        "models_synced": org["models_synced"],
+    }) for org in page_orgs])
+    org_ids = deployment_data.keys()
 
     # Query 2: Organizations with users
-    for org in list(Organization.objects.values("id", "users__username", "users__first_name", "users__last_name")):
+    for org in list(Organization.objects.filter(id__in=org_ids).values("id", "users__username", "users__first_name", "users__last_name")):
         org_id = org["id"]
         deployment_data[org_id]["users"] = deployment_data[org_id].get("users", {})
         deployment_data[org_id]["users"][org["users__username"]] = {
@@ -48,53 +80,52 @@ def show_deployment_cms(request):
         }
 
     # Query 3: Organizations with devices
-    device_data = DeviceZone.objects \
-        .annotate( \
-            n_sessions=Count("device__client_sessions"), \
-            n_models=Sum("device__client_sessions__models_uploaded")) \
-        .values("n_sessions", "n_models", "device__id", "device__name", "zone__id", "zone__name", "zone__organization__id") \
-        .order_by("zone__name", "-n_models", "-n_sessions")
+    device_data = DeviceSummary.objects \
+        .filter(organization__in=org_ids) \
+        .values("sync_sessions", "models_synced", "device__id", "device__name", "zone__id", "zone__name", "organization") \
+        .order_by("zone__name", "-models_synced", "-sync_sessions")
 
     for devzone in list(device_data):
-        org_id = devzone["zone__organization__id"]
-        if not org_id:
-            continue
+        org_id = devzone["organization"]
         deployment_data[org_id]["devices"] = deployment_data[org_id].get("devices", {})
         deployment_data[org_id]["devices"][devzone["device__id"]] = {
             "id": devzone["device__id"],
             "name": devzone["device__name"],
             "zone_name": devzone["zone__name"],
             "zone_id": devzone["zone__id"],
-            "models_synced": devzone["n_models"],
-            "sync_sessions": devzone["n_sessions"],
+            "models_synced": devzone["models_synced"],
+            "sync_sessions": devzone["sync_sessions"],
         }
-        deployment_data[org_id]["models_synced"] += devzone["n_models"] or 0
-        deployment_data[org_id]["sync_sessions"] += devzone["n_sessions"] or 0
 
     # Query 4: Organizations with facilities
-    facilities_by_org = list(Facility.objects \
-        .filter(signed_by__devicemetadata__is_demo_device=False) \
-        .annotate( \
-            n_actual_users=Count("facilityuser")) \
+    facilities_by_org = FacilitySummary.objects \
+        .filter(organization__in=org_ids) \
         .values( \
             "n_actual_users", \
-            "name", "address", \
-            "latitude", "longitude", \
-            "contact_email", "contact_name", \
-            "user_count", \
-            "zone_fallback__organization__id", \
-            "signed_by__devicezone__zone__organization__id",) \
-        .order_by("-n_actual_users"))
+            "facility__name", "facility__address", \
+            "facility__latitude", "facility__longitude", \
+            "facility__contact_email", "facility__contact_name", \
+            "facility__user_count", \
+            "organization",) \
+        .order_by("-n_actual_users")
 
     for fac in list(facilities_by_org):
-        org_id = fac["signed_by__devicezone__zone__organization__id"] or fac["zone_fallback__organization__id"]
+        org_id = fac["organization"]
         deployment_data[org_id]["facilities"] = deployment_data[org_id].get("facilities", {})
-        deployment_data[org_id]["facilities"][fac["name"]] = fac
-        deployment_data[org_id]["total_users"] += fac["n_actual_users"] or 0
+        deployment_data[org_id]["facilities"][fac["facility__name"]] = {
+            "n_actual_users": fac["n_actual_users"],
+            "name": fac["facility__name"],
+            "address": fac["facility__address"],
+            "latitude": fac["facility__latitude"],
+            "longitude": fac["facility__longitude"],
+            "contact_email": fac["facility__contact_email"],
+            "contact_name": fac["facility__contact_name"],
+            "user_count": fac["facility__user_count"],
+        }
 
-    # Combine all data into a single data store.
-    sort_fn = lambda dep: (dep["total_users"], dep["models_synced"], dep["sync_sessions"])
-    paged_data, page_urls = paginate_data(request, sorted(deployment_data.values(), key=sort_fn, reverse=True), page=int(request.GET.get("cur_page", 1)), per_page=int(request.GET.get("per_page", 25)))
+    # Deployments are in the order of query 1
+    if paged_data:
+        paged_data.object_list = deployment_data.values()
 
     return {
         "pages": paged_data,
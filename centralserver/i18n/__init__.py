@@ -3,11 +3,14 @@ Utility functions for i18n related tasks on the distributed server
 """
 import bisect
 import glob
+import hashlib
 import json
 import os
 import re
 import requests
 import shutil
+import tempfile
+import time
 from fle_utils.collections_local_copy import OrderedDict, defaultdict
 
 from django.conf import settings; logging = settings.LOG
@@ -24,7 +27,7 @@ from django.views.i18n import javascript_catalog
 ###                                          ###
 ################################################
 from kalite.version import SHORTVERSION
-from fle_utils.general import softload_json
+from fle_utils.general import ensure_dir, softload_json
 from kalite.i18n.base import get_locale_path, get_langcode_map, lcode_to_ietf
 
 AMARA_HEADERS = {
@@ -47,6 +50,12 @@ LANGUAGE_SRT_SUFFIX = "_download_status.json"
 SRTS_JSON_FILEPATH = os.path.join(SUBTITLES_DATA_ROOT, "srts_remote_availability.json")
 DUBBED_VIDEOS_MAPPING_FILEPATH = os.path.join(I18N_CENTRAL_DATA_PATH, "dubbed_video_mappings.json")
 SUBTITLE_COUNTS_FILEPATH = os.path.join(SUBTITLES_DATA_ROOT, "subtitle_counts.json")
+# Catalogs of the srts on disk, per language, and an index of their counts
+SRT_CATALOG_DIRPATH = os.path.join(SUBTITLES_DATA_ROOT, "srt_catalog")
+SRT_CATALOG_INDEX_FILEPATH = os.path.join(SRT_CATALOG_DIRPATH, "index.json")
+# Seconds by which file systems may round mtimes. A directory listed this
+# soon after it last changed may change again without a new mtime.
+SRT_CATALOG_MTIME_RESOLUTION = 2
 SUPPORTED_LANGUAGES_FILEPATH = os.path.join(I18N_CENTRAL_DATA_PATH, "supported_languages.json")
 CROWDIN_CACHE_DIR = os.path.join(settings.PROJECT_PATH, "..", "_crowdin_cache")
 LANGUAGE_PACK_BUILD_DIR = os.path.join(settings.ROOT_DATA_PATH, "i18n", "build")
@@ -57,6 +66,13 @@ POT_DIRPATH = os.path.join(I18N_CENTRAL_DATA_PATH, "pot")
 
 CROWDIN_API_URL = "https://api.crowdin.com/api/project"
 
+# Seconds a file read through get_cached_json() is served from memory before
+# checking whether it has changed
+JSON_FILE_CACHE_CHECK_INTERVAL = getattr(settings, "JSON_FILE_CACHE_CHECK_INTERVAL", 1)
+
+# (json_filepath, transform) => (file version, time checked, data, serialized data)
+_json_file_cache = {}
+
 
 def get_lang_map_filepath(lang_code):
     return os.path.join(SUBTITLES_DATA_ROOT, "languages", lang_code + LANGUAGE_SRT_SUFFIX)
@@ -213,16 +229,169 @@ def get_srt_path(lang_code=None, youtube_id=None):
     return srt_path
 
 
+def get_srt_catalog_filepath(locale):
+    return os.path.join(SRT_CATALOG_DIRPATH, locale + ".json")
+
+
+def _write_json_atomically(json_filepath, data):
+    # Readers never see a partly written file, and writers in other threads
+    # or processes each write a temporary file of their own
+    dirpath = os.path.dirname(json_filepath)
+    ensure_dir(dirpath)
+    with tempfile.NamedTemporaryFile("w", dir=dirpath, prefix=os.path.basename(json_filepath) + ".", suffix=".tmp", delete=False) as fp:
+        try:
+            json.dump(data, fp)
+        except Exception:
+            os.remove(fp.name)
+            raise
+    # Temporary files are only readable by their owner
+    os.chmod(fp.name, 0644)
+    os.rename(fp.name, json_filepath)
+
+
+def _get_file_hash(filepath):
+    md5 = hashlib.md5()
+    with open(filepath, "rb") as fp:
+        for chunk in iter(lambda: fp.read(64 * 1024), ""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def _update_srt_catalog(locale, index, full=False):
+    """Bring the catalog of a language's srts up to date, and its entry of the index.
+
+    The srt directory is only listed when its mtime has changed since the last
+    update, when it was last listed within SRT_CATALOG_MTIME_RESOLUTION of
+    that mtime, or when full is set. Only srts whose size or mtime have
+    changed are hashed again.
+
+    Rewriting an srt in place doesn't change the directory's mtime, so such
+    changes are only picked up with full set.
+
+    Returns:
+        True when the index entry has changed
+    """
+    dirpath = os.path.join(get_srt_path(), locale, "subtitles")
+    try:
+        dir_mtime = os.stat(dirpath).st_mtime
+    except OSError:
+        if locale not in index:
+            return False
+        del index[locale]
+        if os.path.exists(get_srt_catalog_filepath(locale)):
+            os.remove(get_srt_catalog_filepath(locale))
+        return True
+
+    entry = index.get(locale)
+    listed_at = time.time()
+    if (entry and entry["dir_mtime"] == dir_mtime and not full and
+            entry.get("listed_at", 0) - dir_mtime > SRT_CATALOG_MTIME_RESOLUTION):
+        return False
+
+    catalog = softload_json(get_srt_catalog_filepath(locale), default={})
+    srts = {}
+    for filename in os.listdir(dirpath):
+        youtube_id, ext = os.path.splitext(filename)
+        if ext != ".srt":
+            continue
+        filepath = os.path.join(dirpath, filename)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            # Deleted in the meantime
+            continue
+        srt = catalog.get(youtube_id)
+        if not srt or srt["size"] != stat.st_size or srt["mtime"] != stat.st_mtime:
+            srt = {"size": stat.st_size, "mtime": stat.st_mtime, "hash": _get_file_hash(filepath)}
+        srts[youtube_id] = srt
+
+    if srts != catalog:
+        _write_json_atomically(get_srt_catalog_filepath(locale), srts)
+    index[locale] = {"count": len(srts), "dir_mtime": dir_mtime, "listed_at": listed_at}
+    return True
+
+
+def update_srt_catalogs(locales=None, full=False):
+    """Bring the srt catalogs of the languages up to date.
+
+    Args:
+        locales: locale directory names, as in get_srt_path(); by default all
+            languages with an srt directory or a catalog
+        full: list and stat all srts, even of unchanged directories. Needed
+            to pick up srts rewritten in place.
+
+    Returns:
+        the index: {locale: {"count": number of srts, "dir_mtime": float,
+            "listed_at": float}}
+    """
+    index = softload_json(SRT_CATALOG_INDEX_FILEPATH, default={})
+    if locales is None:
+        srt_root = get_srt_path()
+        locales = set(index) | set(os.listdir(srt_root) if os.path.exists(srt_root) else [])
+
+    changed = False
+    for locale in locales:
+        changed = _update_srt_catalog(locale, index, full=full) or changed
+    if changed:
+        _write_json_atomically(SRT_CATALOG_INDEX_FILEPATH, index)
+    return index
+
+
+def get_srt_catalog(lang_code):
+    """Returns {youtube_id: {"size", "mtime", "hash"}} of the srts available in the language"""
+    locale = get_locale_path(lang_code)
+    update_srt_catalogs([locale])
+    return softload_json(get_srt_catalog_filepath(locale), default={})
+
+
 def get_subtitle_count(lang_code):
-    # Used in API and update_language_packs
-    all_srts = glob.glob(os.path.join(get_srt_path(lang_code=lang_code), "*.srt"))
-    return len(all_srts)
+    # Used in API and update_language_packs. Reads the srt catalog, which
+    # only lists the srt directory again when it has changed.
+    locale = get_locale_path(lang_code)
+    return update_srt_catalogs([locale]).get(locale, {}).get("count", 0)
 
 
 def get_langs_with_subtitles():
     # Used in cache_subtitles
-    subtitles_path = get_srt_path()
-    if os.path.exists(subtitles_path):
-        return os.listdir(subtitles_path)
-    else:
-        return []
+    return sorted(update_srt_catalogs())
+
+
+def get_cached_json(json_filepath, transform=None):
+    """Load a json file through an in-process cache, kept until the file changes.
+
+    The file's mtime and size are checked at most every
+    JSON_FILE_CACHE_CHECK_INTERVAL seconds, so steady-state calls touch
+    neither the disk nor json.
+
+    Args:
+        transform: function of the loaded data, whose result is cached instead.
+            Must be the same object on each call, e.g. a module-level function.
+
+    Returns:
+        (data, serialized): the data, and it serialized as utf-8 JSON. The data
+        is shared by all callers, so must not be modified.
+
+    Raises:
+        OSError or IOError when the file can't be read
+    """
+    key = (json_filepath, transform)
+    now = time.time()
+    cached = _json_file_cache.get(key)
+    if cached and now - cached[1] < JSON_FILE_CACHE_CHECK_INTERVAL:
+        return cached[2], cached[3]
+
+    stat = os.stat(json_filepath)
+    version = (stat.st_mtime, stat.st_size, stat.st_ino)
+    if cached and cached[0] == version:
+        _json_file_cache[key] = (version, now) + cached[2:]
+        return cached[2], cached[3]
+
+    with open(json_filepath, "r") as fp:
+        data = json.load(fp)
+    if transform:
+        data = transform(data)
+    serialized = json.dumps(data, ensure_ascii=False)
+    if isinstance(serialized, unicode):
+        serialized = serialized.encode("utf-8")
+    _json_file_cache[key] = (version, now, data, serialized)
+    return data, serialized
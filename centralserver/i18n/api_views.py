@@ -9,7 +9,7 @@ from django.core.management import call_command
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, Http404
 
-from . import get_language_pack_availability_filepath, SUBTITLE_COUNTS_FILEPATH, SUBTITLES_DATA_ROOT, DUBBED_VIDEOS_MAPPING_FILEPATH
+from . import get_cached_json, get_language_pack_availability_filepath, SUBTITLE_COUNTS_FILEPATH, SUBTITLES_DATA_ROOT, DUBBED_VIDEOS_MAPPING_FILEPATH
 from fle_utils.internet.decorators import allow_jsonp, api_handle_error_with_json
 from fle_utils.internet.classes import JsonResponse
 
@@ -23,14 +23,18 @@ def get_subtitle_counts(request):
     """
 
     # Get the subtitles file
-    if not os.path.exists(SUBTITLE_COUNTS_FILEPATH):
+    try:
+        subtitle_counts, subtitle_counts_json = get_cached_json(SUBTITLE_COUNTS_FILEPATH)
+    except (IOError, OSError):
         # could call-command, but return 404 for now.
         raise Http404("Subtitles count file %s not found." % SUBTITLE_COUNTS_FILEPATH)
 
-    with open(SUBTITLE_COUNTS_FILEPATH, "r") as fp:
-        subtitle_counts = json.load(fp)
+    return JsonResponse(subtitle_counts_json)
+
 
-    return JsonResponse(subtitle_counts)
+def sort_language_packs(language_packs_available):
+    # Turn the dictionary into a sorted list of language packs, alphabetized by name
+    return sorted(language_packs_available.values(), key=lambda lp: lp["name"].lower())
 
 
 @allow_jsonp
@@ -38,18 +42,14 @@ def get_subtitle_counts(request):
 def get_available_language_packs(request, version):
     """Return list of available language packs"""
 
-    # Open language pack availability file
+    # Open language pack availability file, sorted and serialized once per change
     try:
-        with open(get_language_pack_availability_filepath(version=version), "r") as fp:
-            language_packs_available = json.load(fp)
+        available_packs, available_packs_json = get_cached_json(get_language_pack_availability_filepath(version=version), transform=sort_language_packs)
     except Exception as e:
         logging.debug("Unexpected error getting available language packs: %s" % e)
-        language_packs_available = {}
+        available_packs_json = "[]"
 
-    # Turn the dictionary into a sorted list of language packs, alphabetized by name
-    available_packs = sorted(language_packs_available.values(), key=lambda lp: lp["name"].lower())
-    
-    return JsonResponse(available_packs)
+    return JsonResponse(available_packs_json)
 
 
 @api_handle_error_with_json
@@ -60,9 +60,8 @@ def get_dubbed_video_mappings(request):
     try:
         if not os.path.exists(DUBBED_VIDEOS_MAPPING_FILEPATH):
             call_command("generate_dubbed_video_mappings")
-        with open(DUBBED_VIDEOS_MAPPING_FILEPATH, "r") as fp:
-            dubbed_videos_mapping = json.load(fp)
+        dubbed_videos_mapping, dubbed_videos_mapping_json = get_cached_json(DUBBED_VIDEOS_MAPPING_FILEPATH)
     except:
         raise Http404
 
-    return JsonResponse(dubbed_videos_mapping)
+    return JsonResponse(dubbed_videos_mapping_json)
@@ -0,0 +1,33 @@
+"""
+"""
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from centralserver.i18n import update_srt_catalogs
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    args = "[<locale> ...]"
+    help = (
+        "Updates the catalog of the srts available per language, read by "
+        "get_subtitle_count() and get_langs_with_subtitles(). Only srt "
+        "directories changed since the last update are listed again."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option('-f', '--full',
+            action='store_true',
+            dest='full',
+            help='Check all srts, also of directories that seem unchanged. Needed to pick up srts rewritten in place',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        index = update_srt_catalogs(locales=args or None, full=options.get('full', False))
+        for locale, entry in sorted(index.items()):
+            logger.info("{locale}: {count} srts".format(locale=locale, count=entry["count"]))
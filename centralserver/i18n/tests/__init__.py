@@ -3,3 +3,5 @@
 # in other ways
 # See: https://github.com/fle-internal/ka-lite-central/blob/057443c942794c62b2bdf1f5f95a270457414ac2/centralserver/i18n/tests/translation_tests.py
 # from .translation_tests import *
+
+from .catalog_tests import *
@@ -0,0 +1,178 @@
+"""
+Tests of the srt catalog and of the json file cache
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from mock import patch
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from .. import get_cached_json, update_srt_catalogs, _json_file_cache, _write_json_atomically
+
+
+class SrtCatalogTests(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.catalog_dir = tempfile.mkdtemp()
+        self.srt_dir = os.path.join(self.static_root, "srt", "pt_BR", "subtitles")
+        os.makedirs(self.srt_dir)
+
+        self.settings_override = override_settings(STATIC_ROOT=self.static_root)
+        self.settings_override.enable()
+        self.patches = [
+            patch("centralserver.i18n.SRT_CATALOG_DIRPATH", self.catalog_dir),
+            patch("centralserver.i18n.SRT_CATALOG_INDEX_FILEPATH", os.path.join(self.catalog_dir, "index.json")),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.settings_override.disable()
+        shutil.rmtree(self.static_root)
+        shutil.rmtree(self.catalog_dir)
+
+    def write_srt(self, youtube_id, content="1\n00:00:01,000 --> 00:00:02,000\nHi\n"):
+        with open(os.path.join(self.srt_dir, youtube_id + ".srt"), "w") as f:
+            f.write(content)
+
+    def set_dir_mtime(self, mtime):
+        # Whole seconds, which os.utime() sets exactly
+        os.utime(self.srt_dir, (mtime, mtime))
+        return mtime
+
+    def read_catalog(self):
+        with open(os.path.join(self.catalog_dir, "pt_BR.json")) as f:
+            return json.load(f)
+
+    def test_srts_are_counted(self):
+        self.write_srt("abc")
+        self.write_srt("def")
+        index = update_srt_catalogs()
+        self.assertEqual(index["pt_BR"]["count"], 2)
+        self.assertEqual(sorted(self.read_catalog()), ["abc", "def"])
+
+    def test_added_srt_is_counted(self):
+        self.write_srt("abc")
+        # As if the directory was last changed long before it was listed
+        self.set_dir_mtime(int(time.time()) - 60)
+        update_srt_catalogs()
+        self.write_srt("def")
+        self.assertEqual(update_srt_catalogs()["pt_BR"]["count"], 2)
+
+    def test_removed_language_is_dropped(self):
+        self.write_srt("abc")
+        update_srt_catalogs()
+        shutil.rmtree(os.path.join(self.static_root, "srt", "pt_BR"))
+        self.assertNotIn("pt_BR", update_srt_catalogs(["pt_BR"]))
+        self.assertFalse(os.path.exists(os.path.join(self.catalog_dir, "pt_BR.json")))
+
+    def test_srt_rewritten_in_place_needs_full(self):
+        self.write_srt("abc")
+        dir_mtime = self.set_dir_mtime(int(time.time()) - 60)
+        update_srt_catalogs()
+        old_hash = self.read_catalog()["abc"]["hash"]
+
+        # Rewriting the file doesn't change the directory's mtime
+        self.write_srt("abc", "1\n00:00:01,000 --> 00:00:02,000\nHello there\n")
+        self.set_dir_mtime(dir_mtime)
+
+        update_srt_catalogs()
+        self.assertEqual(self.read_catalog()["abc"]["hash"], old_hash)
+        update_srt_catalogs(full=True)
+        self.assertNotEqual(self.read_catalog()["abc"]["hash"], old_hash)
+
+    def test_directory_listed_within_mtime_resolution_is_listed_again(self):
+        self.write_srt("abc")
+        dir_mtime = self.set_dir_mtime(int(time.time()))
+        with patch("centralserver.i18n.time.time", return_value=dir_mtime + 1):
+            update_srt_catalogs()
+
+        # A file added in the same tick of the mtime doesn't change it
+        self.write_srt("def")
+        self.set_dir_mtime(dir_mtime)
+        with patch("centralserver.i18n.time.time", return_value=dir_mtime + 10):
+            self.assertEqual(update_srt_catalogs()["pt_BR"]["count"], 2)
+
+        # Listed long enough after its last change, it isn't listed again
+        self.write_srt("ghi")
+        self.set_dir_mtime(dir_mtime)
+        self.assertEqual(update_srt_catalogs()["pt_BR"]["count"], 2)
+
+
+class WriteJsonTests(TestCase):
+
+    def setUp(self):
+        self.dirpath = tempfile.mkdtemp()
+        self.json_filepath = os.path.join(self.dirpath, "index.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.dirpath)
+
+    def test_threads_write_files_of_their_own(self):
+        data = [dict(("key%d" % i, n) for i in range(1000)) for n in range(4)]
+
+        def write(n):
+            for __ in range(20):
+                _write_json_atomically(self.json_filepath, data[n])
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(len(data))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with open(self.json_filepath) as f:
+            self.assertIn(json.load(f), data)
+        self.assertEqual(os.listdir(self.dirpath), ["index.json"])
+        self.assertEqual(os.stat(self.json_filepath).st_mode & 0777, 0644)
+
+
+class CachedJsonTests(TestCase):
+
+    def setUp(self):
+        _json_file_cache.clear()
+        fd, self.json_filepath = tempfile.mkstemp(suffix=".json")
+        os.close(fd)
+        self.write_json({"a": 1})
+
+    def tearDown(self):
+        _json_file_cache.clear()
+        os.remove(self.json_filepath)
+
+    def write_json(self, data):
+        with open(self.json_filepath, "w") as f:
+            json.dump(data, f)
+
+    def test_data_is_loaded_once(self):
+        data, serialized = get_cached_json(self.json_filepath)
+        self.assertEqual(data, {"a": 1})
+        self.assertEqual(json.loads(serialized), {"a": 1})
+        self.assertIs(get_cached_json(self.json_filepath)[0], data)
+
+    def test_changed_file_is_loaded_again(self):
+        with patch("centralserver.i18n.JSON_FILE_CACHE_CHECK_INTERVAL", 0):
+            data = get_cached_json(self.json_filepath)[0]
+            self.write_json({"a": 1, "b": 22})
+            self.assertEqual(get_cached_json(self.json_filepath)[0], {"a": 1, "b": 22})
+            self.assertNotEqual(get_cached_json(self.json_filepath)[0], data)
+
+    def test_file_is_not_checked_within_interval(self):
+        with patch("centralserver.i18n.JSON_FILE_CACHE_CHECK_INTERVAL", 60):
+            get_cached_json(self.json_filepath)
+            self.write_json({"a": 1, "b": 22})
+            self.assertEqual(get_cached_json(self.json_filepath)[0], {"a": 1})
+
+    def test_transformed_data_is_cached_separately(self):
+        def keys(data):
+            return sorted(data)
+        self.assertEqual(get_cached_json(self.json_filepath)[0], {"a": 1})
+        self.assertEqual(get_cached_json(self.json_filepath, transform=keys)[0], ["a"])
+        self.assertEqual(get_cached_json(self.json_filepath)[0], {"a": 1})
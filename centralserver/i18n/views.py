@@ -1,6 +1,5 @@
 """
 """
-import json
 from collections import OrderedDict
 
 from django.conf import settings
@@ -12,12 +11,34 @@ from annoying.decorators import render_to
 from kalite.version import SHORTVERSION
 
 from fle_utils.general import sort_version_list
-from . import get_language_pack_availability_filepath
+from . import get_cached_json, get_language_pack_availability_filepath
 
 
 logging = settings.LOG
 
 
+def get_lang_pack_by_version(lang_availability):
+    """
+    Returns the language packs, organized by version, with the newest first
+    """
+    ordered_versions = sort_version_list([pack["software_version"] for code, pack in lang_availability.items()], reverse=True)
+    lang_pack_by_version = OrderedDict((version, []) for version in ordered_versions)
+
+    for code, pack in lang_availability.items():
+        # add a url to download the language pack
+        language_code = pack["code"]
+        try:
+            url = reverse("download_language_pack", kwargs={"version": SHORTVERSION, "lang_code": language_code})
+        except NoReverseMatch:
+            url = ""
+        pack["download_language_url"] = url
+
+        software_version = pack["software_version"]
+        del pack["software_version"]  # won't be used other than to sort
+        lang_pack_by_version[software_version].append(pack)
+    return lang_pack_by_version
+
+
 @render_to('i18n/language_dashboard.html')
 def language_dashboard(request):
     """
@@ -32,23 +53,8 @@ def language_dashboard(request):
         }
     """
     try:
-        with open(get_language_pack_availability_filepath()) as f:
-            lang_availability = json.load(f)
-        ordered_versions = sort_version_list([pack["software_version"] for code, pack in lang_availability.items()], reverse=True)
-        lang_pack_by_version = OrderedDict((version, []) for version in ordered_versions)
-
-        for code, pack in lang_availability.items():
-            # add a url to download the language pack
-            language_code = pack["code"]
-            try:
-                url = reverse("download_language_pack", kwargs={"version": SHORTVERSION, "lang_code": language_code})
-            except NoReverseMatch:
-                url = ""
-            pack["download_language_url"] = url
-
-            software_version = pack["software_version"]
-            del pack["software_version"]  # won't be used other than to sort
-            lang_pack_by_version[software_version].append(pack)
+        # Organized once per change of the availability file
+        lang_pack_by_version, __ = get_cached_json(get_language_pack_availability_filepath(), transform=get_lang_pack_by_version)
         context = {
             "lang_pack_by_version": lang_pack_by_version,
             "crowdin_base_url": "https://crowdin.com/project/ka-lite/"
@@ -116,6 +116,20 @@ CSV_EXPORT_ROOT = os.path.join(
     "csv_exports"
 )
 
+# Hand export downloads over to the front-end web server instead of having a
+# Django worker send them: "x-accel-redirect" for nginx, or "x-sendfile" for
+# Apache mod_xsendfile and lighttpd. For nginx, CSV_EXPORT_ROOT has to be
+# served by an internal location at CSV_EXPORT_ACCEL_PREFIX.
+CSV_EXPORT_SENDFILE = None
+CSV_EXPORT_ACCEL_PREFIX = "/protected/csv_exports/"
+
+# The same for language pack and subtitle downloads. For nginx, the language
+# pack and srt directories have to be served by internal locations at these
+# prefixes.
+STATS_DOWNLOAD_SENDFILE = None
+LANGUAGE_PACK_ACCEL_PREFIX = "/protected/language_packs/"
+SRT_ACCEL_PREFIX = "/protected/srt/"
+
 try:
     from local_settings import *
     import local_settings
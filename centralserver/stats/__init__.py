@@ -1,7 +1,11 @@
 """
 """
+import atexit
 import logging
 import os
+import Queue
+import threading
+import time
 
 from django.conf import settings
 
@@ -10,16 +14,34 @@ from fle_utils.general import ensure_dir
 
 STATS_LOG_DIRPATH = os.path.join(settings.STATS_PATH, 'logs')
 
+# Download events waiting to be written. When the writer falls this far
+# behind, further events are dropped rather than slowing down requests.
+STATS_LOG_QUEUE_SIZE = getattr(settings, "STATS_LOG_QUEUE_SIZE", 100000)
+# Seconds the writer gathers events for before writing them out at once
+STATS_LOG_FLUSH_INTERVAL = getattr(settings, "STATS_LOG_FLUSH_INTERVAL", 1.0)
+STATS_LOG_BATCH_SIZE = getattr(settings, "STATS_LOG_BATCH_SIZE", 1000)
+# A log is rotated when it would grow past this size, keeping that many
+# rotated logs. Only rotate when a single process writes the logs; otherwise,
+# leave this to logrotate with copytruncate.
+STATS_LOG_MAX_BYTES = getattr(settings, "STATS_LOG_MAX_BYTES", 0)
+STATS_LOG_BACKUP_COUNT = getattr(settings, "STATS_LOG_BACKUP_COUNT", 10)
+
+# Seconds the process waits for the last events to be written when exiting
+STATS_LOG_SHUTDOWN_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+
 # Note: beta level logger. Move to config file/dictionary format
 def stats_logger(loggertype="stats", loggername=None):
-    """Return a logger that will log to a file"""
+    """Return a logger that will log to a file, from a background thread"""
 
     loggername = loggername or "kalite." + loggertype
 
     logger = logging.getLogger(loggername)
     if not logger.handlers:
         # For now, limit 1 handler per logger.
-        logger.addHandler(_file_handler(loggername=loggername))
+        logger.addHandler(QueueHandler())
 
     return logger
 
@@ -33,7 +55,208 @@ def _file_handler(filename=None, loggername=None):
     ensure_dir(STATS_LOG_DIRPATH)
     logger_filepath = os.path.join(STATS_LOG_DIRPATH, filename)
 
-    handler = logging.FileHandler(logger_filepath, encoding='utf-8', delay=True)
+    handler = BatchFileHandler(
+        logger_filepath,
+        max_bytes=STATS_LOG_MAX_BYTES,
+        backup_count=STATS_LOG_BACKUP_COUNT,
+    )
     handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
 
     return handler
+
+
+class BatchFileHandler(logging.Handler):
+    """
+    Keeps formatted records until flush_buffer() is called, which appends
+    them all with a single write() to the file, opened with O_APPEND. Lines
+    of several processes writing the same file are never mixed up, and
+    logrotate's copytruncate can't leave a gap before the next batch.
+    """
+    def __init__(self, filename, max_bytes=0, backup_count=0):
+        logging.Handler.__init__(self)
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer = []
+        self.fd = None
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+            if isinstance(line, unicode):
+                line = line.encode("utf-8")
+            self.buffer.append(line + "\n")
+        except Exception:
+            self.handleError(record)
+
+    def flush_buffer(self):
+        if not self.buffer:
+            return
+        data = "".join(self.buffer)
+        self.buffer = []
+
+        self.acquire()
+        try:
+            if self.fd is None:
+                self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            if self.max_bytes:
+                size = os.fstat(self.fd).st_size
+                if size and size + len(data) > self.max_bytes:
+                    self.rotate()
+            while data:
+                # Only a full disk or a signal makes for a short write
+                data = data[os.write(self.fd, data):]
+        finally:
+            self.release()
+
+    def rotate(self):
+        """
+        Renames the file to .1, the previous .1 to .2 and so on, as
+        RotatingFileHandler does, and opens a new file
+        """
+        os.close(self.fd)
+        for n in range(self.backup_count - 1, 0, -1):
+            source = "%s.%d" % (self.filename, n)
+            if os.path.exists(source):
+                os.rename(source, "%s.%d" % (self.filename, n + 1))
+        if self.backup_count:
+            os.rename(self.filename, self.filename + ".1")
+        else:
+            os.remove(self.filename)
+        self.fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+    def close(self):
+        self.acquire()
+        try:
+            self.flush_buffer()
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+        finally:
+            self.release()
+        logging.Handler.close(self)
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands records over to the writer thread of this process, so that logging
+    never waits for the disk
+    """
+    def emit(self, record):
+        try:
+            _get_writer().put(record)
+        except Exception:
+            self.handleError(record)
+
+
+class StatsLogWriter(object):
+    """
+    Writes the records queued by QueueHandler to the file of their logger,
+    in batches, from a daemon thread
+    """
+    STOP = object()
+
+    def __init__(self):
+        self.queue = Queue.Queue(STATS_LOG_QUEUE_SIZE)
+        self.handlers = {}
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name="stats-log-writer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except Queue.Full:
+            self.dropped += 1
+
+    def get_batch(self):
+        """
+        Waits for a record, then gathers those that follow it within
+        STATS_LOG_FLUSH_INTERVAL
+        """
+        batch = [self.queue.get()]
+        deadline = time.time() + STATS_LOG_FLUSH_INTERVAL
+        while batch[-1] is not self.STOP and len(batch) < STATS_LOG_BATCH_SIZE:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get_batch()
+            try:
+                self.write(record for record in batch if record is not self.STOP)
+            except Exception:
+                # The writer must keep running
+                logger.exception("Could not write stats log records")
+            if batch[-1] is self.STOP:
+                return
+
+    def write(self, records):
+        handlers = set()
+        for record in records:
+            if record.name not in self.handlers:
+                self.handlers[record.name] = _file_handler(loggername=record.name)
+            handler = self.handlers[record.name]
+            handler.handle(record)
+            handlers.add(handler)
+        for handler in handlers:
+            handler.flush_buffer()
+
+        if self.dropped:
+            logger.warning("Dropped %d stats log records, as the queue was full" % self.dropped)
+            self.dropped = 0
+
+    def stop(self, timeout=STATS_LOG_SHUTDOWN_TIMEOUT):
+        """
+        Writes out the queued records and closes the files
+        """
+        try:
+            self.queue.put(self.STOP, timeout=timeout)
+        except Queue.Full:
+            logger.warning("Stats log writer is stuck, %d records were not written" % self.queue.qsize())
+            return
+        self.thread.join(timeout)
+        if not self.thread.is_alive():
+            for handler in self.handlers.values():
+                handler.close()
+
+
+_writer = None
+_writer_pid = None
+_writer_lock = threading.Lock()
+
+
+def _get_writer():
+    """
+    Returns the writer of this process, starting it if needed. Threads don't
+    survive a fork, so a forked process starts a writer of its own.
+    """
+    global _writer, _writer_pid
+    if _writer_pid != os.getpid():
+        with _writer_lock:
+            if _writer_pid != os.getpid():
+                _writer = StatsLogWriter()
+                _writer_pid = os.getpid()
+    return _writer
+
+
+def flush_stats_logs():
+    """
+    Stops the writer once it has written all queued records. It is started
+    again by the next record logged.
+    """
+    global _writer, _writer_pid
+    with _writer_lock:
+        if _writer and _writer_pid == os.getpid():
+            _writer.stop()
+        _writer = _writer_pid = None
+
+
+atexit.register(flush_stats_logs)
@@ -3,11 +3,18 @@
 import os
 
 from django.conf import settings
-from django.http import HttpResponseRedirect, HttpResponse, Http404
+from django.http import HttpResponseRedirect, Http404
+from django.utils.dateparse import parse_date
+from django.utils.translation import ugettext as _
 
 from . import stats_logger
-from centralserver.i18n import get_language_pack_filepath, get_srt_path
+from .models import DownloadRollup
+from centralserver.central.downloads import RANGE_RE, serve_file
+from centralserver.i18n import LANGUAGE_PACK_ROOT, get_language_pack_filepath, get_srt_path
 from fle_utils.django_utils.functions import get_request_ip
+from fle_utils.internet.classes import JsonResponse, JsonResponseMessageError
+from fle_utils.internet.decorators import api_handle_error_with_json
+from kalite.shared.decorators.auth import require_superuser
 from fle_utils.videos import OUTSIDE_DOWNLOAD_BASE_URL  # for video download redirects
 from kalite.version import VERSION as KALITE_VERSION
 
@@ -28,23 +35,59 @@ def download_video(request, video_path):
         return HttpResponseRedirect("https://img.youtube.com/vi/{youtube_id}/mqdefault.jpg".format(youtube_id=youtube_id))
 
 
+def serve_download(request, path, root, content_type, accel_prefix_setting):
+    """
+    Sends a file under root, as attachment, through the front-end web server
+    when STATS_DOWNLOAD_SENDFILE is set
+    """
+    # Never serve anything outside of root, which the front-end web server
+    # would do on request
+    path = os.path.realpath(path)
+    root = os.path.realpath(root)
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        raise Http404
+
+    response = serve_file(
+        request,
+        path,
+        content_type=content_type,
+        sendfile=getattr(settings, "STATS_DOWNLOAD_SENDFILE", None),
+        sendfile_root=root,
+        accel_prefix=getattr(settings, accel_prefix_setting, None),
+    )
+    response['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(path)
+    return response
+
+
+def is_download(request, response):
+    """
+    Checking whether a file has changed, or the file's size, is not a
+    download, and neither is resuming one: a file fetched in several ranges
+    is downloaded once, by the range starting at its first byte.
+    """
+    if request.method == "HEAD" or response.status_code not in (200, 206):
+        return False
+    if response.status_code == 206:
+        return response["Content-Range"].startswith("bytes 0-")
+    if response.has_header("X-Accel-Redirect") or response.has_header("X-Sendfile"):
+        # The front-end web server answers the range requested, if any
+        match = RANGE_RE.match(request.META.get("HTTP_RANGE", "").strip())
+        return not match or match.groups() == ("", "") or (match.group(1) != "" and int(match.group(1)) == 0)
+    return True
+
+
 # central server
 def download_language_pack(request, version, lang_code):
     """Dummy function for capturing a language pack download request and logging
     to output, so we can collect stats."""
 
-    # Log the event
-    stats_logger("language_packs").info("lpd;%s;%s;%s" % (get_request_ip(request), lang_code, version))
-
-    # Find the file to return
+    # Find the file to return, and stream it back to the user
     zip_filepath = get_language_pack_filepath(lang_code, version=version)
-    if not os.path.exists(zip_filepath):
-        raise Http404
+    response = serve_download(request, zip_filepath, LANGUAGE_PACK_ROOT, 'application/zip', "LANGUAGE_PACK_ACCEL_PREFIX")
 
-    # Stream it back to the user
-    zh = open(zip_filepath, "rb")
-    response = HttpResponse(content=zh, mimetype='application/zip', content_type='application/zip')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(zip_filepath)
+    # Log the event
+    if is_download(request, response):
+        stats_logger("language_packs").info("lpd;%s;%s;%s" % (get_request_ip(request), lang_code, version))
 
     return response
 
@@ -54,19 +97,46 @@ def download_subtitle(request, lang_code, youtube_id):
     """Dummy function for capturing a video download request and logging
     to output, so we can collect stats."""
 
-    # Log the info
-    stats_logger("subtitles").info("sd;%s;%s;%s" % (get_request_ip(request), lang_code, youtube_id))
-
-    # Find the file to return
+    # Find the file to return, and stream it back to the user
     srt_filepath = get_srt_path(lang_code, youtube_id=youtube_id)
-    if not os.path.exists(srt_filepath):
-        raise Http404
+    response = serve_download(request, srt_filepath, get_srt_path(), 'text/plain', "SRT_ACCEL_PREFIX")
 
-    # Stream it back to the user
-    # Stream it back to the user
-    zh = open(srt_filepath,"rb")
-    response = HttpResponse(content=zh, mimetype='text/plain', content_type='text/plain')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % os.path.basename(srt_filepath)
+    # Log the info
+    if is_download(request, response):
+        stats_logger("subtitles").info("sd;%s;%s;%s" % (get_request_ip(request), lang_code, youtube_id))
 
     return response
 
+
+@require_superuser
+@api_handle_error_with_json
+def download_stats(request):
+    """
+    Returns the downloads of a kind (video, language_pack or subtitle),
+    from the rollups made by the rollupdownloads command. These are of the
+    whole site, so only superusers may see them. Optional:
+    * start, end: dates as YYYY-MM-DD, included
+    * group_by: comma-separated fields to total by, of date, language,
+        version and content_id; "date" by default
+    * language, version, content_id: only count these
+    """
+    kind = request.GET.get("kind", "")
+    group_by = [field for field in request.GET.get("group_by", "date").split(",") if field]
+    if kind not in dict(DownloadRollup.KINDS) or set(group_by) - set(DownloadRollup.GROUP_FIELDS):
+        return JsonResponseMessageError(_("Unknown kind of download or group_by field."), status=400)
+    try:
+        start_date = parse_date(request.GET.get("start", ""))
+        end_date = parse_date(request.GET.get("end", ""))
+    except ValueError:
+        return JsonResponseMessageError(_("Dates must be given as YYYY-MM-DD."), status=400)
+    filters = dict((field, request.GET[field]) for field in ("language", "version", "content_id") if field in request.GET)
+
+    downloads = DownloadRollup.get_downloads(kind, start_date=start_date, end_date=end_date, group_by=group_by, **filters)
+    for row in downloads:
+        if "date" in row:
+            row["date"] = row["date"].isoformat()
+    return JsonResponse({
+        "kind": kind,
+        "group_by": group_by,
+        "downloads": downloads,
+    })
@@ -0,0 +1,37 @@
+"""
+"""
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from centralserver.stats.models import DownloadRollup, StatsLogOffset
+from centralserver.stats.rollups import rollup_logs
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Counts the video, language pack and subtitle downloads logged since "
+        "the last run into daily rollups. Run it periodically, one at a time."
+    )
+
+    option_list = BaseCommand.option_list + (
+        make_option('-r', '--reset',
+            action='store_true',
+            dest='reset',
+            help='Delete all rollups and count the logs again from the start',
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options.get('reset', False):
+            with transaction.commit_on_success():
+                DownloadRollup.objects.all().delete()
+                StatsLogOffset.objects.all().delete()
+
+        for filename, n_lines in sorted(rollup_logs().items()):
+            logger.info("Read {n} new lines of {filename}".format(n=n_lines, filename=filename))
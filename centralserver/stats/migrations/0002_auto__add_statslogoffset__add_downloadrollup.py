@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'StatsLogOffset'
+        db.create_table('stats_statslogoffset', (
+            ('filename', self.gf('django.db.models.fields.CharField')(max_length=100, primary_key=True)),
+            ('inode', self.gf('django.db.models.fields.BigIntegerField')(null=True)),
+            ('offset', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('updated', self.gf('django.db.models.fields.DateTimeField')(auto_now=True, blank=True)),
+        ))
+        db.send_create_signal('stats', ['StatsLogOffset'])
+
+        # Adding model 'DownloadRollup'
+        db.create_table('stats_downloadrollup', (
+            ('id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('date', self.gf('django.db.models.fields.DateField')()),
+            ('kind', self.gf('django.db.models.fields.CharField')(max_length=20)),
+            ('language', self.gf('django.db.models.fields.CharField')(max_length=16, blank=True)),
+            ('version', self.gf('django.db.models.fields.CharField')(max_length=50, blank=True)),
+            ('content_id', self.gf('django.db.models.fields.CharField')(max_length=100, blank=True)),
+            ('downloads', self.gf('django.db.models.fields.IntegerField')(default=0)),
+        ))
+        db.send_create_signal('stats', ['DownloadRollup'])
+
+        # Adding unique constraint on 'DownloadRollup', fields ['date', 'kind', 'language', 'version', 'content_id']
+        db.create_unique('stats_downloadrollup', ['date', 'kind', 'language', 'version', 'content_id'])
+
+        # Adding index on 'DownloadRollup', fields ['kind', 'date']
+        db.create_index('stats_downloadrollup', ['kind', 'date'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'DownloadRollup', fields ['kind', 'date']
+        db.delete_index('stats_downloadrollup', ['kind', 'date'])
+
+        # Removing unique constraint on 'DownloadRollup', fields ['date', 'kind', 'language', 'version', 'content_id']
+        db.delete_unique('stats_downloadrollup', ['date', 'kind', 'language', 'version', 'content_id'])
+
+        # Deleting model 'StatsLogOffset'
+        db.delete_table('stats_statslogoffset')
+
+        # Deleting model 'DownloadRollup'
+        db.delete_table('stats_downloadrollup')
+
+
+    models = {
+        'stats.downloadrollup': {
+            'Meta': {'unique_together': "(('date', 'kind', 'language', 'version', 'content_id'),)", 'object_name': 'DownloadRollup', 'index_together': "[['kind', 'date']]"},
+            'content_id': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'downloads': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'language': ('django.db.models.fields.CharField', [], {'max_length': '16', 'blank': 'True'}),
+            'version': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        },
+        'stats.statslogoffset': {
+            'Meta': {'object_name': 'StatsLogOffset'},
+            'filename': ('django.db.models.fields.CharField', [], {'max_length': '100', 'primary_key': 'True'}),
+            'inode': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'offset': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        'stats.unregistereddevice': {
+            'Meta': {'object_name': 'UnregisteredDevice'},
+            'id': ('django.db.models.fields.CharField', [], {'max_length': '32', 'primary_key': 'True'})
+        },
+        'stats.unregistereddeviceping': {
+            'Meta': {'object_name': 'UnregisteredDevicePing'},
+            'device': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['stats.UnregisteredDevice']", 'unique': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_ip': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'last_ping': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'npings': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['stats']
\ No newline at end of file
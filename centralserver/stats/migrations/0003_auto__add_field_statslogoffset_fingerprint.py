@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'StatsLogOffset.fingerprint'
+        db.add_column(u'stats_statslogoffset', 'fingerprint',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=32, blank=True),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'StatsLogOffset.fingerprint'
+        db.delete_column(u'stats_statslogoffset', 'fingerprint')
+
+
+    models = {
+        u'stats.downloadrollup': {
+            'Meta': {'unique_together': "(('date', 'kind', 'language', 'version', 'content_id'),)", 'object_name': 'DownloadRollup', 'index_together': "[['kind', 'date']]"},
+            'content_id': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'date': ('django.db.models.fields.DateField', [], {}),
+            'downloads': ('django.db.models.fields.IntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'kind': ('django.db.models.fields.CharField', [], {'max_length': '20'}),
+            'language': ('django.db.models.fields.CharField', [], {'max_length': '16', 'blank': 'True'}),
+            'version': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'})
+        },
+        u'stats.statslogoffset': {
+            'Meta': {'object_name': 'StatsLogOffset'},
+            'filename': ('django.db.models.fields.CharField', [], {'max_length': '100', 'primary_key': 'True'}),
+            'fingerprint': ('django.db.models.fields.CharField', [], {'max_length': '32', 'blank': 'True'}),
+            'inode': ('django.db.models.fields.BigIntegerField', [], {'null': 'True'}),
+            'offset': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'})
+        },
+        u'stats.unregistereddevice': {
+            'Meta': {'object_name': 'UnregisteredDevice'},
+            'id': ('django.db.models.fields.CharField', [], {'max_length': '32', 'primary_key': 'True'})
+        },
+        u'stats.unregistereddeviceping': {
+            'Meta': {'object_name': 'UnregisteredDevicePing'},
+            'device': ('django.db.models.fields.related.ForeignKey', [], {'to': u"orm['stats.UnregisteredDevice']", 'unique': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_ip': ('django.db.models.fields.CharField', [], {'max_length': '50', 'blank': 'True'}),
+            'last_ping': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'blank': 'True'}),
+            'npings': ('django.db.models.fields.IntegerField', [], {'default': '0'})
+        }
+    }
+
+    complete_apps = ['stats']
\ No newline at end of file
@@ -5,6 +5,7 @@ from annoying.functions import get_object_or_None
 
 from django.conf import settings; logging = settings.LOG
 from django.db import models
+from django.db.models import F, Sum
 
 from fle_utils.django_utils.classes import ExtendedModel
 from securesync.models import ID_MAX_LENGTH, IP_MAX_LENGTH
@@ -49,3 +50,79 @@ class UnregisteredDevicePing(ExtendedModel):
         except Exception as e:
             # Never block functionality
             logging.error("Error recording unregistered device ping: %s" % e)
+
+
+class StatsLogOffset(models.Model):
+    """
+    How far the rollupdownloads command has read a stats log. The inode and
+    the fingerprint of the file's head tell whether the log has been rotated
+    since, see rollups.get_unread_files().
+    """
+    filename = models.CharField(primary_key=True, max_length=100)
+    inode = models.BigIntegerField(null=True)
+    offset = models.BigIntegerField(default=0)
+    fingerprint = models.CharField(max_length=32, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __unicode__(self):
+        return u"%s: %s bytes read" % (self.filename, self.offset)
+
+
+class DownloadRollup(models.Model):
+    """
+    Downloads in a day, as logged by stats.api_views: per video, per language
+    pack language and version, and per subtitle language.
+    """
+    KIND_VIDEO = "video"
+    KIND_LANGUAGE_PACK = "language_pack"
+    KIND_SUBTITLE = "subtitle"
+    KINDS = (
+        (KIND_VIDEO, "Video"),
+        (KIND_LANGUAGE_PACK, "Language pack"),
+        (KIND_SUBTITLE, "Subtitles"),
+    )
+    # Fields downloads can be totalled by
+    GROUP_FIELDS = ("date", "language", "version", "content_id")
+
+    date = models.DateField()
+    kind = models.CharField(max_length=20, choices=KINDS)
+    language = models.CharField(max_length=16, blank=True)
+    version = models.CharField(max_length=50, blank=True)
+    content_id = models.CharField(max_length=100, blank=True)
+    downloads = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("date", "kind", "language", "version", "content_id")
+        index_together = [["kind", "date"]]
+
+    def __unicode__(self):
+        return u"%s %s %s %s %s: %s downloads" % (self.date, self.kind, self.language, self.version, self.content_id, self.downloads)
+
+    @classmethod
+    def add_downloads(cls, counts):
+        """
+        Adds to the rollups the counts of downloads, keyed by (date, kind,
+        language, version, content_id)
+        """
+        for (date, kind, language, version, content_id), n_downloads in counts.iteritems():
+            rollups = cls.objects.filter(date=date, kind=kind, language=language, version=version, content_id=content_id)
+            if not rollups.update(downloads=F("downloads") + n_downloads):
+                cls.objects.create(date=date, kind=kind, language=language, version=version, content_id=content_id, downloads=n_downloads)
+
+    @classmethod
+    def get_downloads(cls, kind, start_date=None, end_date=None, group_by=("date",), **filters):
+        """
+        Returns dicts of the downloads of the kind between the dates,
+        included, totalled by the group_by fields
+        """
+        rollups = cls.objects.filter(kind=kind, **filters)
+        if start_date:
+            rollups = rollups.filter(date__gte=start_date)
+        if end_date:
+            rollups = rollups.filter(date__lte=end_date)
+        if not group_by:
+            return [{"downloads": rollups.aggregate(n_downloads=Sum("downloads"))["n_downloads"] or 0}]
+        return [
+            dict([(field, row[field]) for field in group_by], downloads=row["n_downloads"])
+            for row in rollups.values(*group_by).annotate(n_downloads=Sum("downloads")).order_by(*group_by)
+        ]
@@ -0,0 +1,176 @@
+"""
+Rolls the download events of the stats logs up into DownloadRollup rows.
+Each log is read from where the previous run stopped, so a run only costs as
+much as the lines logged since.
+"""
+import datetime
+import hashlib
+import logging
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+
+from . import STATS_LOG_DIRPATH
+from .models import DownloadRollup, StatsLogOffset
+
+
+# Logs written by stats.api_views, by the name of their stats_logger()
+STATS_ROLLUP_LOGS = ["kalite.videos.log", "kalite.language_packs.log", "kalite.subtitles.log"]
+
+# Lines read per transaction
+STATS_ROLLUP_BATCH_SIZE = getattr(settings, "STATS_ROLLUP_BATCH_SIZE", 100000)
+
+# Rotated logs looked into for the rest of the one last read, as in
+# RotatingFileHandler's "kalite.videos.log.1"
+MAX_ROTATED_LOGS = 100
+
+# Bytes at the start of a log that identify it, see get_fingerprint()
+FINGERPRINT_BYTES = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def parse_line(line):
+    """
+    Returns the (date, kind, language, version, content_id) of a download
+    logged as "<asctime> - vd;ip;youtube_id", "lpd;ip;lang;version" or
+    "sd;ip;lang;youtube_id", or None for any other line
+    """
+    try:
+        timestamp, message = line.decode("utf-8", "replace").rstrip("\r\n").split(" - ", 1)
+        date = datetime.datetime.strptime(timestamp[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+    fields = message.split(";")
+    if fields[0] == "vd" and len(fields) == 3:
+        return (date, DownloadRollup.KIND_VIDEO, "", "", fields[2][:100])
+    elif fields[0] == "lpd" and len(fields) == 4:
+        return (date, DownloadRollup.KIND_LANGUAGE_PACK, fields[2][:16], fields[3][:50], "")
+    elif fields[0] == "sd" and len(fields) == 4:
+        return (date, DownloadRollup.KIND_SUBTITLE, fields[2][:16], "", "")
+    return None
+
+
+def get_fingerprint(f, offset):
+    """
+    Returns the md5 of the first bytes of the open file, up to offset. Lines
+    are only ever appended to a log, so its head stays the same until it is
+    rotated, and is the same in a copy made by logrotate's copytruncate.
+    """
+    position = f.tell()
+    f.seek(0)
+    head = f.read(min(offset, FINGERPRINT_BYTES))
+    f.seek(position)
+    return hashlib.md5(head).hexdigest()
+
+
+def get_unread_files(path, inode, offset, fingerprint=""):
+    """
+    Returns (path, offset) of the files of the log not read to the end yet,
+    oldest first. When the log has been rotated since it was last read, that
+    is the rest of the rotated file, the files rotated after it, and the new
+    log.
+
+    The file last read is recognized by the fingerprint of its head, as
+    copytruncate keeps the inode of the log but moves its lines to a copy.
+    Offsets stored without a fingerprint are matched by inode.
+    """
+    def is_last_read(file_path):
+        try:
+            with open(file_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if fingerprint:
+                    return stat.st_size >= offset and get_fingerprint(f, offset) == fingerprint
+        except (IOError, OSError):
+            return False
+        # A log truncated in place is read from the start
+        return stat.st_ino == inode and stat.st_size >= offset
+
+    if not os.path.exists(path):
+        return []
+    if inode is None:
+        return [(path, 0)]
+    if is_last_read(path):
+        return [(path, offset)]
+
+    files = []
+    rotated_paths = ["%s.%d" % (path, n) for n in range(1, MAX_ROTATED_LOGS + 1)]
+    for n, rotated_path in enumerate(rotated_paths):
+        if not os.path.exists(rotated_path):
+            break
+        if is_last_read(rotated_path):
+            files.append((rotated_path, offset))
+            # Files with lower numbers were rotated later
+            for newer_path in reversed(rotated_paths[:n]):
+                files.append((newer_path, 0))
+            break
+    else:
+        logger.warning("Could not find the rotated log %s was being read from, some downloads are not counted" % path)
+
+    files.append((path, 0))
+    return files
+
+
+def save_rollups(log_offset, counts, f):
+    """
+    Adds the counts and stores how far the log has been read at once, so that
+    no line is counted twice. f is the file read.
+    """
+    log_offset.fingerprint = get_fingerprint(f, log_offset.offset) if log_offset.offset else ""
+    with transaction.commit_on_success():
+        DownloadRollup.add_downloads(counts)
+        log_offset.save()
+
+
+def rollup_log(filename):
+    """
+    Counts the downloads logged since the last run into the rollups. Returns
+    the number of lines read.
+    """
+    path = os.path.join(STATS_LOG_DIRPATH, filename)
+    try:
+        log_offset = StatsLogOffset.objects.get(filename=filename)
+    except StatsLogOffset.DoesNotExist:
+        log_offset = StatsLogOffset(filename=filename)
+
+    n_lines = 0
+    files = get_unread_files(path, log_offset.inode, log_offset.offset, log_offset.fingerprint)
+    for file_path, offset in files:
+        # Rotated files are complete; the last line of the log may still be
+        # being written.
+        is_current = (file_path == path)
+        counts = Counter()
+        n_batch_lines = 0
+
+        with open(file_path, "rb") as f:
+            log_offset.inode = os.fstat(f.fileno()).st_ino
+            log_offset.offset = offset
+            f.seek(offset)
+            for line in iter(f.readline, ""):
+                if is_current and not line.endswith("\n"):
+                    break
+                log_offset.offset += len(line)
+                n_batch_lines += 1
+                key = parse_line(line)
+                if key:
+                    counts[key] += 1
+                if n_batch_lines >= STATS_ROLLUP_BATCH_SIZE:
+                    save_rollups(log_offset, counts, f)
+                    n_lines += n_batch_lines
+                    counts = Counter()
+                    n_batch_lines = 0
+
+            save_rollups(log_offset, counts, f)
+            n_lines += n_batch_lines
+
+    return n_lines
+
+
+def rollup_logs():
+    """
+    Returns the number of lines read per log
+    """
+    return dict((filename, rollup_log(filename)) for filename in STATS_ROLLUP_LOGS)
@@ -0,0 +1,3 @@
+from .log_tests import *
+from .rollup_tests import *
+from .download_tests import *
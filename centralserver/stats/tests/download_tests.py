@@ -0,0 +1,78 @@
+"""
+Tests of which requests of a language pack or subtitle count as a download,
+and of the download stats endpoint
+"""
+import datetime
+import json
+import os
+import tempfile
+
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from ..api_views import is_download
+from ..models import DownloadRollup
+from centralserver.central.downloads import serve_file
+
+
+class IsDownloadTests(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".zip")
+        os.write(fd, "x" * 1000)
+        os.close(fd)
+        self.factory = RequestFactory()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def is_download(self, method="get", sendfile=None, **headers):
+        request = getattr(self.factory, method)("/download.zip", **headers)
+        response = serve_file(request, self.path, "application/zip", sendfile=sendfile, sendfile_root=os.path.dirname(self.path), accel_prefix="/protected/")
+        return is_download(request, response)
+
+    def test_whole_file(self):
+        self.assertTrue(self.is_download())
+
+    def test_head_and_not_modified(self):
+        self.assertFalse(self.is_download(method="head"))
+        etag = serve_file(self.factory.get("/"), self.path, "application/zip")["ETag"]
+        self.assertFalse(self.is_download(HTTP_IF_NONE_MATCH=etag))
+
+    def test_only_first_range_counts(self):
+        self.assertTrue(self.is_download(HTTP_RANGE="bytes=0-499"))
+        self.assertFalse(self.is_download(HTTP_RANGE="bytes=500-"))
+        self.assertFalse(self.is_download(HTTP_RANGE="bytes=-100"))
+        self.assertFalse(self.is_download(HTTP_RANGE="bytes=5000-"))
+
+    def test_only_first_range_counts_with_sendfile(self):
+        for sendfile in ["x-accel-redirect", "x-sendfile"]:
+            self.assertTrue(self.is_download(sendfile=sendfile))
+            self.assertTrue(self.is_download(sendfile=sendfile, HTTP_RANGE="bytes=0-499"))
+            self.assertFalse(self.is_download(sendfile=sendfile, HTTP_RANGE="bytes=500-"))
+
+
+class DownloadStatsTests(TestCase):
+
+    def setUp(self):
+        DownloadRollup.add_downloads({(datetime.date(2015, 1, 2), DownloadRollup.KIND_SUBTITLE, "pt", "", ""): 3})
+
+    def get_stats(self):
+        return self.client.get(reverse("download_stats"), {"kind": DownloadRollup.KIND_SUBTITLE})
+
+    def test_superuser(self):
+        User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.login(username="admin", password="password")
+        response = self.get_stats()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["downloads"], [{"date": "2015-01-02", "downloads": 3}])
+
+    def test_other_users_are_denied(self):
+        User.objects.create_user("user", "user@example.com", "password")
+        self.client.login(username="user", password="password")
+        # PermissionDenied is turned into a redirect to the login page
+        response = self.get_stats()
+        self.assertNotEqual(response.status_code, 200)
+        self.assertNotIn("downloads", response.content)
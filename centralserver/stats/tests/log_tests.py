@@ -0,0 +1,114 @@
+"""
+Tests of the stats log writer
+"""
+import logging
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.test import TestCase
+
+from .. import BatchFileHandler, StatsLogWriter, _get_writer, flush_stats_logs
+
+
+def make_record(loggername, message):
+    return logging.getLogger(loggername).makeRecord(loggername, logging.INFO, __file__, 0, message, (), None)
+
+
+class StatsLogTestCase(TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.dirpath_patch = patch("centralserver.stats.STATS_LOG_DIRPATH", self.log_dir)
+        self.dirpath_patch.start()
+
+    def tearDown(self):
+        self.dirpath_patch.stop()
+        shutil.rmtree(self.log_dir)
+
+    def read_lines(self, filename):
+        with open(os.path.join(self.log_dir, filename), "rb") as f:
+            return [line.split(" - ", 1)[1] for line in f.read().splitlines()]
+
+
+class BatchFileHandlerTests(StatsLogTestCase):
+
+    def test_batch_is_written_at_once(self):
+        handler = BatchFileHandler(os.path.join(self.log_dir, "test.log"))
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+        for n in range(3):
+            handler.handle(make_record("test", "vd;127.0.0.1;video%d" % n))
+
+        with patch("centralserver.stats.os.write", wraps=os.write) as write:
+            handler.flush_buffer()
+        self.assertEqual(write.call_count, 1)
+        handler.close()
+
+        self.assertEqual(self.read_lines("test.log"), ["vd;127.0.0.1;video0", "vd;127.0.0.1;video1", "vd;127.0.0.1;video2"])
+
+    def test_unicode_messages(self):
+        handler = BatchFileHandler(os.path.join(self.log_dir, "test.log"))
+        handler.handle(make_record("test", u"sd;127.0.0.1;pt-BR;v\u00eddeo"))
+        handler.close()
+
+        with open(os.path.join(self.log_dir, "test.log"), "rb") as f:
+            self.assertEqual(f.read().decode("utf-8"), u"sd;127.0.0.1;pt-BR;v\u00eddeo\n")
+
+    def test_rotation(self):
+        filename = os.path.join(self.log_dir, "test.log")
+        handler = BatchFileHandler(filename, max_bytes=10, backup_count=2)
+        for n in range(3):
+            handler.handle(make_record("test", "line%d" % n))
+            handler.flush_buffer()
+        handler.close()
+
+        self.assertEqual(open(filename).read(), "line2\n")
+        self.assertEqual(open(filename + ".1").read(), "line1\n")
+        self.assertEqual(open(filename + ".2").read(), "line0\n")
+
+
+class StatsLogWriterTests(StatsLogTestCase):
+
+    def test_records_are_written_to_the_file_of_their_logger(self):
+        writer = StatsLogWriter()
+        writer.put(make_record("kalite.videos", "vd;127.0.0.1;video1"))
+        writer.put(make_record("kalite.subtitles", "sd;127.0.0.1;es;video1"))
+        writer.put(make_record("kalite.videos", "vd;127.0.0.1;video2"))
+        writer.stop()
+
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(self.read_lines("kalite.videos.log"), ["vd;127.0.0.1;video1", "vd;127.0.0.1;video2"])
+        self.assertEqual(self.read_lines("kalite.subtitles.log"), ["sd;127.0.0.1;es;video1"])
+
+    @patch("centralserver.stats.STATS_LOG_FLUSH_INTERVAL", 10)
+    def test_records_queued_together_are_written_in_one_batch(self):
+        with patch("centralserver.stats.os.write", wraps=os.write) as write:
+            writer = StatsLogWriter()
+            for n in range(10):
+                writer.put(make_record("kalite.videos", "vd;127.0.0.1;video%d" % n))
+            writer.stop()
+        self.assertEqual(write.call_count, 1)
+        self.assertEqual(len(self.read_lines("kalite.videos.log")), 10)
+
+    @patch("centralserver.stats.STATS_LOG_QUEUE_SIZE", 1)
+    def test_records_are_dropped_when_the_queue_is_full(self):
+        # Without its thread running, the writer never empties the queue
+        with patch("centralserver.stats.threading.Thread.start"):
+            writer = StatsLogWriter()
+        writer.put(make_record("kalite.videos", "vd;127.0.0.1;queued"))
+        writer.put(make_record("kalite.videos", "vd;127.0.0.1;dropped"))
+        self.assertEqual(writer.queue.qsize(), 1)
+        self.assertEqual(writer.dropped, 1)
+
+    def test_queued_records_are_written_at_exit(self):
+        writer = _get_writer()
+        writer.put(make_record("kalite.language_packs", "lpd;127.0.0.1;es;0.17"))
+        flush_stats_logs()
+
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(self.read_lines("kalite.language_packs.log"), ["lpd;127.0.0.1;es;0.17"])
+        # The next record starts a new writer
+        self.assertNotEqual(_get_writer(), writer)
+        flush_stats_logs()
@@ -0,0 +1,119 @@
+"""
+Tests of the download rollups read from the stats logs
+"""
+import datetime
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.test import TestCase
+
+from ..models import DownloadRollup
+from ..rollups import parse_line, rollup_log
+
+
+class ParseLineTests(TestCase):
+
+    def test_video_download(self):
+        self.assertEqual(
+            parse_line("2016-01-02 12:00:00,000 - vd;127.0.0.1;abc123\n"),
+            (datetime.date(2016, 1, 2), DownloadRollup.KIND_VIDEO, "", "", "abc123"),
+        )
+
+    def test_language_pack_download(self):
+        self.assertEqual(
+            parse_line("2016-01-02 12:00:00,000 - lpd;127.0.0.1;pt-BR;0.17\n"),
+            (datetime.date(2016, 1, 2), DownloadRollup.KIND_LANGUAGE_PACK, "pt-BR", "0.17", ""),
+        )
+
+    def test_subtitle_download(self):
+        self.assertEqual(
+            parse_line("2016-01-02 12:00:00,000 - sd;127.0.0.1;es;abc123\n"),
+            (datetime.date(2016, 1, 2), DownloadRollup.KIND_SUBTITLE, "es", "", ""),
+        )
+
+    def test_other_lines_are_ignored(self):
+        self.assertEqual(parse_line("2016-01-02 12:00:00,000 - vd;127.0.0.1\n"), None)
+        self.assertEqual(parse_line("2016-01-02 12:00:00,000 - xd;127.0.0.1;abc123\n"), None)
+        self.assertEqual(parse_line("not a date - vd;127.0.0.1;abc123\n"), None)
+        self.assertEqual(parse_line("\n"), None)
+
+
+class RollupLogTests(TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.dirpath_patch = patch("centralserver.stats.rollups.STATS_LOG_DIRPATH", self.log_dir)
+        self.dirpath_patch.start()
+        self.path = os.path.join(self.log_dir, "kalite.videos.log")
+
+    def tearDown(self):
+        self.dirpath_patch.stop()
+        shutil.rmtree(self.log_dir)
+
+    def log_downloads(self, youtube_ids, path=None, end="\n"):
+        with open(path or self.path, "ab") as f:
+            for youtube_id in youtube_ids:
+                f.write("2016-01-02 12:00:00,000 - vd;127.0.0.1;%s%s" % (youtube_id, end))
+
+    def get_downloads(self):
+        return dict(
+            (row["content_id"], row["downloads"])
+            for row in DownloadRollup.get_downloads(DownloadRollup.KIND_VIDEO, group_by=("content_id",))
+        )
+
+    def test_reading_resumes_at_the_offset(self):
+        self.log_downloads(["a", "b"])
+        self.assertEqual(rollup_log("kalite.videos.log"), 2)
+        self.log_downloads(["a"])
+        self.assertEqual(rollup_log("kalite.videos.log"), 1)
+        self.assertEqual(rollup_log("kalite.videos.log"), 0)
+
+        self.assertEqual(self.get_downloads(), {"a": 2, "b": 1})
+
+    def test_incomplete_line_is_read_once_complete(self):
+        self.log_downloads(["a"])
+        self.log_downloads(["b"], end="")
+        self.assertEqual(rollup_log("kalite.videos.log"), 1)
+        with open(self.path, "ab") as f:
+            f.write("\n")
+        self.assertEqual(rollup_log("kalite.videos.log"), 1)
+
+        self.assertEqual(self.get_downloads(), {"a": 1, "b": 1})
+
+    def test_rest_of_renamed_log_is_read(self):
+        self.log_downloads(["a"])
+        rollup_log("kalite.videos.log")
+        self.log_downloads(["b"])
+        os.rename(self.path, self.path + ".1")
+        self.log_downloads(["c"])
+
+        self.assertEqual(rollup_log("kalite.videos.log"), 2)
+        self.assertEqual(self.get_downloads(), {"a": 1, "b": 1, "c": 1})
+
+    def copytruncate(self):
+        shutil.copyfile(self.path, self.path + ".1")
+        open(self.path, "r+b").truncate()
+
+    def test_rest_of_copied_log_is_read_after_truncation(self):
+        self.log_downloads(["a", "a"])
+        rollup_log("kalite.videos.log")
+        self.log_downloads(["b"])
+        self.copytruncate()
+        self.log_downloads(["c"])
+
+        self.assertEqual(rollup_log("kalite.videos.log"), 2)
+        self.assertEqual(self.get_downloads(), {"a": 2, "b": 1, "c": 1})
+
+    def test_truncated_log_grown_past_the_offset(self):
+        self.log_downloads(["a"])
+        rollup_log("kalite.videos.log")
+        self.log_downloads(["b"])
+        self.copytruncate()
+        # Same inode, and larger than when last read
+        self.log_downloads(["c"] * 5)
+
+        self.assertEqual(rollup_log("kalite.videos.log"), 6)
+        self.assertEqual(self.get_downloads(), {"a": 1, "b": 1, "c": 5})